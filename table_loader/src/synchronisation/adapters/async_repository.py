@@ -0,0 +1,137 @@
+import abc
+import asyncio
+import concurrent.futures
+import functools
+import typing
+
+from synchronisation.adapters import repository
+
+# calls in flight at once per unit of work, they're mostly waiting on the network
+MAX_IN_FLIGHT = 64
+
+
+class AbstractAsyncGridRepository(abc.ABC):
+    @abc.abstractmethod
+    async def add(self, *args):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get(self, *args):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list(self, *args):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def remove(self, *args):
+        raise NotImplementedError
+
+
+class OffloadedGridRepository(AbstractAsyncGridRepository):
+    """
+    Awaits the blocking calls of a repository on a thread pool, with at most max_in_flight of
+    them running at once. Every other method of the repository, e.g. get_state, is awaitable
+    the same way.
+    """
+
+    def __init__(
+        self,
+        grid_repository: repository.AbstractGridRepository,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        self.repository = grid_repository
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.semaphores: typing.Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # a semaphore belongs to the loop it was first awaited in
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return self.semaphores[loop]
+
+    async def run(self, method: str, *args, **kwargs):
+        call = functools.partial(getattr(self.repository, method), *args, **kwargs)
+        async with self.get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def map(
+        self, method: str, calls: typing.Iterable[typing.Tuple]
+    ) -> typing.List[typing.Any]:
+        """
+        Overlaps the calls of a method, e.g. uploads of many grids
+        :param calls: the positional arguments of every call
+        :return: the result, or the exception, of every call in order
+        """
+        return await asyncio.gather(
+            *(self.run(method, *args) for args in calls), return_exceptions=True
+        )
+
+    async def add(self, *args, **kwargs):
+        return await self.run("add", *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self.run("get", *args, **kwargs)
+
+    async def list(self, *args, **kwargs):
+        return await self.run("list", *args, **kwargs)
+
+    async def remove(self, *args, **kwargs):
+        return await self.run("remove", *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        if name == "repository":
+            # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        value = getattr(self.repository, name)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        async def offloaded(*args, **kwargs):
+            return await self.run(name, *args, **kwargs)
+
+        return offloaded
+
+
+class AsyncFilesystemGridRepository(OffloadedGridRepository):
+    def __init__(
+        self,
+        root: typing.Optional[str] = None,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        super().__init__(
+            repository.FilesystemGridRepository(root=root), executor, max_in_flight
+        )
+
+
+class AsyncGoogleCloudStorageGridRepository(OffloadedGridRepository):
+    def __init__(
+        self,
+        bucket_name: str,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        super().__init__(
+            repository.GoogleCloudStorageGridRepository(bucket_name=bucket_name),
+            executor,
+            max_in_flight,
+        )
+
+
+class AsyncBigqueryGridRepository(OffloadedGridRepository):
+    def __init__(
+        self,
+        billing_project: str,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ):
+        super().__init__(
+            repository.BigqueryGridRepository(billing_project=billing_project),
+            executor,
+            max_in_flight,
+        )
@@ -0,0 +1,115 @@
+import base64
+import dataclasses
+import hashlib
+import simplejson as json
+import struct
+import typing
+from crcmod import crcmod
+
+# payloads are cut at row boundaries into chunks of about AVERAGE_CHUNK_SIZE bytes
+MIN_CHUNK_SIZE = 16 * 1024 * 1024
+AVERAGE_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class Chunk:
+    offset: int
+    size: int
+    rows: int
+    # content address of the chunk
+    digest: str
+    crc32c: str
+
+
+def is_boundary(row: bytes, probability_scale: int) -> bool:
+    """
+    The decision only depends on the content of the row, so inserting or removing rows only moves
+    the boundaries around the edit and the chunks elsewhere keep their content address.
+    The odds of cutting after a row grow with its length, which keeps the average chunk size
+    independent of the row size.
+    """
+    row_hash = int.from_bytes(hashlib.blake2b(row, digest_size=8).digest(), "big")
+    return row_hash < len(row) * probability_scale
+
+
+def split_chunks(
+    file_name: str,
+    min_size: int = MIN_CHUNK_SIZE,
+    average_size: int = AVERAGE_CHUNK_SIZE,
+    max_size: int = MAX_CHUNK_SIZE,
+) -> typing.List[Chunk]:
+    """
+    Streams a .jsonl file once and finds its content defined chunks without writing anything
+    :return: the chunks in file order
+    """
+    probability_scale = 2**64 // max(average_size - min_size, 1)
+    chunks: typing.List[Chunk] = []
+    offset = 0
+    size = 0
+    rows = 0
+    digest = hashlib.blake2b(digest_size=16)
+    crc32c = crcmod.predefined.Crc("crc-32c")
+
+    def cut():
+        chunks.append(
+            Chunk(
+                offset=offset,
+                size=size,
+                rows=rows,
+                digest=digest.hexdigest(),
+                crc32c=base64.b64encode(struct.pack(">I", crc32c.crcValue)).decode(
+                    "utf-8"
+                ),
+            )
+        )
+
+    with open(file_name, "rb") as f:
+        for row in f:
+            digest.update(row)
+            crc32c.update(row)
+            size += len(row)
+            rows += 1
+            if size >= max_size or (
+                size >= min_size and is_boundary(row, probability_scale)
+            ):
+                cut()
+                offset += size
+                size = 0
+                rows = 0
+                digest = hashlib.blake2b(digest_size=16)
+                crc32c = crcmod.predefined.Crc("crc-32c")
+    if size:
+        cut()
+    return chunks
+
+
+def write_chunk(source_file: str, chunk: Chunk, target_file: str, buffer_size=1 << 20):
+    with open(source_file, "rb") as source, open(target_file, "wb") as target:
+        source.seek(chunk.offset)
+        remaining = chunk.size
+        while remaining:
+            data = source.read(min(buffer_size, remaining))
+            target.write(data)
+            remaining -= len(data)
+
+
+def write_manifest(
+    chunks: typing.List[Chunk], payload_hash: str, rows: int, file_name: str
+):
+    with open(file_name, "w") as f:
+        json.dump(
+            {
+                "payload_hash": payload_hash,
+                "rows": rows,
+                "chunks": [dataclasses.asdict(chunk) for chunk in chunks],
+            },
+            f,
+        )
+
+
+def read_manifest(file_name: str) -> typing.Dict:
+    with open(file_name, "r") as f:
+        manifest = json.load(f)
+    manifest["chunks"] = [Chunk(**chunk) for chunk in manifest["chunks"]]
+    return manifest
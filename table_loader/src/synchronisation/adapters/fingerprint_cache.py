@@ -0,0 +1,146 @@
+import dataclasses
+import logging
+import os
+import sqlite3
+import threading
+import typing
+
+logger = logging.getLogger()
+
+# lives next to the projects/ directory
+DEFAULT_CACHE_FILE = ".table_loader_cache.sqlite"
+
+
+@dataclasses.dataclass(frozen=True)
+class Fingerprint:
+    crc32c: typing.Optional[str] = None
+    rows: typing.Optional[int] = None
+    schema: typing.Optional[str] = None
+    schema_digest: typing.Optional[str] = None
+    # the query of a view and its normalised fingerprint
+    query: typing.Optional[str] = None
+    query_fingerprint: typing.Optional[str] = None
+    # the options of its create statement, as json
+    view_options: typing.Optional[str] = None
+
+
+# columns added since the cache was introduced, added to existing cache files
+ADDED_COLUMNS = {
+    "query": "text",
+    "query_fingerprint": "text",
+    "schema_digest": "text",
+    "view_options": "text",
+}
+
+
+def stat_key(file_name: str) -> typing.Tuple[int, int, int]:
+    """
+    The cheapest possible way of telling whether a file has changed since it was last hashed
+    :param file_name:
+    :return: size, modification time in nanoseconds and inode
+    """
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class FingerprintCache:
+    """
+    Persists the crc32c, row count and schema of every file under projects/, and the parsed query
+    of every view, so unchanged files only cost a stat call on subsequent runs.
+    Entries are keyed on the absolute path and are invalidated as soon as the size, modification
+    time or inode of the file changes.
+    """
+
+    def __init__(self, cache_file: str = DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute("""
+            create table if not exists fingerprints (
+                path text primary key,
+                size integer not null,
+                mtime_ns integer not null,
+                inode integer not null,
+                crc32c text,
+                rows integer,
+                schema text,
+                query text,
+                query_fingerprint text,
+                schema_digest text,
+                view_options text
+            )
+            """)
+        columns = {
+            row[1] for row in self.connection.execute("pragma table_info(fingerprints)")
+        }
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                self.connection.execute(
+                    f"alter table fingerprints add column {column} {column_type}"
+                )
+
+    def get(self, file_name: str) -> typing.Optional[Fingerprint]:
+        path = os.path.abspath(file_name)
+        with self.lock:
+            row = self.connection.execute(
+                "select size, mtime_ns, inode, crc32c, rows, schema, query, "
+                "query_fingerprint, schema_digest, view_options "
+                "from fingerprints where path = ?",
+                (path,),
+            ).fetchone()
+        if row is None or tuple(row[:3]) != stat_key(path):
+            return None
+        return Fingerprint(
+            crc32c=row[3],
+            rows=row[4],
+            schema=row[5],
+            query=row[6],
+            query_fingerprint=row[7],
+            schema_digest=row[8],
+            view_options=row[9],
+        )
+
+    def set(
+        self,
+        file_name: str,
+        fingerprint: Fingerprint,
+        key: typing.Optional[typing.Tuple[int, int, int]] = None,
+    ):
+        """
+        :param file_name:
+        :param fingerprint:
+        :param key: stat key taken before hashing, so a file modified mid-hash is not cached as unchanged
+        """
+        path = os.path.abspath(file_name)
+        size, mtime_ns, inode = key or stat_key(path)
+        with self.lock:
+            self.connection.execute(
+                "insert or replace into fingerprints "
+                "(path, size, mtime_ns, inode, crc32c, rows, schema, query, "
+                "query_fingerprint, schema_digest, view_options) "
+                "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    size,
+                    mtime_ns,
+                    inode,
+                    fingerprint.crc32c,
+                    fingerprint.rows,
+                    fingerprint.schema,
+                    fingerprint.query,
+                    fingerprint.query_fingerprint,
+                    fingerprint.schema_digest,
+                    fingerprint.view_options,
+                ),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
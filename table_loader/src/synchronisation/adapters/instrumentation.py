@@ -0,0 +1,215 @@
+import collections
+import contextlib
+import functools
+import os
+import simplejson as json
+import threading
+import time
+import typing
+
+# the calls that reach the storage and BigQuery APIs, per object the clients hand out
+STORAGE_CALLS = frozenset(
+    {
+        "list_blobs",
+        "batch",
+        "upload_from_filename",
+        "download_to_filename",
+        "download_as_bytes",
+        "delete",
+        "copy_blob",
+    }
+)
+BIGQUERY_CALLS = frozenset(
+    {
+        "create_table",
+        "get_table",
+        "update_table",
+        "list_tables",
+        "delete_table",
+        "load_table_from_uri",
+        "copy_table",
+        "query",
+        "get_dataset",
+        "create_dataset",
+    }
+)
+# local calls that return objects whose methods reach the API
+HANDED_OUT = frozenset({"bucket", "blob"})
+
+UNATTRIBUTED = "unattributed"
+PROMETHEUS_PREFIX = "table_loader"
+
+
+class Metrics:
+    """
+    Stage durations, byte counters and API calls of a run, shared by all of its threads.
+    Stages are timed per dataset, so their seconds add up across datasets synchronised at the
+    same time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stage_seconds: typing.Dict[str, float] = collections.Counter()
+            self.stage_runs: typing.Dict[str, int] = collections.Counter()
+            self.bytes: typing.Dict[str, int] = collections.Counter()
+            self.method_seconds: typing.Dict[str, float] = collections.Counter()
+            self.method_runs: typing.Dict[str, int] = collections.Counter()
+            self.api_calls: typing.Dict[typing.Tuple[str, str], int] = (
+                collections.Counter()
+            )
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stage_seconds[name] += seconds
+                self.stage_runs[name] += 1
+
+    def add_bytes(self, kind: str, size: int):
+        with self.lock:
+            self.bytes[kind] += size
+
+    @contextlib.contextmanager
+    def method(self, name: str):
+        """
+        Attributes the API calls made until the method returns to it, per thread
+        """
+        methods = self.local.__dict__.setdefault("methods", [])
+        methods.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            methods.pop()
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.method_seconds[name] += seconds
+                self.method_runs[name] += 1
+
+    def count_call(self, call: str):
+        methods = getattr(self.local, "methods", None)
+        method = methods[-1] if methods else UNATTRIBUTED
+        with self.lock:
+            self.api_calls[method, call] += 1
+
+    def report(self) -> typing.Dict:
+        with self.lock:
+            api_calls: typing.Dict[str, typing.Dict[str, int]] = {}
+            for (method, call), count in sorted(self.api_calls.items()):
+                api_calls.setdefault(method, {})[call] = count
+            return {
+                "seconds": round(time.time() - self.started, 4),
+                "stages": {
+                    name: {
+                        "seconds": round(self.stage_seconds[name], 4),
+                        "runs": self.stage_runs[name],
+                    }
+                    for name in sorted(self.stage_runs)
+                },
+                "bytes": dict(sorted(self.bytes.items())),
+                "methods": {
+                    name: {
+                        "seconds": round(self.method_seconds[name], 4),
+                        "runs": self.method_runs[name],
+                    }
+                    for name in sorted(self.method_runs)
+                },
+                "api_calls": api_calls,
+            }
+
+    def write_report(self, file_name: str):
+        write_atomically(file_name, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, file_name: str):
+        """
+        Writes the report in the text format of the node exporter's textfile collector
+        """
+        report = self.report()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_run_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_seconds {report['seconds']}",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge",
+        ]
+        for name, stage in report["stages"].items():
+            lines.append(
+                f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{name}"}} {stage["seconds"]}'
+            )
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_bytes gauge")
+        for kind, size in report["bytes"].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_bytes{{kind="{kind}"}} {size}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_api_calls gauge")
+        for method, calls in report["api_calls"].items():
+            for call, count in calls.items():
+                lines.append(
+                    f"{PROMETHEUS_PREFIX}_api_calls"
+                    f'{{method="{method}",call="{call}"}} {count}'
+                )
+        write_atomically(file_name, "\n".join(lines) + "\n")
+
+
+def write_atomically(file_name: str, content: str):
+    # scrapers never see a half written file
+    staging_file = f"{file_name}.{os.getpid()}.tmp"
+    with open(staging_file, "w") as f:
+        f.write(content)
+    os.replace(staging_file, file_name)
+
+
+# the metrics of the current run, like the root logger there's one per process
+METRICS = Metrics()
+
+
+def instrumented(method: typing.Callable) -> typing.Callable:
+    """
+    Times a repository method and attributes the API calls it makes to it
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with METRICS.method(f"{type(self).__name__}.{method.__name__}"):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class CountedClient:
+    """
+    Proxy of an API client, or of a bucket or blob it handed out, that counts the API calls
+    """
+
+    def __init__(self, target, calls: typing.FrozenSet[str]):
+        object.__setattr__(self, "target", target)
+        object.__setattr__(self, "calls", calls)
+
+    def __getattr__(self, name: str):
+        value = getattr(self.target, name)
+        if name in HANDED_OUT:
+
+            @functools.wraps(value)
+            def hand_out(*args, **kwargs):
+                return CountedClient(value(*args, **kwargs), self.calls)
+
+            return hand_out
+
+        if name in self.calls:
+
+            @functools.wraps(value)
+            def call(*args, **kwargs):
+                METRICS.count_call(name)
+                return value(*args, **kwargs)
+
+            return call
+        return value
+
+    def __setattr__(self, name: str, value):
+        setattr(self.target, name, value)
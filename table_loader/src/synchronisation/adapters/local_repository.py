@@ -0,0 +1,574 @@
+import concurrent.futures
+import contextlib
+import dataclasses
+import os
+import pathlib
+import random
+import re
+import shutil
+import simplejson as json
+import threading
+import time
+import typing
+from google.api_core import exceptions
+from google.cloud import bigquery
+from synchronisation.adapters import repository, repository_loader, row_delta
+
+# load jobs and queries run in the background like they do on BigQuery
+JOB_WORKERS = 32
+
+MERGE_STATEMENT = re.compile(
+    r"merge `(?P<target>[^`]+)` T using `(?P<source>[^`]+)` S on (?P<on>.+?) when",
+    re.IGNORECASE,
+)
+MERGE_KEY = re.compile(r"T\.`(?P<field>[^`]+)`")
+
+
+@dataclasses.dataclass
+class Faults:
+    """
+    Latency and failures injected into every call of a local client, to benchmark and load test
+    the synchronisation offline under realistic conditions
+    """
+
+    # seconds added to every call
+    latency: float = 0.0
+    # odds of a call failing with a retryable 503
+    failure_rate: float = 0.0
+    seed: typing.Optional[int] = None
+    generator: random.Random = dataclasses.field(init=False, repr=False)
+    lock: threading.Lock = dataclasses.field(
+        init=False, repr=False, default_factory=threading.Lock
+    )
+
+    def __post_init__(self):
+        self.generator = random.Random(self.seed)
+
+    def inject(self, call: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate:
+            with self.lock:
+                failed = self.generator.random() < self.failure_rate
+            if failed:
+                raise exceptions.ServiceUnavailable(f"Injected failure of {call}")
+
+
+def now_millis() -> str:
+    return str(int(time.time() * 1000))
+
+
+class LocalBlob:
+    def __init__(self, client: "LocalStorageClient", bucket_name: str, name: str):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.name = name
+        self.path = client.object_path(bucket_name, name)
+        self.pending_metadata: typing.Optional[typing.Dict[str, str]] = None
+        self.properties: typing.Optional[typing.Dict] = None
+
+    def load_properties(self) -> typing.Dict:
+        if self.properties is None:
+            try:
+                with open(
+                    self.client.properties_path(self.bucket_name, self.name)
+                ) as f:
+                    self.properties = json.load(f)
+            except FileNotFoundError:
+                raise exceptions.NotFound(f"{self.bucket_name}/{self.name} not found")
+        return self.properties
+
+    @property
+    def crc32c(self) -> str:
+        return self.load_properties()["crc32c"]
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    @property
+    def generation(self) -> int:
+        return os.stat(self.path).st_mtime_ns
+
+    @property
+    def metadata(self) -> typing.Optional[typing.Dict[str, str]]:
+        if self.pending_metadata is not None:
+            return self.pending_metadata
+        return self.load_properties().get("metadata")
+
+    @metadata.setter
+    def metadata(self, metadata: typing.Dict[str, str]):
+        self.pending_metadata = metadata
+
+    def upload_from_filename(self, filename: str):
+        self.client.faults.inject("upload_from_filename")
+        self.write(filename)
+
+    def write(self, filename: str):
+        crc32c, _ = repository_loader.make_file_crc32c(filename)
+        properties_path = self.client.properties_path(self.bucket_name, self.name)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        properties_path.parent.mkdir(parents=True, exist_ok=True)
+        # objects are replaced atomically, a reader never sees half an upload
+        staging_path = self.path.with_name(f".{self.path.name}.{threading.get_ident()}")
+        shutil.copyfile(filename, staging_path)
+        os.replace(staging_path, self.path)
+        self.properties = {"crc32c": crc32c, "metadata": self.pending_metadata}
+        with open(properties_path, "w") as f:
+            json.dump(self.properties, f)
+        self.pending_metadata = None
+
+    def download_to_filename(self, filename: str):
+        self.client.faults.inject("download_to_filename")
+        try:
+            shutil.copyfile(self.path, filename)
+        except FileNotFoundError:
+            raise exceptions.NotFound(f"{self.bucket_name}/{self.name} not found")
+
+    def download_as_bytes(
+        self, start: typing.Optional[int] = None, end: typing.Optional[int] = None
+    ) -> bytes:
+        """
+        :param start: first byte of a ranged download
+        :param end: last byte of a ranged download, inclusive like the Range header
+        """
+        self.client.faults.inject("download_as_bytes")
+        try:
+            with open(self.path, "rb") as f:
+                if start is None:
+                    return f.read()
+                if start and start >= os.fstat(f.fileno()).st_size:
+                    raise exceptions.RequestRangeNotSatisfiable(
+                        f"{self.bucket_name}/{self.name} has no byte {start}"
+                    )
+                f.seek(start)
+                return f.read() if end is None else f.read(end - start + 1)
+        except FileNotFoundError:
+            raise exceptions.NotFound(f"{self.bucket_name}/{self.name} not found")
+
+    def delete(self):
+        # the calls of a batch are sent as a single request
+        if not self.client.is_batching():
+            self.client.faults.inject("delete")
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise exceptions.NotFound(f"{self.bucket_name}/{self.name} not found")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.client.properties_path(self.bucket_name, self.name))
+
+
+class LocalBucket:
+    def __init__(self, client: "LocalStorageClient", name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name: str) -> LocalBlob:
+        return LocalBlob(self.client, self.name, blob_name)
+
+    def copy_blob(
+        self, blob: LocalBlob, destination_bucket: "LocalBucket", new_name: str
+    ) -> LocalBlob:
+        self.client.faults.inject("copy_blob")
+        if not blob.path.exists():
+            raise exceptions.NotFound(f"{self.name}/{blob.name} not found")
+        copy = destination_bucket.blob(new_name)
+        copy.metadata = blob.metadata
+        copy.write(str(blob.path))
+        return copy
+
+
+class LocalStorageClient:
+    """
+    The part of storage.Client the bucket repository uses, backed by a directory.
+    Objects live under <root>/<bucket>/objects, their checksum and metadata under
+    <root>/<bucket>/properties.
+    """
+
+    def __init__(self, root: str, faults: typing.Optional[Faults] = None):
+        self.root = pathlib.Path(root)
+        self.faults = faults or Faults()
+        self.local = threading.local()
+
+    def object_path(self, bucket_name: str, blob_name: str) -> pathlib.Path:
+        return self.root.joinpath(bucket_name, "objects", *blob_name.split("/"))
+
+    def properties_path(self, bucket_name: str, blob_name: str) -> pathlib.Path:
+        return self.root.joinpath(
+            bucket_name, "properties", *f"{blob_name}.json".split("/")
+        )
+
+    def bucket(self, bucket_name: str) -> LocalBucket:
+        return LocalBucket(self, bucket_name)
+
+    def list_blobs(self, bucket_or_name, prefix: str = "") -> typing.List[LocalBlob]:
+        self.faults.inject("list_blobs")
+        bucket_name = getattr(bucket_or_name, "name", bucket_or_name)
+        objects = self.root.joinpath(bucket_name, "objects")
+        # only walk the directory the prefix points into
+        start = objects.joinpath(*prefix.split("/")[:-1])
+        names = []
+        for directory, _, files in os.walk(start):
+            relative = pathlib.Path(directory).relative_to(objects).as_posix()
+            for file in files:
+                if file.startswith("."):
+                    continue
+                name = file if relative == "." else f"{relative}/{file}"
+                if name.startswith(prefix):
+                    names.append(name)
+        return [LocalBlob(self, bucket_name, name) for name in sorted(names)]
+
+    def is_batching(self) -> bool:
+        return getattr(self.local, "batching", False)
+
+    @contextlib.contextmanager
+    def batch(self):
+        self.faults.inject("batch")
+        self.local.batching = True
+        try:
+            yield
+        finally:
+            self.local.batching = False
+
+
+class LocalJob:
+    def __init__(self, future: concurrent.futures.Future):
+        self.future = future
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+
+def to_table_id(table) -> str:
+    if isinstance(table, str):
+        return table
+    return f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+
+class LocalBigqueryClient:
+    """
+    The part of bigquery.Client the warehouse repository uses, backed by a directory.
+    Every table is a <root>/<project>/<dataset>/<table>.json resource and its rows a .jsonl file
+    next to it. Datasets exist implicitly and load jobs read their source uris from the local
+    bucket.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        storage: typing.Optional[LocalStorageClient] = None,
+        faults: typing.Optional[Faults] = None,
+    ):
+        self.root = pathlib.Path(root)
+        self.storage = storage
+        self.faults = faults or Faults()
+        self.lock = threading.RLock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_WORKERS)
+
+    def close(self):
+        """
+        Waits for the running jobs and shuts their threads down, like bigquery.Client.close
+        """
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def table_path(self, table_id: str) -> pathlib.Path:
+        return self.root.joinpath(*table_id.split(".")).with_suffix(".json")
+
+    def rows_path(self, table_id: str) -> pathlib.Path:
+        return self.table_path(table_id).with_suffix(".jsonl")
+
+    def read_table(self, table_id: str) -> typing.Dict:
+        try:
+            with open(self.table_path(table_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise exceptions.NotFound(f"Table {table_id} not found")
+
+    def write_table(self, table_id: str, properties: typing.Dict):
+        properties["lastModifiedTime"] = now_millis()
+        path = self.table_path(table_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(properties, f)
+
+    def create_table(self, table: bigquery.Table) -> bigquery.Table:
+        self.faults.inject("create_table")
+        table_id = to_table_id(table)
+        properties = table.to_api_repr()
+        if "view" in properties:
+            properties["type"] = "VIEW"
+        elif "materializedView" in properties:
+            properties["type"] = "MATERIALIZED_VIEW"
+        else:
+            properties["type"] = "TABLE"
+        if properties["type"] != "TABLE":
+            self.check_references(table_id, properties)
+        properties["numRows"] = "0"
+        properties["creationTime"] = now_millis()
+        with self.lock:
+            if self.table_path(table_id).exists():
+                raise exceptions.Conflict(f"Already Exists: Table {table_id}")
+            self.write_table(table_id, properties)
+            self.rows_path(table_id).write_bytes(b"")
+        return bigquery.Table.from_api_repr(properties)
+
+    def check_references(self, table_id: str, properties: typing.Dict):
+        """
+        Like bigquery, a view can't be created before the grids it reads from
+        """
+        query = (properties.get("view") or properties["materializedView"])["query"]
+        for reference in repository_loader.get_references(
+            query, table_id.partition(".")[0]
+        ):
+            if not self.table_path(reference).exists():
+                raise exceptions.NotFound(f"Not found: Table {reference}")
+
+    def get_table(self, table) -> bigquery.Table:
+        self.faults.inject("get_table")
+        return bigquery.Table.from_api_repr(self.read_table(to_table_id(table)))
+
+    def update_table(self, table: bigquery.Table, fields: typing.List[str]):
+        self.faults.inject("update_table")
+        table_id = to_table_id(table)
+        patch = table.to_api_repr()
+        with self.lock:
+            properties = self.read_table(table_id)
+            for field in fields:
+                if field == "labels":
+                    labels = {**properties.get("labels", {}), **patch["labels"]}
+                    properties["labels"] = {
+                        label: value
+                        for label, value in labels.items()
+                        if value is not None
+                    }
+                else:
+                    properties[field] = patch.get(field)
+            self.write_table(table_id, properties)
+        return bigquery.Table.from_api_repr(properties)
+
+    def list_tables(self, dataset) -> typing.List[bigquery.table.TableListItem]:
+        self.faults.inject("list_tables")
+        project, _, dataset_id = str(dataset).partition(".")
+        items = []
+        for path in sorted(self.root.joinpath(project, dataset_id).glob("*.json")):
+            with open(path) as f:
+                properties = json.load(f)
+            items.append(
+                bigquery.table.TableListItem(
+                    {
+                        "tableReference": properties["tableReference"],
+                        "type": properties["type"],
+                    }
+                )
+            )
+        return items
+
+    def delete_table(self, table, not_found_ok: bool = False):
+        self.faults.inject("delete_table")
+        table_id = to_table_id(table)
+        with self.lock:
+            try:
+                os.remove(self.table_path(table_id))
+            except FileNotFoundError:
+                if not not_found_ok:
+                    raise exceptions.NotFound(f"Table {table_id} not found")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.rows_path(table_id))
+
+    def get_dataset(self, dataset_ref) -> bigquery.Dataset:
+        self.faults.inject("get_dataset")
+        return bigquery.Dataset(str(dataset_ref))
+
+    def create_dataset(self, dataset, exists_ok: bool = False) -> bigquery.Dataset:
+        self.faults.inject("create_dataset")
+        dataset_path = self.root.joinpath(dataset.project, dataset.dataset_id)
+        if dataset_path.is_dir() and not exists_ok:
+            raise exceptions.Conflict(f"Already Exists: Dataset {dataset.dataset_id}")
+        dataset_path.mkdir(parents=True, exist_ok=True)
+        return dataset
+
+    def copy_table(
+        self, sources, destination, job_config: bigquery.CopyJobConfig
+    ) -> LocalJob:
+        self.faults.inject("copy_table")
+        return LocalJob(
+            self.executor.submit(
+                self.copy, to_table_id(sources), to_table_id(destination), job_config
+            )
+        )
+
+    def copy(self, source_id: str, table_id: str, job_config: bigquery.CopyJobConfig):
+        """
+        Overwrites or appends to the target, which keeps its own description and labels
+        """
+        self.faults.inject("copy job")
+        with self.lock:
+            source = self.read_table(source_id)
+            try:
+                properties = self.read_table(table_id)
+            except exceptions.NotFound:
+                properties = dict(source)
+                project, dataset_id, table_name = table_id.split(".")
+                properties["tableReference"] = {
+                    "projectId": project,
+                    "datasetId": dataset_id,
+                    "tableId": table_name,
+                }
+            truncate = job_config.write_disposition == (
+                bigquery.WriteDisposition.WRITE_TRUNCATE
+            )
+            rows = self.rows_path(source_id).read_bytes()
+            with open(self.rows_path(table_id), "wb" if truncate else "ab") as f:
+                f.write(rows)
+            properties["schema"] = source.get("schema")
+            previous_rows = 0 if truncate else int(properties.get("numRows") or 0)
+            properties["numRows"] = str(previous_rows + int(source["numRows"]))
+            self.write_table(table_id, properties)
+
+    def load_table_from_uri(
+        self, source_uris, destination, job_config: bigquery.LoadJobConfig
+    ) -> LocalJob:
+        self.faults.inject("load_table_from_uri")
+        if isinstance(source_uris, str):
+            source_uris = [source_uris]
+        return LocalJob(
+            self.executor.submit(
+                self.load, list(source_uris), to_table_id(destination), job_config
+            )
+        )
+
+    def load(
+        self,
+        source_uris: typing.List[str],
+        table_id: str,
+        job_config: bigquery.LoadJobConfig,
+    ):
+        self.faults.inject("load job")
+        if self.storage is None:
+            raise ValueError("Loading needs the local storage the uris point to")
+        truncate = job_config.write_disposition == (
+            bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        with self.lock:
+            try:
+                properties = self.read_table(table_id)
+            except exceptions.NotFound:
+                # load jobs create their destination, like the staging table of a merge
+                project, dataset_id, table_name = table_id.split(".")
+                properties = {
+                    "tableReference": {
+                        "projectId": project,
+                        "datasetId": dataset_id,
+                        "tableId": table_name,
+                    },
+                    "type": "TABLE",
+                    "creationTime": now_millis(),
+                }
+                truncate = True
+            if truncate and job_config.schema:
+                properties["schema"] = {
+                    "fields": [field.to_api_repr() for field in job_config.schema]
+                }
+
+            rows = 0 if truncate else int(properties.get("numRows") or 0)
+            with open(self.rows_path(table_id), "wb" if truncate else "ab") as target:
+                for source_uri in source_uris:
+                    bucket_name, _, blob_name = source_uri.replace(
+                        "gs://", "", 1
+                    ).partition("/")
+                    with open(
+                        self.storage.object_path(bucket_name, blob_name), "rb"
+                    ) as f:
+                        for row in f:
+                            if row.strip():
+                                target.write(row.rstrip(b"\n") + b"\n")
+                                rows += 1
+            properties["numRows"] = str(rows)
+            self.write_table(table_id, properties)
+
+    def query(self, query: str) -> LocalJob:
+        self.faults.inject("query")
+        match = MERGE_STATEMENT.match(query.strip())
+        if match is None:
+            raise exceptions.BadRequest("Only merge statements run locally")
+        key_fields = MERGE_KEY.findall(match.group("on"))
+        return LocalJob(
+            self.executor.submit(
+                self.merge, match.group("target"), match.group("source"), key_fields
+            )
+        )
+
+    def merge(self, target_id: str, source_id: str, key_fields: typing.List[str]):
+        """
+        Upserts the staged rows into the target by key and deletes the rows flagged as deleted
+        """
+        self.faults.inject("query job")
+        with self.lock:
+            properties = self.read_table(target_id)
+            rows = {}
+            for row in row_delta.iter_rows(str(self.rows_path(target_id))):
+                values = json.loads(row)
+                rows[tuple(values.get(field) for field in key_fields)] = values
+            for row in row_delta.iter_rows(str(self.rows_path(source_id))):
+                values = json.loads(row)
+                key = tuple(values.get(field) for field in key_fields)
+                if values.pop(row_delta.DELETED_COLUMN, None):
+                    rows.pop(key, None)
+                else:
+                    rows[key] = values
+            with open(self.rows_path(target_id), "w") as f:
+                for values in rows.values():
+                    f.write(f"{json.dumps(values)}\n")
+            properties["numRows"] = str(len(rows))
+            self.write_table(target_id, properties)
+
+
+class LocalBucketGridRepository(repository.GoogleCloudStorageGridRepository):
+    """
+    The last known state in a directory rather than a bucket
+    """
+
+    def __init__(
+        self, bucket_name: str, root: str, faults: typing.Optional[Faults] = None
+    ):
+        super().__init__(
+            bucket_name=bucket_name, client=LocalStorageClient(root, faults)
+        )
+
+
+class LocalWarehouseGridRepository(repository.BigqueryGridRepository):
+    """
+    The current state in a directory rather than BigQuery
+    :param storage: where the load jobs find their source uris, usually the client of the
+        LocalBucketGridRepository of the same unit of work
+    """
+
+    def __init__(
+        self,
+        billing_project: str,
+        root: str,
+        storage: typing.Optional[LocalStorageClient] = None,
+        faults: typing.Optional[Faults] = None,
+    ):
+        super().__init__(
+            billing_project=billing_project,
+            client=LocalBigqueryClient(root, storage=storage, faults=faults),
+        )
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,13 +1,167 @@
 # import inspect
+import collections
+import concurrent.futures
+import datetime
 import os
+import tempfile
+import threading
+import time
 import pathlib
+import functools
+import simplejson as json
 
 # from synchronisation.domain import model
 import typing
+from google.api_core import exceptions
 from google.cloud import bigquery, storage
+from synchronisation.adapters import (
+    chunking,
+    fingerprint_cache,
+    instrumentation,
+    repository_loader,
+    row_delta,
+)
 from synchronisation.domain import model
 import abc
 
+# uploads are latency bound, so a pool much larger than the number of cores is fine
+UPLOAD_WORKERS = 32
+# the storage JSON API accepts at most 100 calls per batch request
+DELETE_BATCH_SIZE = 100
+# content addressed payload chunks, outside of the dataset prefixes
+CHUNK_PREFIX = "_chunks"
+# payloads waiting for their load to succeed before they become the last known state
+UPLOAD_STAGING_PREFIX = "_staging"
+# tables are staged in a sibling dataset, so the dataset readers see is never cluttered
+STAGING_DATASET_SUFFIX = "_staging"
+# staging tables left behind by an interrupted run expire by themselves
+STAGING_EXPIRATION_MS = 24 * 60 * 60 * 1000
+# load jobs running at the same time per dataset and seconds between polls
+LOAD_JOBS_IN_FLIGHT = 20
+JOB_POLL_INTERVAL = 1.0
+# last known payloads are streamed in ranged downloads of this many bytes
+DOWNLOAD_RANGE_SIZE = 8 * 1024 * 1024
+
+
+# bigquery table_type -> grid class
+GRID_TYPES = {
+    "TABLE": model.Table,
+    "VIEW": model.View,
+    "MATERIALIZED_VIEW": model.MaterialisedView,
+}
+
+
+def table_to_grid(table: bigquery.Table) -> model.Grid:
+    grid = GRID_TYPES.get(table.table_type, model.Table)()
+    grid.grid_id = f"{table.project}.{table.dataset_id}.{table.table_id}"
+    grid.description = table.description or ""
+    grid.labels = dict(table.labels or {})
+    grid.modification_date = table.modified.isoformat() if table.modified else ""
+    grid.set_schema([field.to_api_repr() for field in table.schema])
+    if isinstance(grid, model.Table):
+        grid.rows = table.num_rows or 0
+    elif isinstance(grid, model.MaterialisedView):
+        grid.query = table.mview_query
+        grid.refresh_enabled = bool(table.mview_enable_refresh)
+        if table.mview_refresh_interval is not None:
+            grid.refresh_interval = int(
+                table.mview_refresh_interval.total_seconds() * 1000
+            )
+    else:
+        grid.query = table.view_query
+    if isinstance(grid, model.SqlMixin):
+        grid.query_fingerprint = repository_loader.make_query_fingerprint(grid.query)
+    return grid
+
+
+def to_bigquery_schema(schema):
+    """
+    Drops the properties that only mean something to table_loader, bigquery rejects them
+    """
+    if not schema or not isinstance(schema[0], dict):
+        return schema
+    return [
+        {
+            name: value
+            for name, value in field.items()
+            if name != row_delta.ROW_KEY_PROPERTY
+        }
+        for field in schema
+    ]
+
+
+def make_merge_statement(
+    grid_id: str,
+    staging_id: str,
+    schema: typing.List[typing.Dict],
+    key_fields: typing.List[str],
+) -> str:
+    columns = [f"`{field['name']}`" for field in schema]
+    on = " and ".join(f"T.`{field}` = S.`{field}`" for field in key_fields)
+    update = ", ".join(f"{column} = S.{column}" for column in columns)
+    deleted = f"S.`{row_delta.DELETED_COLUMN}`"
+    return (
+        f"merge `{grid_id}` T using `{staging_id}` S on {on} "
+        f"when matched and {deleted} then delete "
+        f"when matched then update set {update} "
+        f"when not matched and {deleted} is not true then "
+        f"insert ({', '.join(columns)}) "
+        f"values ({', '.join(f'S.{column}' for column in columns)})"
+    )
+
+
+def get_staging_id(grid_id: str) -> str:
+    """
+    project.dataset.table -> project.dataset_staging.table
+    """
+    dataset_id, _, table_id = grid_id.rpartition(".")
+    return f"{dataset_id}{STAGING_DATASET_SUFFIX}.{table_id}"
+
+
+class SwapJob:
+    """
+    Loads a staging table, then overwrites the target with a WRITE_TRUNCATE copy job.
+    The copy is a metadata operation, so readers see the old rows until the new ones replace them
+    at once, rather than a missing or empty table for the length of the load.
+    The staging table is dropped once the copy is done or either job failed.
+    """
+
+    def __init__(self, client, grid_id: str, staging_id: str, load_job):
+        self.client = client
+        self.grid_id = grid_id
+        self.staging_id = staging_id
+        self.load_job = load_job
+        self.copy_job = None
+
+    def start_copy(self):
+        job_config = bigquery.CopyJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        return self.client.copy_table(
+            sources=self.staging_id, destination=self.grid_id, job_config=job_config
+        )
+
+    def done(self) -> bool:
+        if self.copy_job is None:
+            if not self.load_job.done():
+                return False
+            try:
+                self.load_job.result()
+            except Exception:
+                # result raises it
+                return True
+            self.copy_job = self.start_copy()
+        return self.copy_job.done()
+
+    def result(self):
+        try:
+            self.load_job.result()
+            if self.copy_job is None:
+                self.copy_job = self.start_copy()
+            return self.copy_job.result()
+        finally:
+            self.client.delete_table(table=self.staging_id, not_found_ok=True)
+
 
 class AbstractGridRepository:
     @abc.abstractmethod
@@ -28,12 +182,17 @@ class AbstractGridRepository:
 
 
 class FilesystemGridRepository(AbstractGridRepository):
-    def __init__(self, root: pathlib.Path):
+    def __init__(
+        self,
+        root: pathlib.Path,
+        cache: typing.Optional[fingerprint_cache.FingerprintCache] = None,
+    ):
         # do we even need root here?
-        self.root = root
+        self.root = pathlib.Path(root)
+        self.cache = cache
 
     def grid_to_path_prefix(self, grid_id):
-        return self.root.joinpath(grid_id.split("."))
+        return self.root.joinpath(*grid_id.split("."))
 
     def add(self, grid: model.Grid):
         prefix = self.grid_to_path_prefix(grid.id)
@@ -70,18 +229,31 @@ class FilesystemGridRepository(AbstractGridRepository):
         required_mixins = set()
         for file in files:
             if file.endswith("jsonl"):
-                required_mixins.add(model.Content)
+                required_mixins.add(model.ContentMixin)
             if file.endswith("json"):
-                required_mixins.add(model.Schema)
-        for subclass in model.Grid.__subclasses__():
+                required_mixins.add(model.SchemaMixin)
+        for subclass in model.GRID_CLASSES:
             if set(subclass.__mro__).issuperset(required_mixins):
                 return subclass
         return ValueError(f"Unable to extract type from files {files}")
 
     def get(self, grid_id: str) -> model.Grid:
-        grid_files = self.matching_files_from_grid_id(grid_id)
+        grid_files = list(self.matching_files_from_grid_id(grid_id))
         cls = self.type_from_files(grid_files)
-        return cls()
+        grid = cls()
+        grid.grid_id = grid_id
+        for file in grid_files:
+            # only files whose stat metadata changed since the last run are hashed
+            if file.endswith(".jsonl"):
+                grid.payload_hash, grid.rows = (
+                    repository_loader.get_payload_fingerprint(file, self.cache)
+                )
+                grid.payload = repository_loader.get_payload(file)
+            elif file.endswith(".json"):
+                grid.set_schema(
+                    *repository_loader.get_schema_and_digest(file, self.cache)
+                )
+        return grid
 
     def list(self, dataset_path: pathlib.Path):
         return os.listdir(dataset_path)
@@ -90,40 +262,433 @@ class FilesystemGridRepository(AbstractGridRepository):
         os.remove(source_path)
 
 
+class BlobFingerprint(typing.NamedTuple):
+    crc32c: str
+    size: int
+    generation: int
+    # crc32c of the whole payload a chunk manifest describes
+    payload_hash: typing.Optional[str] = None
+
+
+def blob_name_to_grid_id(blob_name: str) -> str:
+    """
+    project/dataset/grid_name.jsonl -> project.dataset.grid_name
+    """
+    return ".".join(blob_name.partition(".")[0].split("/"))
+
+
 class GoogleCloudStorageGridRepository(AbstractGridRepository):
-    def __init__(self, bucket_name: str):
-        self.client = storage.Client()
+    def __init__(
+        self, bucket_name: str, client: typing.Optional[storage.Client] = None
+    ):
+        self.client = instrumentation.CountedClient(
+            client or storage.Client(), instrumentation.STORAGE_CALLS
+        )
         self.bucket_name = bucket_name
         self.bucket = self.client.bucket(bucket_name)
 
-    def add(self, source_path: str, target_url: str):
+    @instrumentation.instrumented
+    def add(
+        self,
+        source_path: str,
+        target_url: str,
+        metadata: typing.Optional[typing.Dict[str, str]] = None,
+    ):
         blob = self.bucket.blob(target_url)
+        if metadata:
+            blob.metadata = metadata
         blob.upload_from_filename(source_path)
+        instrumentation.METRICS.add_bytes("uploaded", os.path.getsize(source_path))
+
+    @instrumentation.instrumented
+    def copy(self, source_url: str, target_url: str):
+        """
+        Copies a blob within the bucket without downloading it, the copy keeps its crc32c
+        """
+        self.bucket.copy_blob(self.bucket.blob(source_url), self.bucket, target_url)
+
+    @staticmethod
+    def get_chunk_prefix(target_url: str) -> str:
+        return f"{CHUNK_PREFIX}/{os.path.dirname(target_url)}/"
+
+    def get_chunk_uris(
+        self, target_url: str, chunks: typing.Iterable[chunking.Chunk]
+    ) -> typing.List[str]:
+        chunk_prefix = self.get_chunk_prefix(target_url)
+        return [
+            f"gs://{self.bucket_name}/{chunk_prefix}{chunk.digest}.chunk"
+            for chunk in chunks
+        ]
+
+    @instrumentation.instrumented
+    def add_chunks(
+        self,
+        source_path: str,
+        target_url: str,
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.List[chunking.Chunk]:
+        """
+        Uploads a payload as content addressed chunks cut at row boundaries. Chunks already in the
+        bucket aren't uploaded again, so a small edit to a huge payload only transfers the chunks
+        around the edit.
+        Chunks live under _chunks/ so listing the dataset prefix doesn't page through them, they're
+        only part of the last known state once a manifest lists them.
+        :param source_path: .jsonl file
+        :param target_url: project/dataset/grid_name.manifest
+        :param max_workers:
+        :return: the chunks, in payload order
+        """
+        chunk_prefix = self.get_chunk_prefix(target_url)
+        chunks = chunking.split_chunks(source_path)
+        existing = self.index(chunk_prefix)
+
+        with tempfile.TemporaryDirectory() as directory:
+            uploads = {}
+            for chunk in chunks:
+                chunk_url = f"{chunk_prefix}{chunk.digest}.chunk"
+                if chunk_url in existing or chunk_url in uploads:
+                    continue
+                chunk_path = os.path.join(directory, f"{chunk.digest}.chunk")
+                chunking.write_chunk(source_path, chunk, chunk_path)
+                uploads[chunk_url] = chunk_path
+
+            results = self.add_many(
+                [(chunk_path, chunk_url) for chunk_url, chunk_path in uploads.items()],
+                max_workers=max_workers,
+            )
+            for error in results.values():
+                if error is not None:
+                    raise error
+        return chunks
+
+    @instrumentation.instrumented
+    def add_manifest(
+        self,
+        chunks: typing.List[chunking.Chunk],
+        target_url: str,
+        payload_hash: str,
+        rows: int,
+    ):
+        """
+        :param chunks: uploaded by add_chunks
+        :param target_url: project/dataset/grid_name.manifest
+        :param payload_hash: crc32c of the whole payload, kept on the manifest for get_state
+        :param rows:
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            manifest_path = os.path.join(directory, "manifest")
+            chunking.write_manifest(chunks, payload_hash, rows, manifest_path)
+            self.add(manifest_path, target_url, metadata={"payload_hash": payload_hash})
+
+    @instrumentation.instrumented
+    def add_chunked(
+        self,
+        source_path: str,
+        target_url: str,
+        payload_hash: str,
+        rows: int,
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.List[str]:
+        """
+        Uploads a payload as content addressed chunks plus a manifest listing them
+        :param source_path: .jsonl file
+        :param target_url: project/dataset/grid_name.manifest
+        :param payload_hash: crc32c of the whole payload, kept on the manifest for get_state
+        :param rows:
+        :param max_workers:
+        :return: the uris of the chunks, in payload order
+        """
+        chunks = self.add_chunks(source_path, target_url, max_workers=max_workers)
+        self.add_manifest(chunks, target_url, payload_hash, rows)
+        return self.get_chunk_uris(target_url, chunks)
+
+    @instrumentation.instrumented
+    def remove_unreferenced_chunks(self, prefix: str) -> typing.List[str]:
+        """
+        Removes the chunks of a dataset that no manifest lists any more: the chunks an edit
+        superseded, those of a deleted or no longer chunked table and those of a failed load
+        :param prefix: project/dataset/
+        :return: the chunks that were removed
+        """
+        chunks = self.index(f"{CHUNK_PREFIX}/{prefix}")
+        if not chunks:
+            return []
+        referenced: typing.Set[str] = set()
+        for blob_name in self.index(prefix):
+            if not blob_name.endswith(".manifest"):
+                continue
+            manifest = json.loads(self.get(blob_name).download_as_bytes())
+            chunk_prefix = self.get_chunk_prefix(blob_name)
+            referenced.update(
+                f"{chunk_prefix}{chunk['digest']}.chunk" for chunk in manifest["chunks"]
+            )
+        results = self.remove_many(
+            [chunk_url for chunk_url in chunks if chunk_url not in referenced]
+        )
+        return [chunk_url for chunk_url, error in results.items() if error is None]
+
+    @instrumentation.instrumented
+    def add_many(
+        self,
+        uploads: typing.Iterable[typing.Tuple[str, str]],
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.Dict[str, typing.Optional[Exception]]:
+        """
+        Uploads files on a worker pool, a failed upload doesn't stop the others
+        :param uploads: (source_path, target_url) pairs
+        :param max_workers:
+        :return: target_url -> None if it was uploaded, otherwise the error
+        """
+        results: typing.Dict[str, typing.Optional[Exception]] = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.add, source_path, target_url): target_url
+                for source_path, target_url in uploads
+            }
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.exception()
+        return results
 
     def get(self, source_url: str):
         return self.bucket.blob(source_url)
 
+    @instrumentation.instrumented
+    def download(self, source_url: str, target_path: str) -> bool:
+        """
+        :return: False if there's no such blob
+        """
+        try:
+            self.get(source_url).download_to_filename(target_path)
+        except exceptions.NotFound:
+            return False
+        instrumentation.METRICS.add_bytes("downloaded", os.path.getsize(target_path))
+        return True
+
+    def iter_rows(self, blob_name: str) -> typing.Iterator[bytes]:
+        """
+        Streams the rows of a .jsonl blob, or of the chunks a .manifest lists, in payload order
+        without downloading the payload to disk. The blob is read in ranges, only one of them is
+        held in memory at a time.
+        """
+        if blob_name.endswith(".manifest"):
+            manifest = json.loads(self.get(blob_name).download_as_bytes())
+            chunk_prefix = self.get_chunk_prefix(blob_name)
+            for chunk in manifest["chunks"]:
+                yield from self.iter_rows(f"{chunk_prefix}{chunk['digest']}.chunk")
+            return
+
+        blob = self.get(blob_name)
+        start = 0
+        remainder = b""
+        while True:
+            try:
+                data = blob.download_as_bytes(
+                    start=start, end=start + DOWNLOAD_RANGE_SIZE - 1
+                )
+            except exceptions.RequestRangeNotSatisfiable:
+                # the previous range ended exactly at the end of the blob
+                data = b""
+            instrumentation.METRICS.add_bytes("downloaded", len(data))
+            lines = (remainder + data).split(b"\n")
+            # the last line may continue in the next range
+            remainder = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield line
+            if len(data) < DOWNLOAD_RANGE_SIZE:
+                break
+            start += len(data)
+        remainder = remainder.strip()
+        if remainder:
+            yield remainder
+
     def list(self, prefix: str):
         return self.client.list_blobs(bucket_or_name=self.bucket_name, prefix=prefix)
 
+    @instrumentation.instrumented
+    def index(self, prefix: str) -> typing.Dict[str, BlobFingerprint]:
+        """
+        A single list_blobs pass is enough to know the checksum of every object under the prefix
+        :param prefix:
+        :return: blob name -> crc32c, size and generation
+        """
+        return {
+            blob.name: BlobFingerprint(
+                crc32c=blob.crc32c,
+                size=blob.size,
+                generation=blob.generation,
+                payload_hash=(blob.metadata or {}).get("payload_hash"),
+            )
+            for blob in self.list(prefix=prefix)
+        }
+
+    def get_state(
+        self,
+        prefix: str,
+        index: typing.Optional[typing.Dict[str, BlobFingerprint]] = None,
+    ) -> typing.Dict[str, model.Grid]:
+        """
+        The last known applied state of the grids under the prefix, built from the blob
+        checksums without downloading anything
+        :param prefix: project/dataset/
+        :param index: reuses an index that was already listed
+        :return: grid_id -> table or view
+        """
+        index = self.index(prefix) if index is None else index
+        grids: typing.Dict[str, model.Grid] = {}
+        for blob_name, fingerprint in index.items():
+            if blob_name.endswith(".sql"):
+                # only records that the view was applied, its query is compared against the
+                # dataset
+                view = model.View()
+                view.grid_id = blob_name_to_grid_id(blob_name)
+                grids[view.grid_id] = view
+                continue
+            if blob_name.endswith(".jsonl"):
+                payload_hash = fingerprint.crc32c
+            elif blob_name.endswith(".manifest"):
+                payload_hash = fingerprint.payload_hash
+            else:
+                continue
+            table = model.Table()
+            table.grid_id = blob_name_to_grid_id(blob_name)
+            table.payload_hash = payload_hash
+            table.payload = model.Payload(functools.partial(self.iter_rows, blob_name))
+            grids[table.grid_id] = table
+        return grids
+
+    def is_unchanged(
+        self,
+        local_path: str,
+        blob_name: str,
+        index: typing.Dict[str, BlobFingerprint],
+        cache: typing.Optional[fingerprint_cache.FingerprintCache] = None,
+    ) -> bool:
+        """
+        Compares a local file against its blob, the size is checked before anything is hashed
+        """
+        fingerprint = index.get(blob_name)
+        if fingerprint is None or not os.path.isfile(local_path):
+            return False
+        if fingerprint.size is not None and fingerprint.size != os.path.getsize(
+            local_path
+        ):
+            return False
+        crc32c, _ = repository_loader.get_payload_fingerprint(local_path, cache)
+        return crc32c == fingerprint.crc32c
+
+    @instrumentation.instrumented
+    def add_changed(
+        self,
+        uploads: typing.Iterable[typing.Tuple[str, str]],
+        prefix: str,
+        cache: typing.Optional[fingerprint_cache.FingerprintCache] = None,
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.Dict[str, typing.Optional[Exception]]:
+        """
+        Only uploads the files whose crc32c differs from the blob already in the bucket
+        :param uploads: (source_path, target_url) pairs, every target_url is under the prefix
+        :param prefix: listed once to get the remote checksums
+        :param cache:
+        :param max_workers:
+        :return: target_url -> None if it was uploaded, otherwise the error, for the uploaded files only
+        """
+        index = self.index(prefix)
+        return self.add_many(
+            [
+                (source_path, target_url)
+                for source_path, target_url in uploads
+                if not self.is_unchanged(source_path, target_url, index, cache)
+            ],
+            max_workers=max_workers,
+        )
+
+    @instrumentation.instrumented
     def remove(self, target_postfix: str):
         blob = self.bucket.blob(target_postfix)
         blob.delete()
 
+    @instrumentation.instrumented
+    def remove_many(
+        self,
+        target_postfixes: typing.Iterable[str],
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.Dict[str, typing.Optional[Exception]]:
+        """
+        Deletes blobs in batch requests of DELETE_BATCH_SIZE calls.
+        The batch only reports its first failure, so a failed batch is retried one blob at a
+        time to find out which of its blobs couldn't be deleted. Blobs that are already gone
+        count as deleted.
+        :param target_postfixes:
+        :param max_workers: used when retrying a failed batch
+        :return: target_postfix -> None if it was deleted, otherwise the error
+        """
+        target_postfixes = list(target_postfixes)
+        results: typing.Dict[str, typing.Optional[Exception]] = {}
+        for start in range(0, len(target_postfixes), DELETE_BATCH_SIZE):
+            end = start + DELETE_BATCH_SIZE
+            batch = target_postfixes[start:end]
+            try:
+                with self.client.batch():
+                    for target_postfix in batch:
+                        self.bucket.blob(target_postfix).delete()
+            except Exception:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers
+                ) as executor:
+                    for target_postfix, error in zip(
+                        batch, executor.map(self._try_remove, batch)
+                    ):
+                        results[target_postfix] = error
+            else:
+                results.update((target_postfix, None) for target_postfix in batch)
+        return results
+
+    def _try_remove(self, target_postfix: str) -> typing.Optional[Exception]:
+        try:
+            self.remove(target_postfix)
+        except exceptions.NotFound:
+            pass
+        except Exception as e:
+            return e
+        return None
+
 
 class BigqueryGridRepository(AbstractGridRepository):
-    def __init__(self, billing_project: str):
+    def __init__(
+        self, billing_project: str, client: typing.Optional[bigquery.Client] = None
+    ):
         self.billing_project = billing_project
-        self.client = bigquery.Client()
+        self.client = instrumentation.CountedClient(
+            client or bigquery.Client(), instrumentation.BIGQUERY_CALLS
+        )
+        # dataset_id -> grid_id -> grid
+        self.snapshots: typing.Dict[str, typing.Dict[str, model.Grid]] = {}
+        # the staging datasets that are known to exist
+        self.staging_datasets: typing.Set[str] = set()
+        self.lock = threading.Lock()
 
     def add(self, grid_id, schema, sql_query, data_uri):
         """
         :param grid_id:
         :param schema:
         :param sql_query: if set, it's assumed the grid is a view
-        :param data_uri: if set, it's assumed the grid is a table
+        :param data_uri: if set, it's assumed the grid is a table, a uri or a list of uris
         :return:
         """
+        load_job = self.start(grid_id, schema, sql_query, data_uri)
+        if load_job is not None:
+            load_job.result()
+
+    @instrumentation.instrumented
+    def start(self, grid_id, schema, sql_query, data_uri):
+        """
+        Creates the grid and submits its load job without waiting for it
+        :return: the load job or None if there's nothing to load
+        """
+        self.invalidate(grid_id)
+        schema = to_bigquery_schema(schema)
         grid = bigquery.Table(table_ref=grid_id, schema=schema)
 
         if sql_query:
@@ -136,18 +701,294 @@ class BigqueryGridRepository(AbstractGridRepository):
                 schema=schema,
                 source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
             )
+            return self.client.load_table_from_uri(
+                source_uris=data_uri, destination=grid_id, job_config=job_config
+            )
+        return None
+
+    @instrumentation.instrumented
+    def start_swap(self, grid_id, schema, sql_query, data_uri) -> SwapJob:
+        """
+        Replaces an existing table without it ever disappearing: the payload is loaded into a
+        staging table that is then copied over the target
+        :param grid_id:
+        :param schema:
+        :param sql_query: unused, views can't be swapped
+        :param data_uri: a uri or a list of uris
+        :return: the job swapping the tables
+        """
+        self.invalidate(grid_id)
+        staging_id = self.create_staging_dataset(grid_id)
+        job_config = bigquery.LoadJobConfig(
+            schema=to_bigquery_schema(schema),
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
         load_job = self.client.load_table_from_uri(
-            source_uris=data_uri, destination=grid_id, job_config=job_config
+            source_uris=data_uri, destination=staging_id, job_config=job_config
         )
-        load_job.result()
+        return SwapJob(self.client, grid_id, staging_id, load_job)
+
+    @instrumentation.instrumented
+    def create_staging_dataset(self, grid_id: str) -> str:
+        """
+        Creates the staging dataset of the grid's dataset, in the same location so tables can be
+        copied between them, the first time it's needed
+        :return: the id of the grid's staging table
+        """
+        staging_id = get_staging_id(grid_id)
+        staging_dataset_id = staging_id.rpartition(".")[0]
+        with self.lock:
+            if staging_dataset_id in self.staging_datasets:
+                return staging_id
+        dataset = self.client.get_dataset(grid_id.rpartition(".")[0])
+        staging_dataset = bigquery.Dataset(staging_dataset_id)
+        staging_dataset.location = dataset.location
+        staging_dataset.default_table_expiration_ms = STAGING_EXPIRATION_MS
+        self.client.create_dataset(staging_dataset, exists_ok=True)
+        with self.lock:
+            self.staging_datasets.add(staging_dataset_id)
+        return staging_id
+
+    @instrumentation.instrumented
+    def add_many(
+        self,
+        grids: typing.Iterable[typing.Tuple[str, typing.Any, str, str]],
+        max_in_flight: int = LOAD_JOBS_IN_FLIGHT,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        swap: typing.Collection[str] = (),
+    ) -> typing.Dict[str, typing.Optional[Exception]]:
+        """
+        Submits the load jobs up front and polls them together, so a dataset pays the latency of
+        its slowest job rather than the sum of all of them
+        :param grids: (grid_id, schema, sql_query, data_uri) as expected by add
+        :param max_in_flight: load jobs running at the same time
+        :param poll_interval: seconds between two polls of the running jobs
+        :param swap: existing tables that are swapped for the loaded ones rather than recreated
+        :return: grid_id -> None if it was added, otherwise the error
+        """
+        pending = collections.deque(grids)
+        in_flight: typing.Dict[str, typing.Any] = {}
+        results: typing.Dict[str, typing.Optional[Exception]] = {}
+
+        while pending or in_flight:
+            while pending and len(in_flight) < max_in_flight:
+                grid_id, schema, sql_query, data_uri = pending.popleft()
+                start = self.start_swap if grid_id in swap else self.start
+                try:
+                    load_job = start(grid_id, schema, sql_query, data_uri)
+                except Exception as e:
+                    results[grid_id] = e
+                    continue
+                if load_job is None:
+                    results[grid_id] = None
+                else:
+                    in_flight[grid_id] = load_job
+
+            finished = [
+                grid_id for grid_id, load_job in in_flight.items() if load_job.done()
+            ]
+            for grid_id in finished:
+                load_job = in_flight.pop(grid_id)
+                try:
+                    load_job.result()
+                    results[grid_id] = None
+                except Exception as e:
+                    results[grid_id] = e
 
+            if in_flight and not finished:
+                time.sleep(poll_interval)
+
+        return results
+
+    @instrumentation.instrumented
+    def create_view(self, grid: model.Grid):
+        """
+        Creates a view or a materialised view, bigquery checks the grids it reads from exist
+        :param grid: with the query of the view
+        :return:
+        """
+        self.invalidate(grid.grid_id)
+        view = bigquery.Table(table_ref=grid.grid_id)
+        view.description = grid.description
+        view.labels = grid.labels
+        if isinstance(grid, model.MaterialisedView):
+            view.mview_query = grid.query
+            view.mview_enable_refresh = grid.refresh_enabled
+            view.mview_refresh_interval = datetime.timedelta(
+                milliseconds=grid.refresh_interval
+            )
+        else:
+            view.view_query = grid.query
+        self.client.create_table(view)
+
+    def add_views(
+        self,
+        grids: typing.Iterable[model.Grid],
+        replace: typing.Collection[str] = (),
+        max_workers: int = UPLOAD_WORKERS,
+    ) -> typing.Dict[str, typing.Optional[Exception]]:
+        """
+        Creates views that don't read from each other concurrently, there's no job to wait for
+        :param grids: views and materialised views
+        :param replace: existing grids that are removed first
+        :param max_workers: concurrent create_table calls
+        :return: grid_id -> None if it was created, otherwise the error
+        """
+
+        def add_view(grid: model.Grid) -> typing.Optional[Exception]:
+            try:
+                if grid.grid_id in replace:
+                    self.remove(grid.grid_id)
+                self.create_view(grid)
+            except Exception as e:
+                return e
+            return None
+
+        grids = list(grids)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return {
+                grid.grid_id: error
+                for grid, error in zip(grids, executor.map(add_view, grids))
+            }
+
+    @instrumentation.instrumented
     def get(self, grid_id: str):
-        self.client.get_table(grid_id)
+        return self.client.get_table(grid_id)
+
+    @instrumentation.instrumented
+    def update(
+        self,
+        grid_id: str,
+        description: str,
+        labels: typing.Dict[str, str],
+        previous_labels: typing.Optional[typing.Dict[str, str]] = None,
+        schema: typing.Optional[typing.List[typing.Dict]] = None,
+    ):
+        """
+        Patches the grid in place, no load job is needed and the table never disappears
+        :param grid_id:
+        :param description:
+        :param labels:
+        :param previous_labels: labels missing from labels are removed
+        :param schema: if set, it's assumed to be an additive change of the current schema
+        :return:
+        """
+        self.invalidate(grid_id)
+        grid = bigquery.Table(table_ref=grid_id)
+        grid.description = description
+        # bigquery removes a label when it's patched to None
+        grid.labels = {
+            **{label: None for label in previous_labels or {}},
+            **labels,
+        }
+        fields = ["description", "labels"]
+        if schema is not None:
+            grid.schema = to_bigquery_schema(schema)
+            fields.append("schema")
+        self.client.update_table(grid, fields)
+
+    @instrumentation.instrumented
+    def append(self, grid_id: str, schema, data_uri: str):
+        """
+        Loads rows into an existing table, used when a keyless payload only had rows appended
+        """
+        self.invalidate(grid_id)
+        schema = to_bigquery_schema(schema)
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        self.client.load_table_from_uri(
+            source_uris=data_uri, destination=grid_id, job_config=job_config
+        ).result()
+
+    @instrumentation.instrumented
+    def merge(
+        self,
+        grid_id: str,
+        schema: typing.List[typing.Dict],
+        key_fields: typing.List[str],
+        data_uri: str,
+    ):
+        """
+        Applies a row delta to an existing table: the changed rows are loaded into a staging table
+        and merged into the target on the key fields, rows flagged as deleted are removed
+        :param grid_id:
+        :param schema:
+        :param key_fields:
+        :param data_uri: rows written by row_delta.write_row_delta
+        :return:
+        """
+        self.invalidate(grid_id)
+        staging_id = self.create_staging_dataset(grid_id)
+        schema = to_bigquery_schema(schema)
+        # deleted rows only carry their key, so nothing else can be required
+        staging_schema = [
+            {**field, "mode": "NULLABLE"} if field.get("mode") == "REQUIRED" else field
+            for field in schema
+        ] + [{"name": row_delta.DELETED_COLUMN, "type": "BOOLEAN", "mode": "NULLABLE"}]
+        job_config = bigquery.LoadJobConfig(
+            schema=staging_schema,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        try:
+            self.client.load_table_from_uri(
+                source_uris=data_uri, destination=staging_id, job_config=job_config
+            ).result()
+            self.client.query(
+                make_merge_statement(grid_id, staging_id, schema, key_fields)
+            ).result()
+        finally:
+            self.client.delete_table(table=staging_id, not_found_ok=True)
 
+    @instrumentation.instrumented
     def list(self, dataset_id: str):
         # TODO: might require a bit of formatting or
         #  maybe we do that somewhere else?
         return self.client.list_tables(dataset_id)
 
+    def get_state(
+        self, dataset_id: str, max_workers: int = UPLOAD_WORKERS
+    ) -> typing.Dict[str, model.Grid]:
+        """
+        Snapshot of the current state of the dataset, taken once per run.
+        The tables are listed page by page and fetched concurrently, then every lookup is
+        answered from memory until the dataset is modified through this repository.
+        :param dataset_id: project.dataset
+        :param max_workers: concurrent get_table calls
+        :return: grid_id -> grid
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(dataset_id)
+        if snapshot is not None:
+            return snapshot
+
+        grid_ids = [
+            f"{item.project}.{item.dataset_id}.{item.table_id}"
+            for item in self.list(dataset_id)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            snapshot = {
+                grid.grid_id: grid
+                for grid in map(table_to_grid, executor.map(self.get, grid_ids))
+            }
+
+        with self.lock:
+            self.snapshots[dataset_id] = snapshot
+        return snapshot
+
+    def lookup(self, grid_id: str) -> typing.Optional[model.Grid]:
+        dataset_id = grid_id.rpartition(".")[0]
+        return self.get_state(dataset_id).get(grid_id)
+
+    def invalidate(self, grid_id: str):
+        with self.lock:
+            self.snapshots.pop(grid_id.rpartition(".")[0], None)
+
+    @instrumentation.instrumented
     def remove(self, grid_id: str):
+        self.invalidate(grid_id)
         self.client.delete_table(table=grid_id, not_found_ok=True)
@@ -1,17 +1,34 @@
 import base64
+import dataclasses
+import functools
 
 # import collections
 import logging
 import os
+import re
+import simplejson as json
+import sqlparse
 import struct
-
-# import simplejson as json
 import typing
 from crcmod import crcmod
+from sqlparse import tokens as sql_tokens
+from synchronisation.adapters import fingerprint_cache, instrumentation, row_delta
 from synchronisation.domain import model
 
 # from synchronisation.adapters import repository
 
+# read .jsonl payloads in fixed-size binary chunks to keep memory flat for multi-GB files
+CHUNK_SIZE = 1024 * 1024
+
+# enough to get past leading whitespace to the create statement of a .sql file
+SQL_SNIFF_SIZE = 256
+SQL_CREATE_STATEMENT = re.compile(
+    r"\s*create\s+(or\s+replace\s+)?(?P<materialised>materialized\s+)?view\b",
+    re.IGNORECASE,
+)
+# the keywords a referenced table follows, e.g. FROM, JOIN or LEFT OUTER JOIN
+TABLE_CLAUSE = re.compile(r"^(FROM|([A-Z]+\s+)*JOIN)$")
+
 logger = logging.getLogger()
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO
@@ -33,6 +50,378 @@ def make_crc32c(data: any):
     return base64.b64encode(struct.pack(">I", crc32c.crcValue)).decode("utf-8")
 
 
+def make_file_crc32c(
+    file_name: str, chunk_size: int = CHUNK_SIZE
+) -> typing.Tuple[str, int]:
+    """
+    Streams a file in binary chunks, updating the crc32c and the row count in a single pass.
+    The digest is calculated over the raw bytes, so it compares byte-for-byte with the
+    crc32c that GCS reports for the uploaded blob.
+    :param file_name: path of the file to hash
+    :param chunk_size: number of bytes read per iteration
+    :return: base64 big-endian crc32c and the number of rows
+    """
+    crc32c = crcmod.predefined.Crc("crc-32c")
+    rows = 0
+    size = 0
+    last_byte = b"\n"
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            crc32c.update(chunk)
+            rows += chunk.count(b"\n")
+            size += len(chunk)
+            last_byte = chunk[-1:]
+    instrumentation.METRICS.add_bytes("hashed", size)
+    # the last row doesn't need to be terminated by a new line
+    if last_byte != b"\n":
+        rows += 1
+    digest = base64.b64encode(struct.pack(">I", crc32c.crcValue)).decode("utf-8")
+    return digest, rows
+
+
+def get_payload_fingerprint(
+    content_file: str, cache: typing.Optional[fingerprint_cache.FingerprintCache] = None
+) -> typing.Tuple[str, int]:
+    """
+    :param content_file: .jsonl file
+    :param cache: if set, the file is only hashed when its stat metadata has changed
+    :return: crc32c and number of rows
+    """
+    if cache is None:
+        return make_file_crc32c(content_file)
+
+    fingerprint = cache.get(content_file)
+    if fingerprint is None or fingerprint.crc32c is None:
+        key = fingerprint_cache.stat_key(content_file)
+        crc32c, rows = make_file_crc32c(content_file)
+        fingerprint = dataclasses.replace(
+            fingerprint or fingerprint_cache.Fingerprint(), crc32c=crc32c, rows=rows
+        )
+        cache.set(content_file, fingerprint, key)
+    return fingerprint.crc32c, fingerprint.rows
+
+
+def get_payload(content_file: str) -> model.Payload:
+    """
+    :return: a handle that only reads the file when its rows are iterated
+    """
+    return model.Payload(functools.partial(row_delta.iter_rows, content_file))
+
+
+def get_schema_and_digest(
+    schema_file: str, cache: typing.Optional[fingerprint_cache.FingerprintCache] = None
+) -> typing.Tuple[typing.List[typing.Dict], str]:
+    """
+    :param schema_file: .json file
+    :param cache: if set, the file is only read when its stat metadata has changed
+    :return: the schema and the digest of its canonical form
+    """
+    fingerprint = cache.get(schema_file) if cache else None
+    if fingerprint is not None and fingerprint.schema_digest is not None:
+        return json.loads(fingerprint.schema), fingerprint.schema_digest
+
+    key = fingerprint_cache.stat_key(schema_file)
+    with open(schema_file, "r") as f:
+        schema = f.read()
+    # the file is kept as it is for loading, only its canonical form is compared
+    schema_digest = model.make_schema_digest(json.loads(schema))
+    if cache is not None:
+        fingerprint = dataclasses.replace(
+            fingerprint or fingerprint_cache.Fingerprint(),
+            schema=schema,
+            schema_digest=schema_digest,
+        )
+        cache.set(schema_file, fingerprint, key)
+    return json.loads(schema), schema_digest
+
+
+def get_schema(
+    schema_file: str, cache: typing.Optional[fingerprint_cache.FingerprintCache] = None
+) -> typing.List[typing.Dict]:
+    """
+    :param schema_file: .json file
+    :param cache: if set, the file is only read when its stat metadata has changed
+    :return: the schema
+    """
+    return get_schema_and_digest(schema_file, cache)[0]
+
+
+def get_sql_grid_type(file_name: str) -> typing.Optional[str]:
+    """
+    Only sniffs the beginning of the file, the create statement is all we need to classify it
+    :param file_name: .sql file
+    :return: view, materialised_view or None if the statement is not recognised
+    """
+    with open(file_name, "r") as f:
+        preamble = f.read(SQL_SNIFF_SIZE)
+    match = SQL_CREATE_STATEMENT.match(preamble)
+    if match is None:
+        return None
+    return "materialised_view" if match.group("materialised") else "view"
+
+
+def get_view_query(sql: str) -> str:
+    """
+    :param sql: create [materialized] view <name> [options(...)] as <query>
+    :return: the query, what bigquery stores as the view's query
+    """
+    offset = 0
+    depth = 0
+    seen_view = False
+    for token in sqlparse.parse(sql)[0].flatten():
+        offset += len(token.value)
+        if token.match(sql_tokens.Punctuation, "("):
+            depth += 1
+        elif token.match(sql_tokens.Punctuation, ")"):
+            depth -= 1
+        elif token.match(sql_tokens.Keyword, "VIEW"):
+            seen_view = True
+        elif seen_view and depth == 0 and token.match(sql_tokens.Keyword, "AS"):
+            return sql[offset:].strip().rstrip(";").rstrip()
+    raise ValueError(f"Not a create view statement: {sql[:SQL_SNIFF_SIZE]}")
+
+
+def get_view_options(sql: str) -> typing.Dict[str, str]:
+    """
+    :param sql: create [materialized] view <name> [options(...)] as <query>
+    :return: option name -> its value as written, e.g. enable_refresh -> false
+    """
+    tokens = [
+        token
+        for token in sqlparse.parse(sql)[0].flatten()
+        if not token.is_whitespace and token.ttype not in sql_tokens.Comment
+    ]
+    options: typing.Dict[str, str] = {}
+    seen_view = False
+    for position, token in enumerate(tokens):
+        if token.match(sql_tokens.Keyword, "VIEW"):
+            seen_view = True
+        elif seen_view and token.match(sql_tokens.Keyword, "AS"):
+            break
+        elif (
+            seen_view
+            and token.value.upper() == "OPTIONS"
+            and position + 1 < len(tokens)
+            and tokens[position + 1].match(sql_tokens.Punctuation, "(")
+        ):
+            # name = value pairs separated by commas, a value may hold parentheses of its own
+            depth = 0
+            option: typing.List[str] = []
+            start = position + 1
+            for option_token in tokens[start:]:
+                if option_token.match(sql_tokens.Punctuation, "("):
+                    depth += 1
+                    if depth == 1:
+                        continue
+                elif option_token.match(sql_tokens.Punctuation, ")"):
+                    depth -= 1
+                elif depth == 1 and option_token.match(sql_tokens.Punctuation, ","):
+                    read_option(option, options)
+                    option = []
+                    continue
+                if depth == 0:
+                    break
+                option.append(option_token.value)
+            read_option(option, options)
+            break
+    return options
+
+
+def read_option(option: typing.List[str], options: typing.Dict[str, str]):
+    if len(option) > 2 and option[1] == "=":
+        options[option[0].lower()] = "".join(option[2:])
+
+
+def get_refresh_options(
+    options: typing.Mapping[str, str],
+) -> typing.Dict[str, typing.Any]:
+    """
+    :param options: of a materialised view
+    :return: the refresh attributes of a MaterialisedView that are set, bigquery's defaults apply
+    to the others
+    """
+    refresh: typing.Dict[str, typing.Any] = {}
+    if "enable_refresh" in options:
+        refresh["refresh_enabled"] = options["enable_refresh"].upper() == "TRUE"
+    if "refresh_interval_minutes" in options:
+        refresh["refresh_interval"] = int(
+            float(options["refresh_interval_minutes"]) * 60 * 1000
+        )
+    return refresh
+
+
+def read_name(
+    tokens: typing.List[sqlparse.sql.Token], position: int
+) -> typing.Tuple[typing.List[str], int]:
+    """
+    Reads a dotted name, every part may be quoted and a quoted part may hold several parts
+    :return: the parts of the name and the position after it
+    """
+    parts: typing.List[str] = []
+    expect_part = True
+    while position < len(tokens):
+        token = tokens[position]
+        if expect_part and (
+            token.ttype in sql_tokens.Name
+            # a part after a dot may be a keyword, e.g. dataset.order
+            or (parts and token.ttype in sql_tokens.Keyword)
+        ):
+            parts.extend(token.value.strip("`").split("."))
+        elif not expect_part and token.match(sql_tokens.Punctuation, "."):
+            pass
+        else:
+            break
+        expect_part = not expect_part
+        position += 1
+    return parts, position
+
+
+def get_references(query: str, project: str) -> typing.Set[str]:
+    """
+    The tables and views a query reads from, names without a project are in the view's project.
+    Names without a dataset are common table expressions or unnested arrays, not grids.
+    :param query:
+    :param project: of the view
+    :return: grid ids
+    """
+    tokens = [
+        token
+        for statement in sqlparse.parse(query)
+        for token in statement.flatten()
+        if not token.is_whitespace and token.ttype not in sql_tokens.Comment
+    ]
+    references: typing.Set[str] = set()
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token.ttype not in sql_tokens.Keyword or not TABLE_CLAUSE.match(
+            token.normalized
+        ):
+            continue
+        # from a, b is a cross join of both
+        while True:
+            parts, position = read_name(tokens, position)
+            if position < len(tokens) and tokens[position].match(
+                sql_tokens.Punctuation, "("
+            ):
+                # a table function rather than a table
+                break
+            if len(parts) == 2:
+                references.add(".".join([project, *parts]))
+            elif len(parts) == 3:
+                references.add(".".join(parts))
+            if position < len(tokens) and tokens[position].match(
+                sql_tokens.Keyword, "AS"
+            ):
+                position += 1
+            if position < len(tokens) and tokens[position].ttype in sql_tokens.Name:
+                # the alias
+                position += 1
+            if position < len(tokens) and tokens[position].match(
+                sql_tokens.Punctuation, ","
+            ):
+                position += 1
+                continue
+            break
+    return references
+
+
+def read_view(sql_file: str) -> typing.Tuple[str, typing.Dict[str, str]]:
+    with open(sql_file, "r") as f:
+        sql = f.read()
+    return get_view_query(sql), get_view_options(sql)
+
+
+def read_view_query(sql_file: str) -> str:
+    return read_view(sql_file)[0]
+
+
+def normalise_query(query: str) -> str:
+    """
+    The form of a query that doesn't change when it's reformatted: comments are dropped, keywords,
+    types and function names upper cased, quoted names split into their parts and tokens
+    separated by a single space. A create statement is reduced to its query first.
+    """
+    if SQL_CREATE_STATEMENT.match(query):
+        query = get_view_query(query)
+    tokens = [
+        token
+        for statement in sqlparse.parse(query)
+        for token in statement.flatten()
+        if not token.is_whitespace
+        and token.ttype not in sql_tokens.Comment
+        and not token.match(sql_tokens.Punctuation, ";")
+    ]
+    parts = []
+    for position, token in enumerate(tokens):
+        is_function = (
+            token.ttype in sql_tokens.Name
+            and position + 1 < len(tokens)
+            and tokens[position + 1].match(sql_tokens.Punctuation, "(")
+        )
+        if (
+            token.ttype in sql_tokens.Keyword
+            or token.ttype in sql_tokens.Name.Builtin
+            or is_function
+        ):
+            parts.append(token.value.upper())
+        elif token.ttype in sql_tokens.Name and token.value.startswith("`"):
+            parts.append(" . ".join(token.value.strip("`").split(".")))
+        else:
+            parts.append(token.value)
+    return " ".join(parts)
+
+
+def make_query_fingerprint(query: typing.Optional[str]) -> typing.Optional[str]:
+    return make_crc32c(normalise_query(query)) if query else None
+
+
+def get_view_and_options(
+    sql_file: str, cache: typing.Optional[fingerprint_cache.FingerprintCache] = None
+) -> typing.Tuple[str, str, typing.Dict[str, str]]:
+    """
+    :param sql_file: .sql file
+    :param cache: if set, the file is only parsed when its stat metadata has changed
+    :return: the query of the view, its fingerprint and the options of the create statement
+    """
+    fingerprint = cache.get(sql_file) if cache else None
+    if (
+        fingerprint is not None
+        and fingerprint.query_fingerprint is not None
+        and fingerprint.view_options is not None
+    ):
+        return (
+            fingerprint.query,
+            fingerprint.query_fingerprint,
+            json.loads(fingerprint.view_options),
+        )
+
+    key = fingerprint_cache.stat_key(sql_file)
+    query, options = read_view(sql_file)
+    query_fingerprint = make_query_fingerprint(query)
+    if cache is not None:
+        fingerprint = dataclasses.replace(
+            fingerprint or fingerprint_cache.Fingerprint(),
+            query=query,
+            query_fingerprint=query_fingerprint,
+            view_options=json.dumps(options),
+        )
+        cache.set(sql_file, fingerprint, key)
+    return query, query_fingerprint, options
+
+
+def get_view(
+    sql_file: str, cache: typing.Optional[fingerprint_cache.FingerprintCache] = None
+) -> typing.Tuple[str, str]:
+    """
+    :param sql_file: .sql file
+    :param cache: if set, the file is only parsed when its stat metadata has changed
+    :return: the query of the view and its fingerprint
+    """
+    return get_view_and_options(sql_file, cache)[:2]
+
+
 # Should we have the table as a create statement for consistency purposes with the view / materialised view?
 def is_table(project: str, dataset: str, grid_name: str):
     expected_file_name = os.path.join(
@@ -46,10 +435,7 @@ def is_view(project: str, dataset: str, grid_name: str):
         os.getcwd(), "projects", project, dataset, f"{grid_name}.sql"
     )
     if os.path.isfile(expected_file_name):
-        with open(expected_file_name, "r") as efn:
-            # this is not enough
-            # statements = ["create view", "create or replace view"]
-            return efn.read().startswith("create or replace view")
+        return get_sql_grid_type(expected_file_name) == "view"
     return False
 
 
@@ -58,36 +444,68 @@ def is_materialised_view(project: str, dataset: str, grid_name: str):
         os.getcwd(), "projects", project, dataset, f"{grid_name}.sql"
     )
     if os.path.isfile(expected_file_name):
-        with open(expected_file_name, "r") as efn:
-            # this is not enough
-            return efn.read().startswith("create materialized view")
+        return get_sql_grid_type(expected_file_name) == "materialised_view"
     return False
 
 
-def get_grid_types(project: str, dataset: str) -> typing.Dict[str, str]:
-    grid_types: typing.Dict[str, str] = {}
-
-    for root, dirs, files in os.walk(os.path.join(os.getcwd(), "projects", project)):
-        if not files:
-            continue
-
-        file: str
-        for file in files:
-            grid_name = file.partition(".")[0]
-
-            if is_table(project, dataset, grid_name):
-                grid_types[grid_name] = "table"
+def scan_dataset(dataset_path: str) -> typing.Dict[str, str]:
+    """
+    Groups the files of a dataset directory by grid name and extension in a single pass
+    :param dataset_path: projects/<project>/<dataset>
+    :return: grid name -> grid type
+    """
+    grid_files: typing.Dict[str, typing.Dict[str, str]] = {}
+    with os.scandir(dataset_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            grid_name, _, extension = entry.name.partition(".")
+            grid_files.setdefault(grid_name, {})[extension] = entry.path
 
-            if is_view(project, dataset, grid_name):
-                grid_types[grid_name] = "view"
+    grid_types: typing.Dict[str, str] = {}
+    for grid_name, files in grid_files.items():
+        if "jsonl" in files:
+            grid_types[grid_name] = "table"
+        if "sql" in files:
+            sql_grid_type = get_sql_grid_type(files["sql"])
+            if sql_grid_type:
+                grid_types[grid_name] = sql_grid_type
+    return grid_types
+
+
+def scan_projects(
+    projects_root: typing.Optional[str] = None,
+) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, str]]]:
+    """
+    Indexes every dataset of every project in one walk of the projects directory
+    :param projects_root: defaults to the projects directory under the working directory
+    :return: project -> dataset -> grid name -> grid type
+    """
+    projects_root = projects_root or os.path.join(os.getcwd(), "projects")
+    index: typing.Dict[str, typing.Dict[str, typing.Dict[str, str]]] = {}
+    with os.scandir(projects_root) as projects:
+        for project in projects:
+            if not project.is_dir():
+                continue
+            with os.scandir(project.path) as datasets:
+                index[project.name] = {
+                    dataset.name: scan_dataset(dataset.path)
+                    for dataset in datasets
+                    if dataset.is_dir()
+                }
+    return index
 
-            if is_materialised_view(project, dataset, grid_name):
-                grid_types[grid_name] = "materialised_view"
 
-        return grid_types
+def get_grid_types(project: str, dataset: str) -> typing.Dict[str, str]:
+    return scan_dataset(os.path.join(os.getcwd(), "projects", project, dataset))
 
 
-def get_preferred_state(project: str, dataset: str, grid_types: typing.Dict[str, str]):
+def get_preferred_state(
+    project: str,
+    dataset: str,
+    grid_types: typing.Dict[str, str],
+    cache: typing.Optional[fingerprint_cache.FingerprintCache] = None,
+):
 
     grids: typing.Dict[
         str, typing.Union[model.Table, model.View, model.MaterialisedView]
@@ -106,23 +524,28 @@ def get_preferred_state(project: str, dataset: str, grid_types: typing.Dict[str,
             table.grid_id = grid_id
 
             content_file = f"{fqfn}.jsonl"
-            with open(content_file) as f:
-                f_content = f.read()
-                table.payload_hash = make_crc32c(f_content)
-                table.rows = sum(1 for _ in f_content.splitlines())
+            table.payload_hash, table.rows = get_payload_fingerprint(
+                content_file, cache
+            )
+            table.payload = get_payload(content_file)
 
             schema_file = f"{fqfn}.json"
-            with open(schema_file, "r") as f:
-                # TODO: normalise schema format
-                table.schema = f.read()
+            table.set_schema(*get_schema_and_digest(schema_file, cache))
 
             grids[grid_id] = table
 
-        elif grid_type == "view":
-            pass
-
-        elif grid_type == "materialised_view":
-            pass
+        elif grid_type in ("view", "materialised_view"):
+            view = model.View() if grid_type == "view" else model.MaterialisedView()
+            view.grid_id = grid_id
+            sql_file = f"{fqfn}.sql"
+            view.query, view.query_fingerprint, options = get_view_and_options(
+                sql_file, cache
+            )
+            if isinstance(view, model.MaterialisedView):
+                for name, value in get_refresh_options(options).items():
+                    setattr(view, name, value)
+
+            grids[grid_id] = view
 
     return grids
 
@@ -0,0 +1,138 @@
+import collections
+import dataclasses
+import hashlib
+import simplejson as json
+import typing
+
+# schema fields flagged with "key": true identify a row across versions of a payload
+ROW_KEY_PROPERTY = "key"
+# marks the staged rows that have to be deleted from the target table
+DELETED_COLUMN = "_table_loader_deleted"
+
+
+def get_key_fields(schema: typing.List[typing.Dict]) -> typing.List[str]:
+    return [field["name"] for field in schema if field.get(ROW_KEY_PROPERTY)]
+
+
+def iter_rows(file_name: str) -> typing.Iterator[bytes]:
+    with open(file_name, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def make_row_hash(row: bytes) -> str:
+    # 64 bits keep collisions negligible for tables with millions of rows, crc32c wouldn't
+    return hashlib.blake2b(row, digest_size=8).hexdigest()
+
+
+def make_row_key(row: bytes, key_fields: typing.List[str]) -> str:
+    values = json.loads(row)
+    return json.dumps([values.get(field) for field in key_fields])
+
+
+def make_row_snapshot(
+    file_name: str, key_fields: typing.List[str]
+) -> typing.Dict[str, typing.Any]:
+    """
+    Streams a .jsonl file once, keeping a hash per row rather than the row itself
+    :param file_name:
+    :param key_fields: if set, key -> row hash, otherwise row hash -> number of rows with that hash
+    :return:
+    """
+    if key_fields:
+        snapshot: typing.Dict[str, typing.Optional[str]] = {}
+        for row in iter_rows(file_name):
+            key = make_row_key(row, key_fields)
+            # there's no telling which of the rows of a repeated key changed
+            snapshot[key] = None if key in snapshot else make_row_hash(row)
+        return snapshot
+    return dict(collections.Counter(make_row_hash(row) for row in iter_rows(file_name)))
+
+
+def write_row_snapshot(snapshot: typing.Dict[str, typing.Any], file_name: str):
+    with open(file_name, "w") as f:
+        for item in snapshot.items():
+            f.write(f"{json.dumps(item)}\n")
+
+
+def read_row_snapshot(file_name: str) -> typing.Dict[str, typing.Any]:
+    with open(file_name, "r") as f:
+        return dict(json.loads(line) for line in f if line.strip())
+
+
+@dataclasses.dataclass
+class RowDelta:
+    # keyed payloads: keys of the rows to insert or update and of the rows to delete
+    upserted: typing.Set[str] = dataclasses.field(default_factory=set)
+    deleted: typing.Set[str] = dataclasses.field(default_factory=set)
+    # keyless payloads: row hash -> number of rows appended with that hash
+    appended: typing.Dict[str, int] = dataclasses.field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return len(self.upserted) + len(self.deleted) + sum(self.appended.values())
+
+
+def diff_row_snapshots(
+    old: typing.Dict[str, typing.Any],
+    new: typing.Dict[str, typing.Any],
+    key_fields: typing.List[str],
+) -> typing.Optional[RowDelta]:
+    """
+    :param old: the last known applied snapshot
+    :param new: the preferred snapshot
+    :param key_fields:
+    :return: the changed rows or None if the payloads can't be diffed row by row, which is the case
+        for keyed payloads where a key repeats and for keyless payloads that had rows changed or
+        removed rather than only appended
+    """
+    if key_fields:
+        if None in old.values() or None in new.values():
+            return None
+        return RowDelta(
+            upserted={key for key, row_hash in new.items() if old.get(key) != row_hash},
+            deleted=old.keys() - new.keys(),
+        )
+
+    appended: typing.Dict[str, int] = {}
+    for row_hash, count in new.items():
+        if count > old.get(row_hash, 0):
+            appended[row_hash] = count - old.get(row_hash, 0)
+    if any(count > new.get(row_hash, 0) for row_hash, count in old.items()):
+        return None
+    return RowDelta(appended=appended)
+
+
+def write_row_delta(
+    source_file: str,
+    target_file: str,
+    delta: RowDelta,
+    key_fields: typing.List[str],
+) -> int:
+    """
+    Writes the changed rows of the source file, and a marker row per deleted key, to the target file
+    :return: the number of rows written
+    """
+    rows = 0
+    appended = dict(delta.appended)
+    with open(target_file, "wb") as f:
+        for row in iter_rows(source_file):
+            if key_fields:
+                if make_row_key(row, key_fields) not in delta.upserted:
+                    continue
+            else:
+                row_hash = make_row_hash(row)
+                if not appended.get(row_hash):
+                    continue
+                appended[row_hash] -= 1
+            f.write(row + b"\n")
+            rows += 1
+
+        for key in delta.deleted:
+            values = dict(zip(key_fields, json.loads(key)))
+            values[DELETED_COLUMN] = True
+            f.write(f"{json.dumps(values)}\n".encode("utf-8"))
+            rows += 1
+    return rows
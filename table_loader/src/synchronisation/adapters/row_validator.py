@@ -0,0 +1,237 @@
+import concurrent.futures
+import dataclasses
+import multiprocessing
+import re
+import simplejson as json
+import threading
+import typing
+from synchronisation.domain import model
+
+try:
+    # optional and not locked, several times faster than the simplejson C speedups
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# enough to fix a file without scanning the whole of it again and again
+MAX_VIOLATIONS = 10
+
+DATE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$")
+INTEGER = re.compile(r"^[+-]?\d+$")
+BOOLEAN_STRINGS = {"true", "false", "1", "0"}
+# the canonical format of a timestamp: a date, optionally a time with fractional seconds and
+# optionally a time zone, e.g. 2020-01-01 00:00:00 UTC or 2020-01-01T00:00:00.5+01:00
+TIMESTAMP = re.compile(
+    r"^\d{4}-\d{1,2}-\d{1,2}"
+    r"([ Tt]\d{1,2}:\d{1,2}(:\d{1,2}(\.\d{1,12})?)?)?"
+    r"\s*([Zz]|UTC|[+-]\d{1,2}(:?\d{2})?|[A-Za-z]+(/[A-Za-z_+-]+)+)?$"
+)
+
+# the pool shared by every dataset of a run, created the first time it's needed
+process_pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+process_pool_lock = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class Violation:
+    line: int
+    field: str
+    message: str
+
+    def __str__(self):
+        return f"line {self.line}: {self.field} {self.message}"
+
+
+class InvalidRowsError(Exception):
+    def __init__(self, violations: typing.List[Violation]):
+        super().__init__("; ".join(str(violation) for violation in violations))
+        self.violations = violations
+
+
+def is_integer(value) -> bool:
+    if isinstance(value, str):
+        return INTEGER.match(value) is not None
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_float(value) -> bool:
+    if isinstance(value, str):
+        try:
+            float(value)
+        except ValueError:
+            return False
+        return True
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_boolean(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in BOOLEAN_STRINGS
+    return isinstance(value, bool)
+
+
+def is_date(value) -> bool:
+    return isinstance(value, str) and DATE.match(value) is not None
+
+
+def is_timestamp(value) -> bool:
+    # either a formatted string or seconds since the epoch
+    if isinstance(value, str) and TIMESTAMP.match(value) is not None:
+        return True
+    return is_float(value)
+
+
+# the values BigQuery accepts in a newline delimited JSON load, per column type
+TYPE_CHECKERS: typing.Dict[str, typing.Callable[[typing.Any], bool]] = {
+    "STRING": lambda value: isinstance(value, str),
+    "BYTES": lambda value: isinstance(value, str),
+    "INT": is_integer,
+    "INTEGER": is_integer,
+    "INT64": is_integer,
+    "FLOAT": is_float,
+    "FLOAT64": is_float,
+    "NUMERIC": is_float,
+    "BIGNUMERIC": is_float,
+    "BOOL": is_boolean,
+    "BOOLEAN": is_boolean,
+    "DATE": is_date,
+    "TIMESTAMP": is_timestamp,
+    "DATETIME": lambda value: isinstance(value, str),
+    "TIME": lambda value: isinstance(value, str),
+    "GEOGRAPHY": lambda value: isinstance(value, str),
+    "RECORD": lambda value: isinstance(value, dict),
+    "STRUCT": lambda value: isinstance(value, dict),
+}
+
+
+def compile_validator(
+    field_definitions: typing.List[model.FieldDefinition],
+) -> typing.Callable[[dict], typing.Iterator[typing.Tuple[str, str]]]:
+    """
+    Looks the checker and mode of every field up once, so validating a row is a dict lookup and a
+    type check per value
+    :param field_definitions:
+    :return: row -> (field, message) for every violation in the row
+    """
+    fields = {
+        field.name: (
+            TYPE_CHECKERS.get(field.type.upper(), lambda value: True),
+            field.type,
+            field.mode.upper(),
+        )
+        for field in field_definitions
+    }
+    required = [
+        field.name for field in field_definitions if field.mode.upper() == "REQUIRED"
+    ]
+
+    def validate(row: dict) -> typing.Iterator[typing.Tuple[str, str]]:
+        if not isinstance(row, dict):
+            yield "", "is not a JSON object"
+            return
+        for name in required:
+            if row.get(name) is None:
+                yield name, "is REQUIRED but missing"
+        for name, value in row.items():
+            field = fields.get(name)
+            if field is None:
+                yield name, "is not in the schema"
+                continue
+            if value is None:
+                continue
+            is_valid, field_type, mode = field
+            if mode == "REPEATED":
+                if not isinstance(value, list):
+                    yield name, "is REPEATED but not a list"
+                elif not all(is_valid(item) for item in value if item is not None):
+                    yield name, f"has items that aren't {field_type}"
+            elif not is_valid(value):
+                yield name, f"is not {field_type}: {value!r}"
+
+    return validate
+
+
+def validate_file(
+    file_name: str,
+    field_definitions: typing.List[model.FieldDefinition],
+    max_violations: int = MAX_VIOLATIONS,
+) -> typing.List[Violation]:
+    """
+    Streams a .jsonl file once, stopping as soon as max_violations were found
+    :return: the first max_violations violations
+    """
+    validate = compile_validator(field_definitions)
+    violations: typing.List[Violation] = []
+    with open(file_name, "rb") as f:
+        for line, row in enumerate(f, start=1):
+            if not row.strip():
+                continue
+            try:
+                row = loads(row)
+            except ValueError as e:
+                violations.append(Violation(line, "", f"is not valid JSON: {e}"))
+            else:
+                for field, message in validate(row):
+                    violations.append(Violation(line, field, message))
+            if len(violations) >= max_violations:
+                return violations[:max_violations]
+    return violations
+
+
+def make_process_pool(
+    max_workers: typing.Optional[int] = None,
+) -> concurrent.futures.ProcessPoolExecutor:
+    # datasets are synchronised on threads, forking a multithreaded process can deadlock
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    One pool per process, so datasets validated at the same time share the cores rather than
+    each starting a pool of their own
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = make_process_pool()
+        return process_pool
+
+
+def validate_files(
+    files: typing.Dict[str, typing.Tuple[str, typing.List[model.FieldDefinition]]],
+    max_workers: typing.Optional[int] = None,
+    max_violations: int = MAX_VIOLATIONS,
+    executor: typing.Optional[concurrent.futures.Executor] = None,
+) -> typing.Dict[str, typing.List[Violation]]:
+    """
+    Validates the files on a process pool, decoding JSON is CPU bound
+    :param files: grid_id -> (.jsonl file, field definitions of the table)
+    :param max_workers: if set, the files get a pool of their own of that size
+    :param max_violations: per file
+    :param executor: defaults to the pool shared by the run
+    :return: grid_id -> violations, for the files that have any
+    """
+    if len(files) <= 1:
+        results = {
+            grid_id: validate_file(file_name, field_definitions, max_violations)
+            for grid_id, (file_name, field_definitions) in files.items()
+        }
+    elif executor is None and max_workers is not None:
+        with make_process_pool(max_workers) as pool:
+            return validate_files(files, max_violations=max_violations, executor=pool)
+    else:
+        pool = executor or get_process_pool()
+        futures = {
+            grid_id: pool.submit(
+                validate_file, file_name, field_definitions, max_violations
+            )
+            for grid_id, (file_name, field_definitions) in files.items()
+        }
+        results = {grid_id: future.result() for grid_id, future in futures.items()}
+    return {
+        grid_id: violations for grid_id, violations in results.items() if violations
+    }
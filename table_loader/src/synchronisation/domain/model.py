@@ -1,12 +1,36 @@
+import hashlib
+import itertools
 import typing
 import dataclasses
 import simplejson as json
 
 
+def slotted(cls):
+    """
+    dataclass(slots=True) for the python versions that don't have it yet.
+    The class is rebuilt with a slot per field it declares, so instances have no __dict__.
+    """
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())
+    }
+    slots = tuple(
+        field.name for field in dataclasses.fields(cls) if field.name not in inherited
+    )
+    namespace = dict(cls.__dict__)
+    for name in slots:
+        namespace.pop(name, None)
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = slots
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@slotted
+@dataclasses.dataclass(eq=False)
 class Grid:
-    grid_id: str
+    grid_id: str = ""
     description: str = ""
-    labels: typing.Dict[str, str] = {}
+    labels: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
     modification_date: str = ""
 
     def is_metadata_unchanged(self, other):
@@ -26,7 +50,8 @@ class Grid:
 
 
 class GridComponent:
-    pass
+    # components only declare fields, the slots live on the concrete grid classes
+    __slots__ = ()
 
 
 @dataclasses.dataclass(frozen=True, eq=True, order=True)
@@ -35,64 +60,354 @@ class FieldDefinition:
     type: str
     mode: str
     description: str
-    # TODO: maybe add fields later as the complexity increases
-    # fields: object = field(default_factory=)
+    # of a RECORD, in order
+    fields: typing.Tuple["FieldDefinition", ...] = ()
     # the below SHOULD NOT be part of this model but just adding it for completion for now
     # policy_tags: object
     # policy_tags_names: typing.List[str]
 
 
+@dataclasses.dataclass
+class SchemaDiff:
+    """
+    Changes needed to go from one schema to another.
+    Additive changes can be patched onto an existing table, breaking ones need a reload.
+    """
+
+    added: typing.List[FieldDefinition] = dataclasses.field(default_factory=list)
+    relaxed: typing.List[FieldDefinition] = dataclasses.field(default_factory=list)
+    redescribed: typing.List[FieldDefinition] = dataclasses.field(default_factory=list)
+    breaking: typing.List[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def is_unchanged(self) -> bool:
+        return not (self.added or self.relaxed or self.redescribed or self.breaking)
+
+    @property
+    def is_additive(self) -> bool:
+        return not self.breaking
+
+
+# standard SQL type name -> the legacy name bigquery reports it under
+TYPE_ALIASES = {
+    "INT": "INTEGER",
+    "INT64": "INTEGER",
+    "SMALLINT": "INTEGER",
+    "BIGINT": "INTEGER",
+    "TINYINT": "INTEGER",
+    "BYTEINT": "INTEGER",
+    "FLOAT64": "FLOAT",
+    "BOOL": "BOOLEAN",
+    "STRUCT": "RECORD",
+    "DECIMAL": "NUMERIC",
+    "BIGDECIMAL": "BIGNUMERIC",
+}
+# the field properties bigquery knows about, anything else is only meaningful to table_loader
+SCHEMA_PROPERTIES = frozenset(
+    {
+        "name",
+        "type",
+        "mode",
+        "description",
+        "fields",
+        "policyTags",
+        "maxLength",
+        "precision",
+        "scale",
+        "defaultValueExpression",
+        "collation",
+        "roundingMode",
+    }
+)
+
+
+def canonical_type(field_type: str) -> str:
+    field_type = field_type.upper()
+    return TYPE_ALIASES.get(field_type, field_type)
+
+
+def canonical_field(field: typing.Dict) -> typing.Dict:
+    """
+    Sorted keys, the defaults filled in and the fields of a RECORD made canonical in turn
+    """
+    canonical = {
+        name: value
+        for name, value in field.items()
+        if name in SCHEMA_PROPERTIES and value is not None
+    }
+    canonical["type"] = canonical_type(field["type"])
+    canonical["mode"] = (field.get("mode") or "NULLABLE").upper()
+    canonical["description"] = field.get("description") or ""
+    if field.get("fields"):
+        canonical["fields"] = canonical_schema(field["fields"])
+    else:
+        canonical.pop("fields", None)
+    return dict(sorted(canonical.items()))
+
+
+def canonical_schema(schema: typing.List[typing.Dict]) -> typing.List[typing.Dict]:
+    """
+    The form of a schema that doesn't change with the key order, formatting or defaults of the
+    file it was read from, the order of the fields is kept
+    """
+    return [canonical_field(field) for field in schema]
+
+
+def make_schema_digest(schema: typing.List[typing.Dict]) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            canonical_schema(schema), sort_keys=True, separators=(",", ":")
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def get_field_definitions(
+    schema: typing.List[typing.Dict],
+) -> typing.List[FieldDefinition]:
+    return [
+        FieldDefinition(
+            name=field["name"],
+            type=field["type"],
+            mode=field.get("mode") or "NULLABLE",
+            description=field.get("description") or "",
+            fields=tuple(get_field_definitions(field.get("fields") or [])),
+        )
+        for field in schema
+    ]
+
+
+def diff_field_definitions(
+    old: typing.List[FieldDefinition],
+    new: typing.List[FieldDefinition],
+    prefix: str = "",
+) -> SchemaDiff:
+    """
+    :param prefix: the path of the RECORD the fields belong to, the fields of a RECORD are
+    diffed like the top level ones and reported under their full path, e.g. ADDRESS.CITY
+    """
+    diff = SchemaDiff()
+    new_by_name = {field.name: field for field in new}
+
+    for old_field in old:
+        path = f"{prefix}{old_field.name}"
+        new_field = new_by_name.get(old_field.name)
+        if new_field is None:
+            diff.breaking.append(f"{path} was removed")
+            continue
+        if canonical_type(new_field.type) != canonical_type(old_field.type):
+            diff.breaking.append(
+                f"{path} changed type from {old_field.type} to {new_field.type}"
+            )
+        elif old_field.fields or new_field.fields:
+            nested = diff_field_definitions(
+                old_field.fields, new_field.fields, prefix=f"{path}."
+            )
+            diff.added.extend(nested.added)
+            diff.relaxed.extend(nested.relaxed)
+            diff.redescribed.extend(nested.redescribed)
+            diff.breaking.extend(nested.breaking)
+        if new_field.mode != old_field.mode:
+            if old_field.mode == "REQUIRED" and new_field.mode == "NULLABLE":
+                diff.relaxed.append(dataclasses.replace(new_field, name=path))
+            else:
+                diff.breaking.append(
+                    f"{path} changed mode from {old_field.mode} to {new_field.mode}"
+                )
+        if new_field.description != old_field.description:
+            diff.redescribed.append(dataclasses.replace(new_field, name=path))
+
+    # existing columns can't move, new ones can only be appended
+    old_by_name = {field.name: field for field in old}
+    kept = [field.name for field in old if field.name in new_by_name]
+    if [field.name for field in new[: len(kept)]] != kept:
+        diff.breaking.append(
+            f"existing fields of {prefix[:-1]} were reordered"
+            if prefix
+            else "existing fields were reordered"
+        )
+
+    for new_field in new:
+        if new_field.name in old_by_name:
+            continue
+        path = f"{prefix}{new_field.name}"
+        if new_field.mode == "REQUIRED":
+            diff.breaking.append(f"{path} was added as REQUIRED")
+        else:
+            diff.added.append(dataclasses.replace(new_field, name=path))
+
+    return diff
+
+
+@dataclasses.dataclass(eq=False)
 class SchemaMixin(GridComponent):
-    schema: typing.List[typing.Dict] = []
+    __slots__ = ()
+    schema: typing.List[typing.Dict] = dataclasses.field(default_factory=list)
+    # of the canonical schema, calculated on first use or passed along with the schema
+    schema_digest: typing.Optional[str] = None
+    # the schema the digest belongs to, a schema assigned directly gets a digest of its own
+    digested_schema: typing.Optional[typing.List[typing.Dict]] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.schema_digest is not None:
+            self.digested_schema = self.schema
+
+    def set_schema(
+        self,
+        schema: typing.List[typing.Dict],
+        schema_digest: typing.Optional[str] = None,
+    ):
+        """
+        :param schema:
+        :param schema_digest: reused if it was already calculated, e.g. cached
+        """
+        self.schema = schema
+        self.schema_digest = schema_digest or make_schema_digest(schema)
+        self.digested_schema = schema
+
+    def set_schema_from_json(self, schema: typing.Union[str, typing.List[typing.Dict]]):
+        """
+        :param schema: the content of a .json schema file, or what it was decoded to
+        """
+        self.set_schema(json.loads(schema) if isinstance(schema, str) else schema)
 
     def get_schema_json(self):
         return json.dumps(self.schema)
 
-    def get_field_definitions(self):
-        # TODO: is there a way to abstract the field_definitions population
-        field_definitions: typing.List[FieldDefinition] = []
-        for field in self.schema:
-            field_definitions.append(
-                FieldDefinition(
-                    name=field["name"],
-                    type=field["type"],
-                    mode=field["mode"],
-                    description=field["description"],
-                )
+    def get_schema_digest(self) -> str:
+        if self.schema_digest is None or self.digested_schema is not self.schema:
+            self.set_schema(self.schema)
+        return self.schema_digest
+
+    def is_schema_equal(self, other: "SchemaMixin") -> bool:
+        """
+        A single comparison of the digests, each one is only calculated once per schema
+        """
+        return self.get_schema_digest() == other.get_schema_digest()
+
+    def get_field_definitions(self) -> typing.List[FieldDefinition]:
+        return get_field_definitions(self.schema)
+
+    def diff_schema(self, other: "SchemaMixin") -> SchemaDiff:
+        """
+        :param other: the schema we start from, usually the current state
+        :return: the changes needed to turn other's schema into this one
+        """
+        if self.is_schema_equal(other):
+            return SchemaDiff()
+        diff = diff_field_definitions(
+            old=other.get_field_definitions(), new=self.get_field_definitions()
+        )
+        if diff.is_unchanged:
+            # e.g. policyTags or maxLength changed, the field definitions don't carry them
+            diff.breaking.append(
+                "field properties other than type, mode and description changed"
             )
-        return field_definitions
+        return diff
+
+
+class Payload:
+    """
+    Lazy handle on the rows of a .jsonl payload, nothing is read until it's iterated.
+    Every iteration reads the underlying file or blob again and decodes one row at a time.
+    """
 
+    __slots__ = ("read_rows",)
 
+    def __init__(self, read_rows: typing.Callable[[], typing.Iterable[bytes]]):
+        """
+        :param read_rows: returns the raw, non-empty rows of the payload
+        """
+        self.read_rows = read_rows
+
+    def __iter__(self) -> typing.Iterator[dict]:
+        for row in self.read_rows():
+            yield json.loads(row)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.read_rows!r})"
+
+
+def is_payload_equal(payload: typing.Iterable[dict], other: typing.Iterable[dict]):
+    """
+    Compares two payloads row by row, stopping at the first difference
+    """
+    missing = object()
+    return all(
+        row == other_row
+        for row, other_row in itertools.zip_longest(payload, other, fillvalue=missing)
+    )
+
+
+@dataclasses.dataclass(eq=False)
 class ContentMixin(GridComponent):
+    __slots__ = ()
     # TODO: should we move the hashing into the model or is it an implementation detail?
     payload_hash: typing.Optional[str] = ""
-    payload: typing.Optional[typing.Iterable[dict]] = []
+    # a list of rows or a lazy Payload handle
+    payload: typing.Optional[typing.Iterable[dict]] = dataclasses.field(
+        default_factory=list, repr=False
+    )
 
 
+@dataclasses.dataclass(eq=False)
 class SqlMixin(GridComponent):
-    query: typing.Optional[str]
+    __slots__ = ()
+    query: typing.Optional[str] = None
+    # of the normalised query, reformatting the query doesn't change it
+    query_fingerprint: typing.Optional[str] = None
+
+    def is_query_unchanged(self, other: "SqlMixin") -> bool:
+        """
+        The fingerprints are compared when both are known, otherwise the queries themselves
+        """
+        if self.query_fingerprint and other.query_fingerprint:
+            return self.query_fingerprint == other.query_fingerprint
+        return self.query == other.query
 
 
+@slotted
+@dataclasses.dataclass(eq=False)
 class Table(Grid, SchemaMixin, ContentMixin):
     rows: typing.Optional[int] = 0
 
     def __eq__(self, other):
-        # TODO: if payload exists in both compare it etc
+        """
+        The payloads are only streamed and compared when either hash is unknown
+        """
         if not isinstance(other, Table):
             return False
-        return (
-            self.grid_id == other.grid_id
-            and self.schema == other.schema
-            and self.payload == other.payload
-            and self.payload_hash == other.payload_hash
-            and self.rows == other.rows
-        )
+        if (
+            self.grid_id != other.grid_id
+            or not self.is_schema_equal(other)
+            or self.rows != other.rows
+        ):
+            return False
+        if self.payload_hash and other.payload_hash:
+            return self.payload_hash == other.payload_hash
+        return is_payload_equal(self.payload, other.payload)
 
 
+@slotted
+@dataclasses.dataclass(eq=False)
 class View(Grid, SchemaMixin, SqlMixin):
     pass
 
 
+@slotted
+@dataclasses.dataclass(eq=False)
 class MaterialisedView(Grid, SchemaMixin, SqlMixin):
     refresh_enabled: bool = True
+    # in milliseconds
     refresh_interval: int = 1800000
+
+    def is_refresh_unchanged(self, other: "MaterialisedView") -> bool:
+        # the interval of a materialised view that isn't refreshed doesn't matter
+        return self.refresh_enabled == other.refresh_enabled and (
+            not self.refresh_enabled or self.refresh_interval == other.refresh_interval
+        )
+
+
+# the concrete grid types
+GRID_CLASSES: typing.Tuple[typing.Type[Grid], ...] = (Table, View, MaterialisedView)
@@ -1,19 +1,156 @@
 import argparse
-from synchronisation.service_layer import actions, uow
+import logging
+import os
+import sys
+from synchronisation.adapters import (
+    fingerprint_cache,
+    instrumentation,
+    repository,
+    repository_loader,
+)
+from synchronisation.domain import model
+from synchronisation.service_layer import actions, dependencies, plan, scheduler, uow
+
+logger = logging.getLogger()
 
 parser = argparse.ArgumentParser()
+parser.add_argument(
+    "command",
+    nargs="?",
+    choices=("plan", "apply"),
+    default="apply",
+    help="plan only decides what needs to happen and writes it to --plan, "
+    "apply (the default) synchronises",
+)
+parser.add_argument(
+    "--plan",
+    help="plan: where the plan is written, "
+    "apply: applies this plan rather than collecting the states again",
+)
 parser.add_argument(
     "--project",
-    help="--project=your-project --bucket-prefix"
-    # f"or leave empty to recurse through every project in your 'projects' directory",
+    help="--project=your-project --bucket-prefix "
+    "or leave empty to recurse through every project in your 'projects' directory",
 )
 parser.add_argument(
     "--bucket-name",
     help="--bucket-name 'gs://bucket_name'",
 )
-args = parser.parse_args()
+parser.add_argument(
+    "--max-workers",
+    type=int,
+    default=scheduler.MAX_WORKERS,
+    help="number of datasets synchronised at the same time",
+)
+parser.add_argument(
+    "--max-workers-per-project",
+    type=int,
+    default=scheduler.MAX_WORKERS_PER_PROJECT,
+    help="number of datasets of the same project synchronised at the same time",
+)
+parser.add_argument(
+    "--report",
+    help="writes the stage timings, bytes and API calls of the run to this JSON file",
+)
+parser.add_argument(
+    "--prometheus-textfile",
+    help="writes the same report in the Prometheus text format, e.g. for the node exporter",
+)
 
 
 def main():
-    uow.RealLifeUnitOfWork(...)
-    actions.synchronise(uow)
+    args = parser.parse_args()
+    root = os.path.join(os.getcwd(), "projects")
+    # unchanged files are neither hashed nor parsed again, the cache is only written when it is closed
+    with fingerprint_cache.FingerprintCache(
+        os.path.join(os.getcwd(), fingerprint_cache.DEFAULT_CACHE_FILE)
+    ) as cache:
+
+        def make_unit_of_work(project: str, bucket_name: str):
+            return uow.StateUnitOfWork(
+                bucket_prefix=bucket_name,
+                billing_project=project,
+                preferred=repository.FilesystemGridRepository(root=root, cache=cache),
+            )
+
+        if args.command == "apply" and args.plan:
+            bucket_name, plans = plan.read_plans(args.plan)
+            bucket_name = args.bucket_name or bucket_name
+            plans_by_unit = {(p.project, p.dataset): p for p in plans}
+            units = [
+                unit
+                for unit in plans_by_unit
+                if not args.project or unit[0] == args.project
+            ]
+            queries = {
+                grid_id: grid.query
+                for dataset_plan in plans
+                for grid_id, grid in dataset_plan.preferred.items()
+                if isinstance(grid, model.SqlMixin)
+            }
+
+            def sync(project: str, dataset: str):
+                return plan.apply_plan(
+                    make_unit_of_work(project, bucket_name),
+                    plans_by_unit[project, dataset],
+                )
+
+        else:
+            with instrumentation.METRICS.stage("scan"):
+                index = repository_loader.scan_projects(root)
+            projects = [args.project] if args.project else sorted(index)
+            units = [
+                (project, dataset)
+                for project in projects
+                for dataset in sorted(index.get(project, {}))
+            ]
+            queries = {
+                f"{project}.{dataset}.{grid_name}": repository_loader.get_view(
+                    os.path.join(root, project, dataset, f"{grid_name}.sql"), cache
+                )[0]
+                for project, dataset in units
+                for grid_name, grid_type in index[project][dataset].items()
+                if grid_type in ("view", "materialised_view")
+            }
+
+            def sync(project: str, dataset: str):
+                unit_of_work = make_unit_of_work(project, args.bucket_name)
+                # the datasets were scanned along with their projects
+                grid_types = index[project][dataset]
+                if args.command == "plan":
+                    return plan.make_plan(
+                        unit_of_work,
+                        project=project,
+                        dataset=dataset,
+                        grid_types=grid_types,
+                    )
+                return actions.synchronise(
+                    unit_of_work,
+                    project=project,
+                    dataset=dataset,
+                    grid_types=grid_types,
+                )
+
+        # datasets are synchronised after the datasets their views read from
+        report = scheduler.synchronise_levels(
+            levels=dependencies.get_unit_levels(units, queries),
+            sync=sync,
+            max_workers=args.max_workers,
+            max_workers_per_project=args.max_workers_per_project,
+        )
+
+    for result in report.errors:
+        logger.error(f"{result.project}.{result.dataset}: {result.error}")
+    if args.command == "plan" and report.succeeded:
+        plans = [result.result for result in report.results]
+        for dataset_plan in plans:
+            for grid_id, action in sorted(dataset_plan.actions.items()):
+                logger.info(f"{action} {grid_id}")
+        if args.plan:
+            plan.write_plans(args.plan, plans, bucket_name=args.bucket_name)
+    if args.report:
+        instrumentation.METRICS.write_report(args.report)
+    if args.prometheus_textfile:
+        instrumentation.METRICS.write_prometheus(args.prometheus_textfile)
+    if not report.succeeded:
+        sys.exit(1)
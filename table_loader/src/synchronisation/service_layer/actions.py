@@ -1,46 +1,716 @@
+import dataclasses
+import logging
+import os
+import tempfile
 import typing
 
-# from synchronisation.domain import model
-from synchronisation.adapters import repository
-from synchronisation.service_layer import uow
+from synchronisation.domain import model
+from synchronisation.adapters import (
+    chunking,
+    instrumentation,
+    repository,
+    repository_loader,
+    row_delta,
+    row_validator,
+)
+from synchronisation.service_layer import dependencies, uow
 
+logger = logging.getLogger()
 
-def decide_table_action():
-    return "create|replace|update|delete"
+CREATE = "create"
+REPLACE = "replace"
+UPDATE = "update"
+UPDATE_SCHEMA = "update_schema"
+MERGE = "merge"
+DELETE = "delete"
 
+# tables smaller than this are cheaper to reload than to diff row by row
+INCREMENTAL_MIN_ROWS = 100000
+# payloads larger than this are uploaded as content addressed chunks
+CHUNKED_MIN_SIZE = 256 * 1024 * 1024
 
-def decide_actions(preferred_state, last_known, current):
-    actions: typing.Dict[str, typing.Callable] = {}
+
+def is_schema_unchanged(grid: model.Grid, other: model.Grid) -> bool:
+    # a state that doesn't know its schema can't tell us it has changed
+    if not getattr(grid, "schema", None) or not getattr(other, "schema", None):
+        return True
+    return grid.is_schema_equal(other)
+
+
+def is_content_unchanged(preferred: model.Grid, other: model.Grid) -> bool:
+    """
+    Cheapest comparisons first, the payload itself is never compared when the hashes are known.
+    The schema is left out, it's compared against the current state where it can be patched.
+    """
+    if type(preferred) is not type(other):
+        return False
+    if isinstance(preferred, model.Table) and preferred.payload_hash != (
+        other.payload_hash
+    ):
+        return False
+    if isinstance(preferred, model.MaterialisedView) and not (
+        preferred.is_refresh_unchanged(other)
+    ):
+        return False
+    if isinstance(preferred, model.SqlMixin):
+        # a reformatted query is the same query
+        return preferred.is_query_unchanged(other)
+    return True
+
+
+def is_incremental(preferred: model.Grid, last_known: model.Grid) -> bool:
+    return (
+        isinstance(preferred, model.Table)
+        and isinstance(last_known, model.Table)
+        and preferred.rows >= INCREMENTAL_MIN_ROWS
+    )
+
+
+def decide_table_action(
+    preferred: typing.Optional[model.Grid],
+    last_known: typing.Optional[model.Grid],
+    current: typing.Optional[model.Grid],
+) -> typing.Optional[str]:
+    """
+    :param preferred: what's in the local directory
+    :param last_known: what was last applied, what's in the bucket
+    :param current: what's in the dataset
+    :return: create, replace, merge, update, update_schema, delete or None if nothing needs to happen
+    """
+    if preferred is None:
+        # a grid we never applied is unmanaged and left alone
+        return DELETE if last_known is not None else None
+
+    if current is None:
+        return CREATE
+
+    # the grid exists but we either never applied it or it was changed behind our back
+    if last_known is None or type(preferred) is not type(current):
+        return REPLACE
+
+    schema_diff: typing.Optional[model.SchemaDiff] = None
+    if not is_schema_unchanged(preferred, current):
+        schema_diff = preferred.diff_schema(current)
+        if not schema_diff.is_additive:
+            return REPLACE
+
+    # the bucket only records that a view was applied, the dataset holds its query
+    applied = current if isinstance(preferred, model.SqlMixin) else last_known
+    if not is_content_unchanged(preferred, applied):
+        if is_incremental(preferred, last_known) and (
+            schema_diff is None or schema_diff.is_unchanged
+        ):
+            # metadata is patched after the rows are merged
+            return MERGE
+        return REPLACE
+
+    if schema_diff is not None and not schema_diff.is_unchanged:
+        # metadata is patched along with the schema
+        return UPDATE_SCHEMA
+
+    if not preferred.is_metadata_unchanged(current):
+        return UPDATE
+
+    return None
+
+
+def decide_actions(
+    preferred_state: typing.Mapping[str, model.Grid],
+    last_known: typing.Mapping[str, model.Grid],
+    current: typing.Mapping[str, model.Grid],
+) -> typing.Dict[str, str]:
+    """
+    Three-way diff of the states in a single pass over the managed grids.
+    Grids that only exist in the current state are unmanaged, so they are never visited.
+    :param preferred_state: grid_id -> grid
+    :param last_known: grid_id -> grid
+    :param current: grid_id -> grid
+    :return: grid_id -> action
+    """
+    actions: typing.Dict[str, str] = {}
+    for grid_id in preferred_state.keys() | last_known.keys():
+        action = decide_table_action(
+            preferred=preferred_state.get(grid_id),
+            last_known=last_known.get(grid_id),
+            current=current.get(grid_id),
+        )
+        if action is not None:
+            actions[grid_id] = action
     return actions
 
 
-def create():
-    pass
+def grid_id_to_blob_prefix(grid_id: str) -> str:
+    return "/".join(grid_id.split("."))
+
+
+@dataclasses.dataclass
+class StagedPayload:
+    """
+    The payload of a table uploaded for its load. It only becomes the last known state once the
+    load succeeded, so a failed load leaves the last known state as it was and the next run tries
+    again.
+    """
+
+    data_uris: typing.List[str]
+    # the blob a payload was uploaded to, unless it was chunked
+    staged_url: typing.Optional[str] = None
+    # of a chunked payload, the manifest listing them is only written when it's published
+    chunks: typing.Optional[typing.List[chunking.Chunk]] = None
+
 
+def stage(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid: model.Table,
+    chunked: typing.Optional[bool] = None,
+) -> StagedPayload:
+    """
+    Uploads the payload of a table where a load can read it, outside of the last known state.
+    Large payloads are uploaded as content addressed chunks so only the edited chunks are sent.
+    :param chunked: defaults to whether the payload is at least CHUNKED_MIN_SIZE
+    """
+    payload_file = f"{unit_of_work.preferred.grid_to_path_prefix(grid.grid_id)}.jsonl"
+    target_prefix = grid_id_to_blob_prefix(grid.grid_id)
+    if chunked is None:
+        chunked = os.path.getsize(payload_file) >= CHUNKED_MIN_SIZE
+    if chunked:
+        manifest_url = f"{target_prefix}.manifest"
+        chunks = unit_of_work.last_known.add_chunks(payload_file, manifest_url)
+        return StagedPayload(
+            data_uris=unit_of_work.last_known.get_chunk_uris(manifest_url, chunks),
+            chunks=chunks,
+        )
+    staged_url = f"{repository.UPLOAD_STAGING_PREFIX}/{target_prefix}.jsonl"
+    unit_of_work.last_known.add(payload_file, staged_url)
+    return StagedPayload(
+        data_uris=[f"gs://{unit_of_work.last_known.bucket_name}/{staged_url}"],
+        staged_url=staged_url,
+    )
+
+
+def discard(unit_of_work: uow.AbstractUnitOfWork, staged: StagedPayload):
+    """
+    Removes the payload of a failed load, its chunks are left for remove_unreferenced_chunks
+    """
+    if staged.staged_url is not None:
+        unit_of_work.last_known.remove_many([staged.staged_url])
 
-def replace():
-    pass
 
+def publish(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid: model.Table,
+    staged: typing.Optional[StagedPayload] = None,
+    row_snapshot: typing.Optional[typing.Dict[str, typing.Any]] = None,
+):
+    """
+    Makes the payload and schema of a table the last known applied state, only call it once the
+    table was applied.
+    Tables large enough to be merged incrementally also get a snapshot of their row hashes.
+    :param unit_of_work:
+    :param grid:
+    :param staged: the payload that was loaded, unset if the table was merged instead
+    :param row_snapshot: reused if it was already calculated
+    """
+    source_prefix = unit_of_work.preferred.grid_to_path_prefix(grid.grid_id)
+    target_prefix = grid_id_to_blob_prefix(grid.grid_id)
+    if staged is None:
+        # a merged table is kept as chunks whatever its size, so after the first merge only the
+        # chunks around the changed rows are uploaded rather than the whole payload
+        staged = stage(unit_of_work, grid, chunked=True)
+    uploads = [(f"{source_prefix}.json", f"{target_prefix}.json")]
 
-def update():
-    pass
+    with tempfile.TemporaryDirectory() as directory:
+        if grid.rows >= INCREMENTAL_MIN_ROWS:
+            if row_snapshot is None:
+                row_snapshot = row_delta.make_row_snapshot(
+                    f"{source_prefix}.jsonl", row_delta.get_key_fields(grid.schema)
+                )
+            snapshot_file = os.path.join(directory, "snapshot.rowhashes")
+            row_delta.write_row_snapshot(row_snapshot, snapshot_file)
+            uploads.append((snapshot_file, f"{target_prefix}.rowhashes"))
 
+        # an unchanged schema or snapshot is left as it is, listing the grid's blobs is cheaper
+        results = unit_of_work.last_known.add_changed(
+            uploads, prefix=f"{target_prefix}."
+        )
 
-def delete():
-    pass
+    for error in results.values():
+        if error is not None:
+            raise error
 
+    # the payload may have crossed the chunking threshold since it was last published
+    if staged.chunks is not None:
+        unit_of_work.last_known.add_manifest(
+            staged.chunks, f"{target_prefix}.manifest", grid.payload_hash, grid.rows
+        )
+        unit_of_work.last_known.remove_many([f"{target_prefix}.jsonl"])
+    else:
+        unit_of_work.last_known.copy(staged.staged_url, f"{target_prefix}.jsonl")
+        unit_of_work.last_known.remove_many(
+            [staged.staged_url, f"{target_prefix}.manifest"]
+        )
+
+
+def publish_queries(
+    unit_of_work: uow.AbstractUnitOfWork, grids: typing.Iterable[model.Grid]
+):
+    """
+    Uploads the .sql files of views, making them the last known applied state
+    """
+    results = unit_of_work.last_known.add_many(
+        [
+            (
+                f"{unit_of_work.preferred.grid_to_path_prefix(grid.grid_id)}.sql",
+                f"{grid_id_to_blob_prefix(grid.grid_id)}.sql",
+            )
+            for grid in grids
+        ]
+    )
+    for error in results.values():
+        if error is not None:
+            raise error
+
+
+class SynchronisationError(Exception):
+    def __init__(self, failures: typing.Dict[str, Exception]):
+        super().__init__(
+            ", ".join(f"{grid_id}: {error}" for grid_id, error in failures.items())
+        )
+        self.failures = failures
+
+
+def prepare_load(
+    unit_of_work: uow.AbstractUnitOfWork, grid_id: str, grid: model.Grid
+) -> typing.Tuple[
+    typing.Tuple[
+        str, typing.Any, typing.Optional[str], typing.Optional[typing.List[str]]
+    ],
+    typing.Optional[StagedPayload],
+]:
+    """
+    :return: the arguments the current state repository needs to add the grid, and the payload
+        that was staged for it
+    """
+    staged = stage(unit_of_work, grid) if isinstance(grid, model.Table) else None
+    return (
+        grid_id,
+        getattr(grid, "schema", None),
+        getattr(grid, "query", None),
+        staged.data_uris if staged is not None else None,
+    ), staged
+
+
+def finish_load(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid: model.Grid,
+    staged: typing.Optional[StagedPayload],
+    error: typing.Optional[Exception],
+) -> typing.Optional[Exception]:
+    """
+    Publishes a loaded table, the payload of a failed load is discarded instead
+    :return: the error of the load, or of the publish
+    """
+    if staged is None:
+        return error
+    if error is not None:
+        discard(unit_of_work, staged)
+        return error
+    try:
+        publish(unit_of_work, grid, staged)
+    except Exception as e:
+        return e
+    return None
+
+
+def validate_payloads(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grids: typing.Iterable[model.Table],
+):
+    """
+    Checks the rows of the payloads against their schemas before anything is uploaded, rather
+    than finding out from a failed load job
+    :raises SynchronisationError: with the first violations of every invalid payload
+    """
+    invalid = row_validator.validate_files(
+        {
+            grid.grid_id: (
+                f"{unit_of_work.preferred.grid_to_path_prefix(grid.grid_id)}.jsonl",
+                grid.get_field_definitions(),
+            )
+            for grid in grids
+        }
+    )
+    if invalid:
+        raise SynchronisationError(
+            {
+                grid_id: row_validator.InvalidRowsError(violations)
+                for grid_id, violations in invalid.items()
+            }
+        )
+
+
+def deploy_views(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grids: typing.Mapping[str, model.Grid],
+    replace: typing.Collection[str] = (),
+):
+    """
+    Creates views level by level, a view only once the views it reads from exist, and every
+    view of a level at the same time. The levels after a failed one are skipped.
+    :param grids: grid_id -> view or materialised view
+    :param replace: views that exist and are removed first
+    :raises SynchronisationError:
+    :raises dependencies.CyclicDependencyError:
+    """
+    for level in dependencies.get_levels(dependencies.get_dependencies(grids)):
+        results = unit_of_work.current.add_views(
+            [grids[grid_id] for grid_id in level], replace=replace
+        )
+        failures = {
+            grid_id: error for grid_id, error in results.items() if error is not None
+        }
+        if failures:
+            raise SynchronisationError(failures)
+        publish_queries(unit_of_work, [grids[grid_id] for grid_id in level])
 
-def synchronise(project: str, bucket_prefix: str):
-    with uow:
-        preferred_state = repository.FilesystemGridRepository.list()
-        last_known = repository.GoogleCloudStorageGridRepository.list()
-        current = repository.BigqueryGridRepository.list()
 
-        actions: typing.Dict
+def is_swappable(grid: model.Grid, current: typing.Optional[model.Grid]) -> bool:
+    """
+    A table replacing a table is swapped in without the target ever disappearing
+    """
+    return isinstance(grid, model.Table) and isinstance(current, model.Table)
+
+
+def load_table(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Table,
+    swap: bool = False,
+):
+    """
+    Loads a single table and publishes it once it was loaded
+    :param swap: the table exists and is swapped for the loaded one
+    """
+    load, staged = prepare_load(unit_of_work, grid_id, grid)
+    if swap:
+        error = unit_of_work.current.add_many([load], swap={grid_id})[grid_id]
+    else:
+        try:
+            unit_of_work.current.add(*load)
+            error = None
+        except Exception as e:
+            error = e
+    error = finish_load(unit_of_work, grid, staged, error)
+    if error is not None:
+        raise error
+
+
+def create(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Grid,
+    current: typing.Optional[model.Grid] = None,
+):
+    if isinstance(grid, model.SqlMixin):
+        return deploy_views(unit_of_work, {grid_id: grid})
+    load_table(unit_of_work, grid_id, grid)
+
+
+def replace(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Grid,
+    current: model.Grid,
+):
+    if isinstance(grid, model.SqlMixin):
+        return deploy_views(unit_of_work, {grid_id: grid}, replace={grid_id})
+    if not is_swappable(grid, current):
+        unit_of_work.current.remove(grid_id)
+        return create(unit_of_work, grid_id, grid)
+
+    load_table(unit_of_work, grid_id, grid, swap=True)
+
+
+def update(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Grid,
+    current: model.Grid,
+):
+    unit_of_work.current.update(
+        grid_id=grid_id,
+        description=grid.description,
+        labels=grid.labels,
+        previous_labels=current.labels,
+    )
+
+
+def update_schema(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Grid,
+    current: model.Grid,
+):
+    unit_of_work.current.update(
+        grid_id=grid_id,
+        description=grid.description,
+        labels=grid.labels,
+        previous_labels=current.labels,
+        schema=grid.schema,
+    )
+
+
+def merge(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: model.Table,
+    current: model.Grid,
+):
+    """
+    Only the rows that changed since the last known applied state are uploaded and merged.
+    Falls back to a replace when there's no row snapshot to diff against, or when rows of a
+    keyless table were changed rather than appended.
+    """
+    source_file = f"{unit_of_work.preferred.grid_to_path_prefix(grid_id)}.jsonl"
+    target_prefix = grid_id_to_blob_prefix(grid_id)
+    key_fields = row_delta.get_key_fields(grid.schema)
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_file = os.path.join(directory, "last_known.rowhashes")
+        if not unit_of_work.last_known.download(
+            f"{target_prefix}.rowhashes", snapshot_file
+        ):
+            return replace(unit_of_work, grid_id, grid, current)
+
+        row_snapshot = row_delta.make_row_snapshot(source_file, key_fields)
+        delta = row_delta.diff_row_snapshots(
+            row_delta.read_row_snapshot(snapshot_file), row_snapshot, key_fields
+        )
+        if delta is None:
+            logger.warning(
+                f"{grid_id} can't be merged row by row, "
+                f"{'a key repeats' if key_fields else 'rows were changed or removed'}, "
+                f"replacing it"
+            )
+            return replace(unit_of_work, grid_id, grid, current)
+
+        if delta.rows:
+            delta_file = os.path.join(directory, "delta.jsonl")
+            row_delta.write_row_delta(source_file, delta_file, delta, key_fields)
+            delta_url = f"{repository.UPLOAD_STAGING_PREFIX}/{target_prefix}.delta"
+            unit_of_work.last_known.add(delta_file, delta_url)
+            data_uri = f"gs://{unit_of_work.last_known.bucket_name}/{delta_url}"
+            try:
+                if key_fields:
+                    unit_of_work.current.merge(
+                        grid_id, grid.schema, key_fields, data_uri
+                    )
+                else:
+                    unit_of_work.current.append(grid_id, grid.schema, data_uri)
+            finally:
+                unit_of_work.last_known.remove_many([delta_url])
+
+    # only once the rows were merged
+    publish(unit_of_work, grid, row_snapshot=row_snapshot)
+    if not grid.is_metadata_unchanged(current):
+        update(unit_of_work, grid_id, grid, current)
+
+
+def delete(
+    unit_of_work: uow.AbstractUnitOfWork,
+    grid_id: str,
+    grid: None,
+    current: typing.Optional[model.Grid],
+):
+    unit_of_work.current.remove(grid_id)
+    target_prefix = grid_id_to_blob_prefix(grid_id)
+    unit_of_work.last_known.remove_many(
+        [
+            f"{target_prefix}.jsonl",
+            f"{target_prefix}.json",
+            f"{target_prefix}.rowhashes",
+            f"{target_prefix}.manifest",
+            f"{target_prefix}.sql",
+        ]
+    )
+
+
+HANDLERS: typing.Dict[str, typing.Callable] = {
+    CREATE: create,
+    REPLACE: replace,
+    UPDATE: update,
+    UPDATE_SCHEMA: update_schema,
+    MERGE: merge,
+    DELETE: delete,
+}
+
+
+@dataclasses.dataclass
+class DatasetPlan:
+    """
+    The actions decided for a dataset and everything needed to apply them without collecting
+    the states again
+    """
+
+    project: str
+    dataset: str
+    # grid_id -> action
+    actions: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    # the preferred and current grids of the grids that have an action
+    preferred: typing.Dict[str, model.Grid] = dataclasses.field(default_factory=dict)
+    current: typing.Dict[str, model.Grid] = dataclasses.field(default_factory=dict)
+    # grid_id -> source file -> stat key, of the files the preferred grids were read from
+    fingerprints: typing.Dict[str, typing.Dict[str, typing.List[int]]] = (
+        dataclasses.field(default_factory=dict)
+    )
+
+
+def make_plan(
+    unit_of_work: uow.AbstractUnitOfWork,
+    project: str,
+    dataset: str,
+    grid_types: typing.Optional[typing.Dict[str, str]] = None,
+) -> DatasetPlan:
+    """
+    Collects the three states of a dataset and decides what needs to happen, changing nothing
+    :param unit_of_work:
+    :param project:
+    :param dataset:
+    :param grid_types: grid name -> grid type, the dataset is scanned unless it already was
+    :return:
+    """
+    metrics = instrumentation.METRICS
+    if grid_types is None:
+        with metrics.stage("scan"):
+            grid_types = repository_loader.get_grid_types(project, dataset)
+    with metrics.stage("hash"):
+        preferred_state = repository_loader.get_preferred_state(
+            project=project,
+            dataset=dataset,
+            grid_types=grid_types,
+            cache=getattr(unit_of_work.preferred, "cache", None),
+        )
+    with metrics.stage("list"):
+        last_known = unit_of_work.last_known.get_state(prefix=f"{project}/{dataset}/")
+        current = unit_of_work.current.get_state(dataset_id=f"{project}.{dataset}")
+
+    actions: typing.Dict[str, str]
+    with metrics.stage("diff"):
         actions = decide_actions(
             preferred_state=preferred_state, last_known=last_known, current=current
         )
 
-        for grid_id, action in actions.items():
-            action()
-            # call the message bus instead?
+    return DatasetPlan(
+        project=project,
+        dataset=dataset,
+        actions=actions,
+        preferred={
+            grid_id: preferred_state[grid_id]
+            for grid_id in actions
+            if grid_id in preferred_state
+        },
+        current={
+            grid_id: current[grid_id] for grid_id in actions if grid_id in current
+        },
+    )
+
+
+def apply_plan(unit_of_work: uow.AbstractUnitOfWork, plan: DatasetPlan):
+    """
+    Applies the actions of a plan, no state is collected again
+    :param unit_of_work:
+    :param plan:
+    :return: the actions that were applied
+    """
+    metrics = instrumentation.METRICS
+    with metrics.stage("validate"):
+        validate_payloads(
+            unit_of_work,
+            [
+                plan.preferred[grid_id]
+                for grid_id, action in plan.actions.items()
+                if action in (CREATE, REPLACE, MERGE)
+                and isinstance(plan.preferred[grid_id], model.Table)
+            ],
+        )
+
+    # load jobs are submitted together and polled as a batch, views are created once the
+    # tables they read from are loaded
+    loads = []
+    staged = {}
+    swap = set()
+    views = {}
+    for grid_id, action in plan.actions.items():
+        grid = plan.preferred.get(grid_id)
+        if action in (CREATE, REPLACE) and isinstance(grid, model.SqlMixin):
+            views[grid_id] = grid
+            continue
+        if action == REPLACE:
+            if is_swappable(grid, plan.current.get(grid_id)):
+                swap.add(grid_id)
+            else:
+                with metrics.stage(DELETE):
+                    unit_of_work.current.remove(grid_id)
+        if action in (CREATE, REPLACE):
+            with metrics.stage("upload"):
+                load, staged[grid_id] = prepare_load(unit_of_work, grid_id, grid)
+                loads.append(load)
+        else:
+            with metrics.stage(action):
+                HANDLERS[action](unit_of_work, grid_id, grid, plan.current.get(grid_id))
+        # call the message bus instead?
+
+    with metrics.stage("load"):
+        results = unit_of_work.current.add_many(loads, swap=swap)
+    # a grid only becomes the last known state once it was loaded
+    with metrics.stage("publish"):
+        results = {
+            grid_id: finish_load(
+                unit_of_work, plan.preferred[grid_id], staged[grid_id], error
+            )
+            for grid_id, error in results.items()
+        }
+    failures = {
+        grid_id: error for grid_id, error in results.items() if error is not None
+    }
+
+    if any(
+        action in (CREATE, REPLACE, MERGE, DELETE)
+        and not isinstance(plan.preferred.get(grid_id), model.SqlMixin)
+        for grid_id, action in plan.actions.items()
+    ):
+        # every table of the dataset is published by now, chunks no manifest lists are garbage
+        with metrics.stage("collect"):
+            unit_of_work.last_known.remove_unreferenced_chunks(
+                f"{plan.project}/{plan.dataset}/"
+            )
+    if failures:
+        raise SynchronisationError(failures)
+
+    with metrics.stage("views"):
+        deploy_views(
+            unit_of_work,
+            views,
+            replace={grid_id for grid_id in views if plan.actions[grid_id] == REPLACE},
+        )
+
+    return plan.actions
+
+
+def synchronise(
+    unit_of_work: uow.AbstractUnitOfWork,
+    project: str,
+    dataset: str,
+    grid_types: typing.Optional[typing.Dict[str, str]] = None,
+):
+    """
+    Synchronises a single dataset, the unit of work the scheduler fans out
+    :param unit_of_work:
+    :param project:
+    :param dataset:
+    :param grid_types: grid name -> grid type, the dataset is scanned unless it already was
+    :return: the actions decided for the dataset
+    """
+    with unit_of_work:
+        return apply_plan(
+            unit_of_work, make_plan(unit_of_work, project, dataset, grid_types)
+        )
@@ -0,0 +1,139 @@
+import logging
+import typing
+
+from synchronisation.adapters import repository_loader
+from synchronisation.domain import model
+
+logger = logging.getLogger()
+
+
+class CyclicDependencyError(Exception):
+    def __init__(self, nodes: typing.Iterable):
+        # grid ids or (project, dataset) units
+        self.nodes = sorted(nodes)
+        names = [
+            node if isinstance(node, str) else ".".join(node) for node in self.nodes
+        ]
+        super().__init__(f"{', '.join(names)} depend on each other")
+
+
+def get_project(grid_id: str) -> str:
+    return grid_id.partition(".")[0]
+
+
+def get_unit(grid_id: str) -> typing.Tuple[str, str]:
+    project, dataset, _ = grid_id.split(".")
+    return project, dataset
+
+
+def get_dependencies(
+    grids: typing.Mapping[str, model.Grid],
+) -> typing.Dict[str, typing.Set[str]]:
+    """
+    :param grids: grid_id -> grid, the views are parsed for the grids they read from
+    :return: grid_id -> the grids among grids it reads from, tables depend on nothing
+    """
+    return {
+        grid_id: (
+            (
+                repository_loader.get_references(grid.query, get_project(grid_id))
+                & grids.keys()
+            )
+            - {grid_id}
+            if isinstance(grid, model.SqlMixin) and grid.query
+            else set()
+        )
+        for grid_id, grid in grids.items()
+    }
+
+
+def get_levels(
+    dependencies: typing.Mapping[typing.Hashable, typing.Collection[typing.Hashable]],
+) -> typing.List[typing.List]:
+    """
+    Topological levels of a dependency graph: everything in a level only depends on earlier
+    levels, so a level can be deployed all at once
+    :param dependencies: node -> the nodes it depends on, unknown nodes are ignored
+    :raises CyclicDependencyError: with the nodes that are part of, or depend on, a cycle
+    :return: the levels, sorted within a level
+    """
+    remaining = {
+        node: {dependency for dependency in depends_on if dependency in dependencies}
+        for node, depends_on in dependencies.items()
+    }
+    dependants: typing.Dict[typing.Hashable, typing.List] = {
+        node: [] for node in remaining
+    }
+    for node, depends_on in remaining.items():
+        for dependency in depends_on:
+            dependants[dependency].append(node)
+
+    levels = []
+    level = sorted(node for node, depends_on in remaining.items() if not depends_on)
+    while level:
+        levels.append(level)
+        next_level = []
+        for node in level:
+            del remaining[node]
+            for dependant in dependants[node]:
+                depends_on = remaining[dependant]
+                depends_on.discard(node)
+                if not depends_on:
+                    next_level.append(dependant)
+        level = sorted(next_level)
+
+    if remaining:
+        raise CyclicDependencyError(remaining)
+    return levels
+
+
+def get_unit_dependencies(
+    units: typing.Iterable[typing.Tuple[str, str]],
+    queries: typing.Mapping[str, str],
+) -> typing.Dict[typing.Tuple[str, str], typing.Set[typing.Tuple[str, str]]]:
+    """
+    Lifts the dependencies of the views to their datasets, a dataset is synchronised after the
+    datasets its views read from
+    :param units: (project, dataset) pairs
+    :param queries: grid_id -> query, of every view
+    :return: (project, dataset) -> the other datasets it depends on
+    """
+    dependencies: typing.Dict[
+        typing.Tuple[str, str], typing.Set[typing.Tuple[str, str]]
+    ] = {unit: set() for unit in units}
+    for grid_id, query in queries.items():
+        unit = get_unit(grid_id)
+        dependencies.setdefault(unit, set()).update(
+            get_unit(reference)
+            for reference in repository_loader.get_references(
+                query, get_project(grid_id)
+            )
+        )
+        dependencies[unit].discard(unit)
+    return dependencies
+
+
+def get_unit_levels(
+    units: typing.Iterable[typing.Tuple[str, str]],
+    queries: typing.Mapping[str, str],
+) -> typing.List[typing.List[typing.Tuple[str, str]]]:
+    """
+    Datasets whose views read from each other both ways can't be ordered, they're synchronised
+    together in a last level
+    :param units: (project, dataset) pairs
+    :param queries: grid_id -> query, of every view
+    :return: the levels of datasets
+    """
+    unit_dependencies = get_unit_dependencies(units, queries)
+    try:
+        return get_levels(unit_dependencies)
+    except CyclicDependencyError as e:
+        logger.warning(f"Can't order the datasets: {e}")
+        cyclic = set(e.nodes)
+        return get_levels(
+            {
+                unit: depends_on
+                for unit, depends_on in unit_dependencies.items()
+                if unit not in cyclic
+            }
+        ) + [e.nodes]
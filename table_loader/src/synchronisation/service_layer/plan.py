@@ -0,0 +1,212 @@
+import dataclasses
+import os
+import simplejson as json
+import typing
+
+from synchronisation.adapters import fingerprint_cache, repository_loader
+from synchronisation.domain import model
+from synchronisation.service_layer import actions, uow
+
+PLAN_VERSION = 1
+# the files a grid can be read from
+SOURCE_EXTENSIONS = (".json", ".jsonl", ".sql")
+
+GRID_CLASSES_BY_NAME = {cls.__name__: cls for cls in model.GRID_CLASSES}
+
+
+class StalePlanError(Exception):
+    def __init__(self, grid_ids: typing.List[str]):
+        super().__init__(
+            f"The source files of {', '.join(grid_ids)} changed since the plan was made, "
+            f"make a new plan"
+        )
+        self.grid_ids = grid_ids
+
+
+def grid_to_dict(grid: model.Grid) -> typing.Dict:
+    # the payload stays on disk, apply reads it from the source files
+    return {
+        "type": type(grid).__name__,
+        **{
+            field.name: getattr(grid, field.name)
+            for field in dataclasses.fields(grid)
+            if field.init and field.name != "payload"
+        },
+    }
+
+
+def grid_from_dict(values: typing.Dict) -> model.Grid:
+    values = dict(values)
+    return GRID_CLASSES_BY_NAME[values.pop("type")](**values)
+
+
+def to_dict(plan: actions.DatasetPlan) -> typing.Dict:
+    return {
+        "project": plan.project,
+        "dataset": plan.dataset,
+        "actions": plan.actions,
+        "preferred": {
+            grid_id: grid_to_dict(grid) for grid_id, grid in plan.preferred.items()
+        },
+        "current": {
+            grid_id: grid_to_dict(grid) for grid_id, grid in plan.current.items()
+        },
+        "fingerprints": plan.fingerprints,
+    }
+
+
+def from_dict(values: typing.Dict) -> actions.DatasetPlan:
+    return actions.DatasetPlan(
+        project=values["project"],
+        dataset=values["dataset"],
+        actions=values["actions"],
+        preferred={
+            grid_id: grid_from_dict(grid)
+            for grid_id, grid in values["preferred"].items()
+        },
+        current={
+            grid_id: grid_from_dict(grid) for grid_id, grid in values["current"].items()
+        },
+        fingerprints=values["fingerprints"],
+    )
+
+
+def write_plans(
+    file_name: str,
+    plans: typing.Iterable[actions.DatasetPlan],
+    bucket_name: typing.Optional[str] = None,
+):
+    with open(file_name, "w") as f:
+        json.dump(
+            {
+                "version": PLAN_VERSION,
+                "bucket_name": bucket_name,
+                "datasets": [to_dict(plan) for plan in plans],
+            },
+            f,
+            indent=2,
+        )
+
+
+def read_plans(
+    file_name: str,
+) -> typing.Tuple[typing.Optional[str], typing.List[actions.DatasetPlan]]:
+    """
+    :return: the bucket the plan was made against and the plan of every dataset
+    """
+    with open(file_name, "r") as f:
+        values = json.load(f)
+    if values.get("version") != PLAN_VERSION:
+        raise ValueError(
+            f"{file_name} is a version {values.get('version')} plan, "
+            f"expected version {PLAN_VERSION}"
+        )
+    return values["bucket_name"], [from_dict(plan) for plan in values["datasets"]]
+
+
+def fingerprint_file(
+    file_name: str, crc32c: typing.Optional[str] = None
+) -> typing.List:
+    """
+    :param crc32c: reused if the file was already hashed
+    :return: size, mtime_ns, inode and crc32c
+    """
+    if crc32c is None:
+        crc32c, _ = repository_loader.make_file_crc32c(file_name)
+    return [*fingerprint_cache.stat_key(file_name), crc32c]
+
+
+def is_source_unchanged(file_name: str, fingerprint: typing.List) -> bool:
+    """
+    The stat metadata settles it for files that weren't touched. Otherwise, e.g. in a fresh
+    checkout, a file of the same size is hashed again.
+    """
+    try:
+        key = list(fingerprint_cache.stat_key(file_name))
+    except FileNotFoundError:
+        return False
+    if key == fingerprint[:3]:
+        return True
+    if key[0] != fingerprint[0]:
+        return False
+    crc32c, _ = repository_loader.make_file_crc32c(file_name)
+    return crc32c == fingerprint[3]
+
+
+def get_source_files(
+    unit_of_work: uow.AbstractUnitOfWork, grid_id: str
+) -> typing.Dict[str, str]:
+    """
+    :return: extension -> file, of the source files that exist
+    """
+    prefix = unit_of_work.preferred.grid_to_path_prefix(grid_id)
+    return {
+        extension: f"{prefix}{extension}"
+        for extension in SOURCE_EXTENSIONS
+        if os.path.isfile(f"{prefix}{extension}")
+    }
+
+
+def fingerprint_sources(
+    unit_of_work: uow.AbstractUnitOfWork, plan: actions.DatasetPlan
+):
+    """
+    Records the source files of every grid with an action, deleted grids have none
+    """
+    for grid_id in plan.actions:
+        grid = plan.preferred.get(grid_id)
+        plan.fingerprints[grid_id] = {
+            extension: fingerprint_file(
+                file_name,
+                crc32c=(
+                    getattr(grid, "payload_hash", None)
+                    if extension == ".jsonl"
+                    else None
+                ),
+            )
+            for extension, file_name in get_source_files(unit_of_work, grid_id).items()
+        }
+
+
+def find_stale_grids(
+    unit_of_work: uow.AbstractUnitOfWork, plan: actions.DatasetPlan
+) -> typing.List[str]:
+    stale = []
+    for grid_id in plan.actions:
+        recorded = plan.fingerprints.get(grid_id, {})
+        source_files = get_source_files(unit_of_work, grid_id)
+        if source_files.keys() != recorded.keys() or not all(
+            is_source_unchanged(source_files[extension], fingerprint)
+            for extension, fingerprint in recorded.items()
+        ):
+            stale.append(grid_id)
+    return stale
+
+
+def make_plan(
+    unit_of_work: uow.AbstractUnitOfWork,
+    project: str,
+    dataset: str,
+    grid_types: typing.Optional[typing.Dict[str, str]] = None,
+) -> actions.DatasetPlan:
+    """
+    Plans a dataset and records the source files the plan is based on
+    :param grid_types: grid name -> grid type, the dataset is scanned unless it already was
+    """
+    with unit_of_work:
+        plan = actions.make_plan(unit_of_work, project, dataset, grid_types)
+        fingerprint_sources(unit_of_work, plan)
+    return plan
+
+
+def apply_plan(unit_of_work: uow.AbstractUnitOfWork, plan: actions.DatasetPlan):
+    """
+    Applies a plan that was read back, as long as its source files haven't changed
+    :raises StalePlanError:
+    :return: the actions that were applied
+    """
+    with unit_of_work:
+        stale = find_stale_grids(unit_of_work, plan)
+        if stale:
+            raise StalePlanError(stale)
+        return actions.apply_plan(unit_of_work, plan)
@@ -0,0 +1,122 @@
+import collections
+import concurrent.futures
+import dataclasses
+import logging
+import typing
+
+logger = logging.getLogger()
+
+MAX_WORKERS = 16
+MAX_WORKERS_PER_PROJECT = 4
+
+
+@dataclasses.dataclass
+class SyncResult:
+    project: str
+    dataset: str
+    result: typing.Any = None
+    error: typing.Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclasses.dataclass
+class SyncReport:
+    results: typing.List[SyncResult] = dataclasses.field(default_factory=list)
+
+    @property
+    def errors(self) -> typing.List[SyncResult]:
+        return [result for result in self.results if not result.succeeded]
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.errors
+
+
+def synchronise_all(
+    units: typing.Iterable[typing.Tuple[str, str]],
+    sync: typing.Callable[[str, str], typing.Any],
+    max_workers: int = MAX_WORKERS,
+    max_workers_per_project: int = MAX_WORKERS_PER_PROJECT,
+) -> SyncReport:
+    """
+    Fans the (project, dataset) sync units out over a bounded thread pool.
+    A unit is only submitted while its project has fewer than max_workers_per_project units in
+    flight, so one big project can't starve the others or exhaust its own API quota.
+    A failing unit is recorded in the report and doesn't stop the remaining ones.
+    :param units: (project, dataset) pairs
+    :param sync: synchronises a single dataset
+    :param max_workers: total number of datasets synchronised at the same time
+    :param max_workers_per_project: number of datasets of the same project synchronised at the same time
+    :return: the result or error of every unit
+    """
+    pending: typing.Dict[str, typing.Deque[str]] = collections.defaultdict(
+        collections.deque
+    )
+    for project, dataset in units:
+        pending[project].append(dataset)
+
+    report = SyncReport()
+    running: typing.Dict[str, int] = collections.Counter()
+    in_flight: typing.Dict[concurrent.futures.Future, typing.Tuple[str, str]] = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or in_flight:
+            for project in list(pending):
+                datasets = pending[project]
+                while (
+                    datasets
+                    and len(in_flight) < max_workers
+                    and running[project] < max_workers_per_project
+                ):
+                    dataset = datasets.popleft()
+                    future = executor.submit(sync, project, dataset)
+                    in_flight[future] = (project, dataset)
+                    running[project] += 1
+                if not datasets:
+                    del pending[project]
+
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                project, dataset = in_flight.pop(future)
+                running[project] -= 1
+                error = future.exception()
+                if error is not None:
+                    logger.error(f"Failed to synchronise {project}.{dataset}: {error}")
+                    report.results.append(SyncResult(project, dataset, error=error))
+                else:
+                    logger.info(f"Synchronised {project}.{dataset}")
+                    report.results.append(
+                        SyncResult(project, dataset, result=future.result())
+                    )
+
+    return report
+
+
+def synchronise_levels(
+    levels: typing.Iterable[typing.Iterable[typing.Tuple[str, str]]],
+    sync: typing.Callable[[str, str], typing.Any],
+    max_workers: int = MAX_WORKERS,
+    max_workers_per_project: int = MAX_WORKERS_PER_PROJECT,
+) -> SyncReport:
+    """
+    Synchronises the levels one after the other and the datasets of a level like
+    synchronise_all, so views are only created once the datasets they read from are
+    :param levels: of (project, dataset) pairs
+    :return: the result or error of every unit
+    """
+    report = SyncReport()
+    for level in levels:
+        report.results.extend(
+            synchronise_all(
+                units=level,
+                sync=sync,
+                max_workers=max_workers,
+                max_workers_per_project=max_workers_per_project,
+            ).results
+        )
+    return report
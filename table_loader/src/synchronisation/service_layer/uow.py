@@ -1,6 +1,8 @@
 import abc
+import concurrent.futures
+import typing
 
-from table_loader.src.synchronisation.adapters import repository
+from synchronisation.adapters import async_repository, repository
 
 
 class AbstractUnitOfWork(abc.ABC):
@@ -8,22 +10,87 @@ class AbstractUnitOfWork(abc.ABC):
     current: repository.AbstractGridRepository
     last_known: repository.AbstractGridRepository
 
+    def __enter__(self):
+        return self
+
     def __exit__(self, *args):
         pass
 
 
 class StateUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, bucket_prefix: str, billing_project: str, root: str):
-        self.preferred = repository.FilesystemGridRepository(root=root)
-        self.last_known = repository.GoogleCloudStorageGridRepository(
+    def __init__(
+        self,
+        bucket_prefix: typing.Optional[str] = None,
+        billing_project: typing.Optional[str] = None,
+        root: typing.Optional[str] = None,
+        preferred: typing.Optional[repository.AbstractGridRepository] = None,
+        last_known: typing.Optional[repository.AbstractGridRepository] = None,
+        current: typing.Optional[repository.AbstractGridRepository] = None,
+    ):
+        """
+        The repositories are built from the bucket, billing project and root unless they're
+        injected, e.g. the local stand-ins of adapters.local_repository
+        """
+        self.preferred = preferred or repository.FilesystemGridRepository(root=root)
+        self.last_known = last_known or repository.GoogleCloudStorageGridRepository(
             bucket_name=bucket_prefix
         )
-        self.current = repository.BigqueryGridRepository(
+        self.current = current or repository.BigqueryGridRepository(
             billing_project=billing_project
         )
 
-    def __enter__(self):
-        self.preferred.get()
-
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
+
+
+class AbstractAsyncUnitOfWork(abc.ABC):
+    preferred: async_repository.AbstractAsyncGridRepository
+    current: async_repository.AbstractAsyncGridRepository
+    last_known: async_repository.AbstractAsyncGridRepository
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class AsyncStateUnitOfWork(AbstractAsyncUnitOfWork):
+    def __init__(
+        self,
+        bucket_prefix: typing.Optional[str] = None,
+        billing_project: typing.Optional[str] = None,
+        root: typing.Optional[str] = None,
+        preferred: typing.Optional[repository.AbstractGridRepository] = None,
+        last_known: typing.Optional[repository.AbstractGridRepository] = None,
+        current: typing.Optional[repository.AbstractGridRepository] = None,
+        max_in_flight: int = async_repository.MAX_IN_FLIGHT,
+    ):
+        """
+        Like StateUnitOfWork, the blocking calls of all three repositories share one thread pool
+        that's shut down on exit
+        :param max_in_flight: calls running at once, per repository
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=3 * max_in_flight, thread_name_prefix="offloaded"
+        )
+        self.preferred = async_repository.OffloadedGridRepository(
+            preferred or repository.FilesystemGridRepository(root=root),
+            self.executor,
+            max_in_flight,
+        )
+        self.last_known = async_repository.OffloadedGridRepository(
+            last_known
+            or repository.GoogleCloudStorageGridRepository(bucket_name=bucket_prefix),
+            self.executor,
+            max_in_flight,
+        )
+        self.current = async_repository.OffloadedGridRepository(
+            current
+            or repository.BigqueryGridRepository(billing_project=billing_project),
+            self.executor,
+            max_in_flight,
+        )
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.executor.shutdown(wait=True)
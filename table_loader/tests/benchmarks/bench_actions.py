@@ -0,0 +1,55 @@
+"""
+Times decide_actions over a synthetic inventory.
+
+    PYTHONPATH=table_loader/src python -m table_loader.tests.benchmarks.bench_actions --grids 100000
+"""
+
+import argparse
+import time
+
+from synchronisation.domain import model
+from synchronisation.service_layer import actions
+
+SCHEMA = [{"name": "ID", "type": "INTEGER", "mode": "REQUIRED", "description": ""}]
+# calculated once, like the digests the loader caches per schema file
+SCHEMA_DIGEST = model.make_schema_digest(SCHEMA)
+
+
+def make_states(grids: int):
+    preferred_state, last_known, current = {}, {}, {}
+    for i in range(grids):
+        grid_id = f"project.dataset.table_{i}"
+        for state, payload_hash in (
+            (preferred_state, f"{i}"),
+            (last_known, f"{i}" if i % 10 else "stale"),
+            (current, ""),
+        ):
+            table = model.Table()
+            table.grid_id = grid_id
+            table.payload_hash = payload_hash
+            table.set_schema(SCHEMA, SCHEMA_DIGEST)
+            state[grid_id] = table
+    return preferred_state, last_known, current
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    preferred_state, last_known, current = make_states(args.grids)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        decided = actions.decide_actions(preferred_state, last_known, current)
+        timings.append(time.perf_counter() - start)
+
+    print(
+        f"decide_actions: {args.grids} grids, {len(decided)} actions, "
+        f"best {min(timings):.3f}s, worst {max(timings):.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
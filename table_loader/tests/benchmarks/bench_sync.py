@@ -0,0 +1,289 @@
+"""
+Runs the whole synchronisation against local stand-ins over a synthetic projects/ tree and prints
+a JSON report with the wall time, throughput and peak RSS of every stage.
+
+    PYTHONPATH=table_loader/src python -m table_loader.tests.benchmarks.bench_sync \
+        --projects 2 --datasets 4 --tables 50 --rows 1000
+
+The tree is loaded once, then a fraction of the tables is changed and the measured run scans,
+hashes, lists, diffs and applies it the way a nightly run would, each stage timed on its own.
+"""
+
+import argparse
+import collections
+import os
+import random
+import resource
+import shutil
+import simplejson as json
+import tempfile
+import time
+
+from synchronisation.adapters import (
+    instrumentation,
+    local_repository,
+    repository,
+    repository_loader,
+)
+from synchronisation.service_layer import actions, scheduler, uow
+
+SCHEMA = [
+    {"name": "ID", "type": "INTEGER", "mode": "REQUIRED", "description": ""},
+    {"name": "NAME", "type": "STRING", "mode": "NULLABLE", "description": ""},
+]
+
+
+def write_payload(path: str, rows: int, row_size: int, seed: int) -> int:
+    generator = random.Random(seed)
+    size = 0
+    with open(path, "w") as f:
+        for i in range(rows):
+            name = f"{generator.getrandbits(4 * row_size):0{row_size}x}"
+            row = f'{{"ID": {i}, "NAME": "{name}"}}\n'
+            f.write(row)
+            size += len(row)
+    return size
+
+
+def generate_projects(
+    root: str, projects: int, datasets: int, tables: int, rows: int, row_size: int
+) -> int:
+    """
+    :return: the size of all the payloads in bytes
+    """
+    size = 0
+    for p in range(projects):
+        for d in range(datasets):
+            dataset_path = os.path.join(root, f"project_{p}", f"dataset_{d}")
+            os.makedirs(dataset_path)
+            for t in range(tables):
+                table_path = os.path.join(dataset_path, f"table_{t}")
+                with open(f"{table_path}.json", "w") as f:
+                    json.dump(SCHEMA, f)
+                size += write_payload(
+                    f"{table_path}.jsonl", rows, row_size, seed=hash((p, d, t))
+                )
+    return size
+
+
+def change_tables(root: str, fraction: float, rows: int, row_size: int) -> int:
+    """
+    Rewrites a fraction of the payloads with one extra row
+    :return: the number of tables changed
+    """
+    changed = 0
+    generator = random.Random(0)
+    for directory, _, files in sorted(os.walk(root)):
+        for file in sorted(files):
+            if file.endswith(".jsonl") and generator.random() < fraction:
+                write_payload(
+                    os.path.join(directory, file), rows + 1, row_size, seed=changed
+                )
+                changed += 1
+    return changed
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on linux, the validator's process pool counts as children
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+class Stages:
+    def __init__(self):
+        self.report = collections.OrderedDict()
+
+    def record(self, name: str, start: float, grids: int, size: int = 0):
+        seconds = time.perf_counter() - start
+        self.report[name] = {
+            "seconds": round(seconds, 4),
+            "grids": grids,
+            "grids_per_second": round(grids / seconds, 1) if seconds else None,
+            "bytes": size,
+            "bytes_per_second": round(size / seconds, 1) if seconds and size else None,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=2)
+    parser.add_argument("--datasets", type=int, default=4)
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--row-size", type=int, default=32, help="bytes per row")
+    parser.add_argument(
+        "--changed", type=float, default=0.1, help="fraction of tables changed"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per call")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-workers", type=int, default=scheduler.MAX_WORKERS)
+    parser.add_argument("--output", help="JSON report file, defaults to stdout")
+    parser.add_argument(
+        "--work-dir", help="kept after the run, defaults to a temporary directory"
+    )
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="table_loader_bench_")
+    projects_root = os.path.join(work_dir, "projects")
+    # the loader resolves the projects directory from the working directory
+    os.chdir(work_dir)
+    faults = local_repository.Faults(
+        latency=args.latency, failure_rate=args.failure_rate, seed=0
+    )
+
+    def make_unit_of_work(project: str):
+        last_known = local_repository.LocalBucketGridRepository(
+            bucket_name="bucket", root=os.path.join(work_dir, "storage"), faults=faults
+        )
+        return uow.StateUnitOfWork(
+            preferred=repository.FilesystemGridRepository(root=projects_root),
+            last_known=last_known,
+            current=local_repository.LocalWarehouseGridRepository(
+                billing_project=project,
+                root=os.path.join(work_dir, "warehouse"),
+                storage=last_known.client,
+                faults=faults,
+            ),
+        )
+
+    def synchronise(project: str, dataset: str):
+        unit_of_work = make_unit_of_work(project)
+        # the local warehouse's job threads are shut down along with the unit of work
+        with unit_of_work.current:
+            return actions.synchronise(unit_of_work, project, dataset)
+
+    def synchronise_all():
+        index = repository_loader.scan_projects(projects_root)
+        return scheduler.synchronise_all(
+            units=[
+                (project, dataset)
+                for project in sorted(index)
+                for dataset in sorted(index[project])
+            ],
+            sync=synchronise,
+            max_workers=args.max_workers,
+        )
+
+    stages = Stages()
+    grids = args.projects * args.datasets * args.tables
+
+    start = time.perf_counter()
+    size = generate_projects(
+        projects_root,
+        args.projects,
+        args.datasets,
+        args.tables,
+        args.rows,
+        args.row_size,
+    )
+    stages.record("generate", start, grids, size)
+
+    start = time.perf_counter()
+    initial = synchronise_all()
+    stages.record("initial_load", start, grids, size)
+
+    changed = change_tables(projects_root, args.changed, args.rows, args.row_size)
+
+    start = time.perf_counter()
+    index = repository_loader.scan_projects(projects_root)
+    grid_types = {
+        (project, dataset): index[project][dataset]
+        for project in sorted(index)
+        for dataset in sorted(index[project])
+    }
+    stages.record("scan", start, sum(map(len, grid_types.values())))
+
+    start = time.perf_counter()
+    preferred_states = {
+        unit: repository_loader.get_preferred_state(*unit, grid_types=types)
+        for unit, types in grid_types.items()
+    }
+    size = sum(
+        os.path.getsize(f"{os.path.join(projects_root, *unit, grid_name)}.jsonl")
+        for unit, types in grid_types.items()
+        for grid_name in types
+    )
+    stages.record("hash", start, grids, size)
+
+    start = time.perf_counter()
+    states = {}
+    for project, dataset in preferred_states:
+        unit_of_work = make_unit_of_work(project)
+        with unit_of_work.current:
+            states[project, dataset] = (
+                unit_of_work.last_known.get_state(prefix=f"{project}/{dataset}/"),
+                unit_of_work.current.get_state(dataset_id=f"{project}.{dataset}"),
+            )
+    stages.record("list", start, grids)
+
+    start = time.perf_counter()
+    plans = {}
+    for (project, dataset), preferred_state in preferred_states.items():
+        last_known, current = states[project, dataset]
+        decided_actions = actions.decide_actions(
+            preferred_state=preferred_state, last_known=last_known, current=current
+        )
+        plans[project, dataset] = actions.DatasetPlan(
+            project=project,
+            dataset=dataset,
+            actions=decided_actions,
+            preferred={
+                grid_id: preferred_state[grid_id]
+                for grid_id in decided_actions
+                if grid_id in preferred_state
+            },
+            current={
+                grid_id: current[grid_id]
+                for grid_id in decided_actions
+                if grid_id in current
+            },
+        )
+    decided = collections.Counter(
+        action for plan in plans.values() for action in plan.actions.values()
+    )
+    stages.record("diff", start, grids)
+
+    def apply(project: str, dataset: str):
+        unit_of_work = make_unit_of_work(project)
+        with unit_of_work, unit_of_work.current:
+            return actions.apply_plan(unit_of_work, plans[project, dataset])
+
+    # only the plans built above are applied, nothing is scanned, hashed or listed again
+    start = time.perf_counter()
+    applied = scheduler.synchronise_all(
+        units=list(plans), sync=apply, max_workers=args.max_workers
+    )
+    stages.record("apply", start, sum(decided.values()))
+
+    report = json.dumps(
+        {
+            "parameters": vars(args),
+            "changed_tables": changed,
+            "actions": dict(decided),
+            "errors": [
+                f"{result.project}.{result.dataset}: {result.error}"
+                for result in initial.errors + applied.errors
+            ],
+            "stages": stages.report,
+            # cumulative over both runs
+            "instrumentation": instrumentation.METRICS.report(),
+            "peak_rss_bytes": peak_rss_bytes(),
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if not args.work_dir:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
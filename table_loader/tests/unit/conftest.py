@@ -2,6 +2,7 @@ import pytest
 from py.path import local
 from uuid import uuid1
 from google.cloud import bigquery
+import table_loader.tests.unit.helpers as tuh
 
 
 def pytest_addoption(parser):
@@ -9,6 +10,13 @@ def pytest_addoption(parser):
     parser.addoption("--project-id")
 
 
+@pytest.fixture(autouse=True)
+def close_warehouses():
+    yield
+    while tuh.WAREHOUSES:
+        tuh.WAREHOUSES.pop().close()
+
+
 @pytest.fixture()
 def bucket_name(pytestconfig) -> str:
     return pytestconfig.getoption("bucket_name")
@@ -0,0 +1,38 @@
+"""
+Builders shared by the tests that synchronise against the local stand-ins
+"""
+
+from synchronisation.adapters import local_repository, repository
+from synchronisation.service_layer import uow
+import json
+import table_loader.tests.unit.variables as tuv
+
+# the local warehouses built during the running test, the close_warehouses fixture shuts
+# their job threads down
+WAREHOUSES = []
+
+
+def make_unit_of_work(tmpdir, faults=None):
+    last_known = local_repository.LocalBucketGridRepository(
+        bucket_name="bucket", root=str(tmpdir.join("storage")), faults=faults
+    )
+    current = local_repository.LocalWarehouseGridRepository(
+        billing_project="project",
+        root=str(tmpdir.join("warehouse")),
+        storage=last_known.client,
+        faults=faults,
+    )
+    WAREHOUSES.append(current)
+    return uow.StateUnitOfWork(
+        preferred=repository.FilesystemGridRepository(
+            root=str(tmpdir.join("projects"))
+        ),
+        last_known=last_known,
+        current=current,
+    )
+
+
+def write_table(tmpdir, rows):
+    dataset = tmpdir.join("projects", "project", "dataset").ensure(dir=True)
+    dataset.join("table.json").write(json.dumps(tuv.JSON_SCHEMA_2))
+    dataset.join("table.jsonl").write("".join(f"{json.dumps(row)}\n" for row in rows))
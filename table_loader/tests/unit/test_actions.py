@@ -0,0 +1,164 @@
+from synchronisation.domain import model
+from synchronisation.service_layer import actions
+import logging
+import table_loader.tests.unit.variables as tuv
+
+logger = logging.getLogger(__name__)
+
+
+def make_table(grid_id, payload_hash=tuv.PAYLOAD_2_HASH, schema=None):
+    table = model.Table()
+    table.grid_id = grid_id
+    table.payload_hash = payload_hash
+    table.schema = schema if schema is not None else tuv.JSON_SCHEMA_2
+    return table
+
+
+def test_new_grid_is_created():
+    preferred = {"p.d.t": make_table("p.d.t")}
+
+    assert actions.decide_actions(preferred, {}, {}) == {"p.d.t": actions.CREATE}
+
+
+def test_unchanged_grid_is_left_alone():
+    preferred = {"p.d.t": make_table("p.d.t")}
+    last_known = {"p.d.t": make_table("p.d.t", schema=[])}
+    current = {"p.d.t": make_table("p.d.t", payload_hash="")}
+
+    assert actions.decide_actions(preferred, last_known, current) == {}
+
+
+def test_changed_payload_is_replaced():
+    preferred = {"p.d.t": make_table("p.d.t")}
+    last_known = {"p.d.t": make_table("p.d.t", payload_hash=tuv.PAYLOAD_1_HASH)}
+    current = {"p.d.t": make_table("p.d.t")}
+
+    assert actions.decide_actions(preferred, last_known, current) == {
+        "p.d.t": actions.REPLACE
+    }
+
+
+def test_schema_changed_behind_our_back_is_replaced():
+    preferred = {"p.d.t": make_table("p.d.t")}
+    last_known = {"p.d.t": make_table("p.d.t")}
+    current = {"p.d.t": make_table("p.d.t", schema=tuv.JSON_SCHEMA_1)}
+
+    assert actions.decide_actions(preferred, last_known, current) == {
+        "p.d.t": actions.REPLACE
+    }
+
+
+def test_additive_schema_change_is_patched():
+    preferred_schema = tuv.JSON_SCHEMA_1 + [{"name": "NAME", "type": "STRING"}]
+    preferred = {"p.d.t": make_table("p.d.t", schema=preferred_schema)}
+    last_known = {"p.d.t": make_table("p.d.t")}
+    current = {"p.d.t": make_table("p.d.t", schema=tuv.JSON_SCHEMA_1)}
+
+    assert actions.decide_actions(preferred, last_known, current) == {
+        "p.d.t": actions.UPDATE_SCHEMA
+    }
+
+
+def test_large_changed_payload_is_merged():
+    preferred = {"p.d.t": make_table("p.d.t")}
+    preferred["p.d.t"].rows = actions.INCREMENTAL_MIN_ROWS
+    last_known = {"p.d.t": make_table("p.d.t", payload_hash=tuv.PAYLOAD_1_HASH)}
+    current = {"p.d.t": make_table("p.d.t")}
+
+    assert actions.decide_actions(preferred, last_known, current) == {
+        "p.d.t": actions.MERGE
+    }
+
+
+def test_changed_refresh_options_are_replaced():
+    def make_materialised_view(refresh_enabled=True, refresh_interval=1800000):
+        view = model.MaterialisedView(
+            refresh_enabled=refresh_enabled, refresh_interval=refresh_interval
+        )
+        view.grid_id = "p.d.v"
+        view.query = "select 1"
+        return view
+
+    last_known = {"p.d.v": model.MaterialisedView(grid_id="p.d.v")}
+    current = {"p.d.v": make_materialised_view()}
+
+    assert actions.decide_actions(
+        {"p.d.v": make_materialised_view(refresh_interval=3600000)},
+        last_known,
+        current,
+    ) == {"p.d.v": actions.REPLACE}
+    assert actions.decide_actions(
+        {"p.d.v": make_materialised_view(refresh_enabled=False)},
+        last_known,
+        current,
+    ) == {"p.d.v": actions.REPLACE}
+    assert (
+        actions.decide_actions(
+            {"p.d.v": make_materialised_view()},
+            last_known,
+            current,
+        )
+        == {}
+    )
+
+
+def test_changed_metadata_is_updated():
+    preferred = {"p.d.t": make_table("p.d.t")}
+    preferred["p.d.t"].description = tuv.DESCRIPTION
+    last_known = {"p.d.t": make_table("p.d.t")}
+    current = {"p.d.t": make_table("p.d.t")}
+
+    assert actions.decide_actions(preferred, last_known, current) == {
+        "p.d.t": actions.UPDATE
+    }
+
+
+def test_removed_grid_is_deleted_and_unmanaged_grid_is_untouched():
+    last_known = {"p.d.removed": make_table("p.d.removed")}
+    current = {
+        "p.d.removed": make_table("p.d.removed"),
+        "p.d.unmanaged": make_table("p.d.unmanaged"),
+    }
+
+    assert actions.decide_actions({}, last_known, current) == {
+        "p.d.removed": actions.DELETE
+    }
+
+
+class FakeBigqueryGridRepository:
+    def __init__(self):
+        self.calls = []
+
+    def update(self, **kwargs):
+        self.calls.append(("update", kwargs))
+
+    def remove(self, grid_id):
+        self.calls.append(("remove", grid_id))
+
+
+class FakeUnitOfWork:
+    def __init__(self):
+        self.current = FakeBigqueryGridRepository()
+
+
+def test_metadata_change_is_patched_in_place():
+    preferred = make_table("p.d.t")
+    preferred.description = tuv.DESCRIPTION
+    preferred.labels = tuv.LABELS
+    current = make_table("p.d.t")
+    unit_of_work = FakeUnitOfWork()
+
+    decided = actions.decide_table_action(preferred, make_table("p.d.t"), current)
+    actions.HANDLERS[decided](unit_of_work, "p.d.t", preferred, current)
+
+    assert unit_of_work.current.calls == [
+        (
+            "update",
+            {
+                "grid_id": "p.d.t",
+                "description": tuv.DESCRIPTION,
+                "labels": tuv.LABELS,
+                "previous_labels": current.labels,
+            },
+        )
+    ]
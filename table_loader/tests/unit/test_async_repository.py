@@ -0,0 +1,71 @@
+from synchronisation.adapters import local_repository, repository
+from synchronisation.service_layer import uow
+import asyncio
+import table_loader.tests.unit.helpers as tuh
+import time
+
+
+def make_unit_of_work(tmpdir, faults=None):
+    last_known = local_repository.LocalBucketGridRepository(
+        bucket_name="bucket", root=str(tmpdir.join("storage")), faults=faults
+    )
+    current = local_repository.LocalWarehouseGridRepository(
+        billing_project="project",
+        root=str(tmpdir.join("warehouse")),
+        storage=last_known.client,
+        faults=faults,
+    )
+    tuh.WAREHOUSES.append(current)
+    return uow.AsyncStateUnitOfWork(
+        preferred=repository.FilesystemGridRepository(
+            root=str(tmpdir.join("projects"))
+        ),
+        last_known=last_known,
+        current=current,
+    )
+
+
+def test_uploads_overlap(tmpdir):
+    latency = 0.05
+    tables = 40
+    payload = tmpdir.join("table.jsonl")
+    payload.write('{"ID": 1}\n')
+
+    async def upload():
+        async with make_unit_of_work(
+            tmpdir, faults=local_repository.Faults(latency=latency)
+        ) as unit_of_work:
+            results = await unit_of_work.last_known.map(
+                "add",
+                [
+                    (str(payload), f"project/dataset/table_{i}.jsonl")
+                    for i in range(tables)
+                ],
+            )
+            state = await unit_of_work.last_known.get_state(prefix="project/dataset/")
+        return results, state
+
+    start = time.perf_counter()
+    results, state = asyncio.run(upload())
+    seconds = time.perf_counter() - start
+
+    assert not [result for result in results if isinstance(result, Exception)]
+    assert len(state) == tables
+    # one after the other they'd take tables * latency
+    assert seconds < tables * latency / 2
+
+
+def test_failures_are_returned_in_order(tmpdir):
+    payload = tmpdir.join("table.jsonl")
+    payload.write('{"ID": 1}\n')
+
+    async def upload():
+        async with make_unit_of_work(
+            tmpdir, faults=local_repository.Faults(failure_rate=1.0)
+        ) as unit_of_work:
+            return await unit_of_work.last_known.map(
+                "add", [(str(payload), "project/dataset/table.jsonl")]
+            )
+
+    (result,) = asyncio.run(upload())
+    assert isinstance(result, Exception)
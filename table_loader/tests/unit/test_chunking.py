@@ -0,0 +1,52 @@
+from synchronisation.adapters import chunking
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROWS = [f'{{"ID":{i}, "NAME":"{"x" * (i % 17)}"}}\n' for i in range(2000)]
+
+
+def split(file_path, rows):
+    file_path.write("".join(rows))
+    return chunking.split_chunks(
+        str(file_path), min_size=1024, average_size=4096, max_size=16384
+    )
+
+
+def test_chunks_cover_the_whole_payload(tmpdir):
+    chunks = split(tmpdir.join("payload.jsonl"), ROWS)
+
+    assert len(chunks) > 1
+    assert sum(chunk.rows for chunk in chunks) == len(ROWS)
+    assert sum(chunk.size for chunk in chunks) == len("".join(ROWS))
+    # a chunk is cut after the row that takes it past the maximum size
+    assert all(1024 <= chunk.size < 16384 + 64 for chunk in chunks[:-1])
+
+
+def test_an_edit_only_changes_nearby_chunks(tmpdir):
+    before = split(tmpdir.join("before.jsonl"), ROWS)
+    after = split(
+        tmpdir.join("after.jsonl"), ROWS[:1000] + ['{"ID":-1}\n'] + ROWS[1000:]
+    )
+
+    changed = {chunk.digest for chunk in after} - {chunk.digest for chunk in before}
+    assert 1 <= len(changed) <= 2
+
+
+def test_chunk_and_manifest_round_trip(tmpdir):
+    payload = tmpdir.join("payload.jsonl")
+    chunks = split(payload, ROWS)
+    chunk_file = str(tmpdir.join("chunk"))
+    manifest_file = str(tmpdir.join("manifest"))
+
+    chunking.write_chunk(str(payload), chunks[1], chunk_file)
+    chunking.write_manifest(chunks, "hash", len(ROWS), manifest_file)
+
+    with open(chunk_file) as f:
+        start = chunks[1].offset
+        assert f.read() == payload.read()[start:][: chunks[1].size]
+    assert chunking.read_manifest(manifest_file) == {
+        "payload_hash": "hash",
+        "rows": len(ROWS),
+        "chunks": chunks,
+    }
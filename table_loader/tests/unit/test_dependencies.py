@@ -0,0 +1,42 @@
+from synchronisation.domain import model
+from synchronisation.service_layer import dependencies
+import pytest
+
+
+def test_views_are_levelled_after_what_they_read_from():
+    grids = {
+        "p.d.table": model.Table(grid_id="p.d.table"),
+        "p.d.base": model.View(grid_id="p.d.base", query="select * from d.table"),
+        "p.d.other": model.View(grid_id="p.d.other", query="select 1"),
+        "p.d.top": model.MaterialisedView(
+            grid_id="p.d.top",
+            query="select * from `p.d.base` join p.d.table using (id)",
+        ),
+    }
+
+    assert dependencies.get_levels(dependencies.get_dependencies(grids)) == [
+        ["p.d.other", "p.d.table"],
+        ["p.d.base"],
+        ["p.d.top"],
+    ]
+
+
+def test_cycles_are_reported():
+    with pytest.raises(dependencies.CyclicDependencyError) as e:
+        dependencies.get_levels({"a": {"b"}, "b": {"a"}, "c": {"a"}, "d": set()})
+    assert e.value.nodes == ["a", "b", "c"]
+
+
+def test_datasets_in_a_cycle_are_synchronised_last():
+    units = [("p", "a"), ("p", "b"), ("p", "c"), ("p", "d")]
+    queries = {
+        "p.b.view": "select * from a.table",
+        "p.c.view": "select * from d.view",
+        "p.d.view": "select * from c.view",
+    }
+
+    assert dependencies.get_unit_levels(units, queries) == [
+        [("p", "a")],
+        [("p", "b")],
+        [("p", "c"), ("p", "d")],
+    ]
@@ -0,0 +1,77 @@
+from synchronisation.adapters import fingerprint_cache, repository_loader
+import json
+import sqlite3
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def test_unchanged_file_is_served_from_cache(tmpdir):
+    file_path = tmpdir.join("static.jsonl")
+    file_path.write('{"STATIC_ID":1}\n')
+
+    with fingerprint_cache.FingerprintCache(str(tmpdir.join("cache.sqlite"))) as cache:
+        cache.set(
+            str(file_path), fingerprint_cache.Fingerprint(crc32c="cached", rows=7)
+        )
+
+        assert repository_loader.get_payload_fingerprint(str(file_path), cache) == (
+            "cached",
+            7,
+        )
+
+
+def test_changed_file_is_hashed_again(tmpdir):
+    file_path = tmpdir.join("static.jsonl")
+    file_path.write('{"STATIC_ID":1}\n')
+
+    with fingerprint_cache.FingerprintCache(str(tmpdir.join("cache.sqlite"))) as cache:
+        cache.set(
+            str(file_path), fingerprint_cache.Fingerprint(crc32c="cached", rows=7)
+        )
+        file_path.write('{"STATIC_ID":1}\n{"STATIC_ID":2}\n')
+        stat = os.stat(str(file_path))
+        os.utime(str(file_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        assert cache.get(str(file_path)) is None
+        assert repository_loader.get_payload_fingerprint(
+            str(file_path), cache
+        ) == repository_loader.make_file_crc32c(str(file_path))
+
+
+def test_cache_persists_across_runs(tmpdir):
+    schema_path = tmpdir.join("static.json")
+    schema_path.write('[{"name": "STATIC_ID", "type": "INTEGER"}]')
+    cache_file = str(tmpdir.join("cache.sqlite"))
+
+    with fingerprint_cache.FingerprintCache(cache_file) as cache:
+        schema = repository_loader.get_schema(str(schema_path), cache)
+
+    with fingerprint_cache.FingerprintCache(cache_file) as cache:
+        assert json.loads(cache.get(str(schema_path)).schema) == schema
+
+
+def test_parsed_view_is_served_from_cache(tmpdir, monkeypatch):
+    sql_path = tmpdir.join("view.sql")
+    sql_path.write("create view `p.d.view` as select 1")
+    cache_file = str(tmpdir.join("cache.sqlite"))
+    # a cache file written before views were cached
+    connection = sqlite3.connect(cache_file)
+    connection.execute(
+        "create table fingerprints (path text primary key, size integer not null, "
+        "mtime_ns integer not null, inode integer not null, crc32c text, rows integer, "
+        "schema text)"
+    )
+    connection.close()
+
+    with fingerprint_cache.FingerprintCache(cache_file) as cache:
+        view = repository_loader.get_view(str(sql_path), cache)
+
+    def parse(sql_file):
+        raise AssertionError("parsed an unchanged view")
+
+    monkeypatch.setattr(repository_loader, "read_view", parse)
+    with fingerprint_cache.FingerprintCache(cache_file) as cache:
+        assert repository_loader.get_view(str(sql_path), cache) == view
+    assert view == ("select 1", repository_loader.make_query_fingerprint("select 1"))
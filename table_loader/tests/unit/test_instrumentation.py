@@ -0,0 +1,64 @@
+from synchronisation.adapters import instrumentation
+from synchronisation.service_layer import actions
+import json
+import logging
+import table_loader.tests.unit.helpers as tuh
+import table_loader.tests.unit.variables as tuv
+
+logger = logging.getLogger(__name__)
+
+
+def test_run_report(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    metrics = instrumentation.METRICS
+    metrics.reset()
+
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    report = metrics.report()
+
+    assert {"scan", "hash", "list", "diff", "upload", "load"} <= set(report["stages"])
+    assert report["bytes"]["hashed"] > 0
+    assert report["bytes"]["uploaded"] > 0
+    assert report["api_calls"]["LocalBucketGridRepository.add"] == {
+        "upload_from_filename": 2
+    }
+    assert report["api_calls"]["LocalWarehouseGridRepository.start"] == {
+        "create_table": 1,
+        "load_table_from_uri": 1,
+    }
+    assert "unattributed" not in report["api_calls"]
+
+
+def test_scanned_dataset_is_not_scanned_again(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    metrics = instrumentation.METRICS
+    metrics.reset()
+
+    actions.synchronise(
+        tuh.make_unit_of_work(tmpdir), "project", "dataset", {"table": "table"}
+    )
+
+    assert "scan" not in metrics.report()["stages"]
+
+
+def test_report_files(tmpdir):
+    metrics = instrumentation.Metrics()
+    with metrics.stage("scan"):
+        metrics.add_bytes("hashed", 10)
+    with metrics.method("Repository.list"):
+        metrics.count_call("list_blobs")
+
+    metrics.write_report(str(tmpdir.join("report.json")))
+    metrics.write_prometheus(str(tmpdir.join("table_loader.prom")))
+
+    report = json.loads(tmpdir.join("report.json").read())
+    assert report["stages"]["scan"]["runs"] == 1
+    assert report["api_calls"] == {"Repository.list": {"list_blobs": 1}}
+    prometheus = tmpdir.join("table_loader.prom").read()
+    assert 'table_loader_bytes{kind="hashed"} 10' in prometheus
+    assert (
+        'table_loader_api_calls{method="Repository.list",call="list_blobs"} 1'
+        in prometheus
+    )
@@ -0,0 +1,207 @@
+from google.api_core import exceptions
+from synchronisation.adapters import (
+    chunking,
+    instrumentation,
+    local_repository,
+    repository,
+)
+from synchronisation.domain import model
+from synchronisation.service_layer import actions
+import functools
+import json
+import logging
+import pytest
+import table_loader.tests.unit.helpers as tuh
+import table_loader.tests.unit.variables as tuv
+
+logger = logging.getLogger(__name__)
+
+
+def test_synchronising_against_local_stand_ins(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+
+    decided = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    unchanged = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2 + [{"ID": 4, "NAME": "FOUR"}])
+    changed = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+
+    assert decided == {"project.dataset.table": actions.CREATE}
+    assert unchanged == {}
+    assert changed == {"project.dataset.table": actions.REPLACE}
+    current = tuh.make_unit_of_work(tmpdir).current.get_state("project.dataset")
+    assert current["project.dataset.table"].rows == 3
+
+
+def test_failed_load_is_not_published(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2 + [{"ID": 4, "NAME": "FOUR"}])
+
+    def fail(self, source_id, table_id, job_config):
+        raise exceptions.InternalServerError(f"Copying {source_id} failed")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(local_repository.LocalBigqueryClient, "copy", fail)
+        with pytest.raises(actions.SynchronisationError):
+            actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    retried = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+
+    assert retried == {"project.dataset.table": actions.REPLACE}
+    unit_of_work = tuh.make_unit_of_work(tmpdir)
+    assert (
+        unit_of_work.current.get_state("project.dataset")["project.dataset.table"].rows
+        == 3
+    )
+    assert unit_of_work.last_known.index("_staging/") == {}
+
+
+def test_merged_table_only_uploads_the_changed_chunks(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(actions, "INCREMENTAL_MIN_ROWS", 10)
+    monkeypatch.setattr(
+        repository.chunking,
+        "split_chunks",
+        functools.partial(
+            chunking.split_chunks, min_size=1024, average_size=4096, max_size=16384
+        ),
+    )
+    rows = [{"ID": i, "NAME": f"{i:0100d}"} for i in range(500)]
+    metrics = instrumentation.METRICS
+
+    def uploaded():
+        return metrics.report()["bytes"].get("uploaded", 0)
+
+    tuh.write_table(tmpdir, rows)
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    tuh.write_table(tmpdir, rows + [{"ID": 500, "NAME": "FIVE HUNDRED"}])
+    # the first merge chunks the payload
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    payload_size = tmpdir.join("projects", "project", "dataset", "table.jsonl").size()
+    before = uploaded()
+    tuh.write_table(
+        tmpdir,
+        rows + [{"ID": 500, "NAME": "FIVE HUNDRED"}, {"ID": 501, "NAME": "ONE MORE"}],
+    )
+    merged = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+
+    assert merged == {"project.dataset.table": actions.MERGE}
+    # the row, the chunk around it, the manifest, the schema and the row hashes
+    assert uploaded() - before < payload_size / 2
+    state = tuh.make_unit_of_work(tmpdir).last_known.get_state("project/dataset/")
+    assert list(state["project.dataset.table"].payload)[-1]["NAME"] == "ONE MORE"
+
+
+def test_unchanged_schema_is_not_uploaded_again(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+
+    def generations():
+        return {
+            name: fingerprint.generation
+            for name, fingerprint in tuh.make_unit_of_work(tmpdir)
+            .last_known.index("project/dataset/")
+            .items()
+        }
+
+    published = generations()
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2 + [{"ID": 4, "NAME": "FOUR"}])
+    actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    republished = generations()
+
+    assert republished["project/dataset/table.json"] == (
+        published["project/dataset/table.json"]
+    )
+    assert republished["project/dataset/table.jsonl"] != (
+        published["project/dataset/table.jsonl"]
+    )
+
+
+def test_injected_failures(tmpdir):
+    unit_of_work = tuh.make_unit_of_work(
+        tmpdir, faults=local_repository.Faults(failure_rate=1.0)
+    )
+    payload = tmpdir.join("table.jsonl")
+    payload.write('{"ID": 1}\n')
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        unit_of_work.last_known.add(str(payload), "project/dataset/table.jsonl")
+    errors = unit_of_work.current.add_many(
+        [("project.dataset.table", tuv.JSON_SCHEMA_1, None, None)]
+    )
+    assert isinstance(errors["project.dataset.table"], exceptions.ServiceUnavailable)
+
+
+def test_replaced_table_is_swapped_in_place(tmpdir):
+    unit_of_work = tuh.make_unit_of_work(tmpdir)
+    payload = tmpdir.join("table.jsonl")
+    grid = (
+        "project.dataset.table",
+        tuv.JSON_SCHEMA_2,
+        None,
+        "gs://bucket/project/dataset/table.jsonl",
+    )
+
+    def publish(rows):
+        payload.write("".join(f"{json.dumps(row)}\n" for row in rows))
+        unit_of_work.last_known.add(str(payload), "project/dataset/table.jsonl")
+
+    publish(tuv.PAYLOAD_2)
+    unit_of_work.current.add(*grid)
+    created = unit_of_work.current.get("project.dataset.table").created
+    publish(tuv.PAYLOAD_2 + [{"ID": 4, "NAME": "FOUR"}])
+
+    errors = unit_of_work.current.add_many([grid], swap={"project.dataset.table"})
+
+    assert errors == {"project.dataset.table": None}
+    table = unit_of_work.current.get("project.dataset.table")
+    assert table.created == created
+    assert table.num_rows == 3
+    assert unit_of_work.current.list("project.dataset_staging") == []
+
+
+def test_views_are_created_after_what_they_read_from(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    dataset = tmpdir.join("projects", "project", "dataset")
+    # the local warehouse refuses views whose sources don't exist, like bigquery
+    dataset.join("a_top.sql").write(
+        "create materialized view `project.dataset.a_top` "
+        "options (refresh_interval_minutes = 60) as select * from dataset.b_base"
+    )
+    dataset.join("b_base.sql").write(
+        "create view `project.dataset.b_base` as select * from `project.dataset.table`"
+    )
+
+    decided = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    dataset.join("b_base.sql").write(
+        "CREATE VIEW project.dataset.b_base AS\n"
+        "-- reformatting doesn't change the view\n"
+        "SELECT *\n  FROM project.dataset.table;\n"
+    )
+    unchanged = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+    dataset.join("b_base.sql").write(
+        "create view `project.dataset.b_base` as select ID from `project.dataset.table`"
+    )
+    changed = actions.synchronise(tuh.make_unit_of_work(tmpdir), "project", "dataset")
+
+    assert decided == {
+        "project.dataset.table": actions.CREATE,
+        "project.dataset.b_base": actions.CREATE,
+        "project.dataset.a_top": actions.CREATE,
+    }
+    assert unchanged == {}
+    assert changed == {"project.dataset.b_base": actions.REPLACE}
+    current = tuh.make_unit_of_work(tmpdir).current.get_state("project.dataset")
+    assert isinstance(current["project.dataset.a_top"], model.MaterialisedView)
+    assert current["project.dataset.a_top"].refresh_interval == 3600000
+    assert current["project.dataset.b_base"].query.startswith("select ID")
+
+
+def test_closing_the_warehouse_shuts_its_jobs_down(tmpdir):
+    with local_repository.LocalBigqueryClient(str(tmpdir)) as client:
+        assert client.executor.submit(lambda: 1).result() == 1
+    with pytest.raises(RuntimeError):
+        client.executor.submit(lambda: 1)
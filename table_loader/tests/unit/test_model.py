@@ -59,3 +59,151 @@ def test_table_comparison(grid_id):
     local_file.schema = tuv.JSON_SCHEMA_1
     local_file.payload = tuv.PAYLOAD_1
     assert local_file != remote_file
+
+
+def test_additive_schema_diff():
+    current = model.Table()
+    current.schema = tuv.JSON_SCHEMA_1
+    preferred = model.Table()
+    preferred.schema = [
+        {**tuv.JSON_SCHEMA_1[0], "mode": "NULLABLE", "description": "new"},
+        {"name": "NAME", "type": "STRING"},
+    ]
+
+    schema_diff = preferred.diff_schema(current)
+
+    assert schema_diff.is_additive
+    assert [field.name for field in schema_diff.added] == ["NAME"]
+    assert [field.name for field in schema_diff.relaxed] == ["ID"]
+    assert [field.name for field in schema_diff.redescribed] == ["ID"]
+
+
+def test_breaking_schema_diff():
+    current = model.Table()
+    current.schema = tuv.JSON_SCHEMA_2
+    preferred = model.Table()
+    preferred.schema = [{**tuv.JSON_SCHEMA_1[0], "type": "STRING"}]
+
+    schema_diff = preferred.diff_schema(current)
+
+    assert not schema_diff.is_additive
+    assert len(schema_diff.breaking) == 2
+
+
+def test_nested_schema_diff():
+    address = {
+        "name": "ADDRESS",
+        "type": "RECORD",
+        "fields": [{"name": "CITY", "type": "STRING", "mode": "REQUIRED"}],
+    }
+    current = model.Table()
+    current.set_schema([address])
+    added = model.Table()
+    added.set_schema(
+        [{**address, "fields": address["fields"] + [{"name": "ZIP", "type": "STRING"}]}]
+    )
+    retyped = model.Table()
+    retyped.set_schema(
+        [{**address, "fields": [{**address["fields"][0], "type": "INTEGER"}]}]
+    )
+    repeated = model.Table()
+    repeated.set_schema(
+        [{**address, "fields": [{**address["fields"][0], "mode": "REPEATED"}]}]
+    )
+
+    added_diff = added.diff_schema(current)
+    assert added_diff.is_additive
+    assert [field.name for field in added_diff.added] == ["ADDRESS.ZIP"]
+    assert retyped.diff_schema(current).breaking == [
+        "ADDRESS.CITY changed type from STRING to INTEGER"
+    ]
+    assert repeated.diff_schema(current).breaking == [
+        "ADDRESS.CITY changed mode from REQUIRED to REPEATED"
+    ]
+
+
+def test_assigned_schema_gets_a_digest_of_its_own():
+    preferred = model.Table()
+    preferred.set_schema(tuv.JSON_SCHEMA_1)
+    current = model.Table()
+    current.set_schema(tuv.JSON_SCHEMA_1)
+
+    assert preferred.is_schema_equal(current)
+    preferred.schema = tuv.JSON_SCHEMA_2
+    assert not preferred.is_schema_equal(current)
+    assert preferred.get_schema_digest() == model.make_schema_digest(tuv.JSON_SCHEMA_2)
+
+
+def test_schema_diff_agrees_with_schema_equality():
+    current = model.Table()
+    current.set_schema(tuv.JSON_SCHEMA_1)
+    preferred = model.Table()
+    preferred.set_schema([{**tuv.JSON_SCHEMA_1[0], "maxLength": "10"}])
+
+    assert not preferred.is_schema_equal(current)
+    assert not preferred.diff_schema(current).is_additive
+
+
+def test_grids_do_not_share_mutable_defaults():
+    table = model.Table()
+    table.labels["team"] = "data"
+    table.schema.append(tuv.JSON_SCHEMA_1[0])
+
+    other = model.Table()
+
+    assert other.labels == {}
+    assert other.schema == []
+    assert not hasattr(table, "__dict__")
+
+
+def test_table_comparison_streams_payloads_without_hashes():
+    def read_rows(rows):
+        return lambda: (json.dumps(row).encode("utf-8") for row in rows)
+
+    def unreadable():
+        raise AssertionError("payload was read although the hashes are known")
+
+    table = model.Table(payload=model.Payload(read_rows(tuv.PAYLOAD_2)))
+    same = model.Table(payload=model.Payload(read_rows(tuv.PAYLOAD_2)))
+    longer = model.Table(payload=model.Payload(read_rows(tuv.PAYLOAD_2 * 2)))
+    hashed = model.Table(payload_hash="a", payload=model.Payload(unreadable))
+
+    assert table == same
+    assert table != longer
+    assert hashed == model.Table(payload_hash="a", payload=model.Payload(unreadable))
+    assert hashed != model.Table(payload_hash="b", payload=model.Payload(unreadable))
+
+
+def test_equivalent_schemas_have_the_same_digest():
+    schema = [
+        {"name": "ID", "type": "INT64", "mode": "REQUIRED", "description": "id"},
+        {
+            "name": "ADDRESS",
+            "type": "STRUCT",
+            "fields": [{"name": "CITY", "type": "STRING", "key": True}],
+        },
+    ]
+    # the way bigquery reports it, with the defaults filled in and legacy type names
+    reported = [
+        {"description": "id", "mode": "REQUIRED", "name": "ID", "type": "INTEGER"},
+        {
+            "mode": "NULLABLE",
+            "name": "ADDRESS",
+            "type": "RECORD",
+            "description": None,
+            "fields": [{"mode": "NULLABLE", "name": "CITY", "type": "STRING"}],
+        },
+    ]
+    preferred = model.Table()
+    preferred.set_schema_from_json(json.dumps(schema))
+    current = model.Table()
+    current.set_schema(reported)
+    changed = model.Table()
+    changed.set_schema(
+        schema[:1] + [{**schema[1], "fields": [{"name": "CITY", "type": "INT64"}]}]
+    )
+
+    assert preferred.schema_digest == current.schema_digest
+    assert preferred.is_schema_equal(current)
+    assert preferred.diff_schema(current).is_unchanged
+    assert not preferred.is_schema_equal(changed)
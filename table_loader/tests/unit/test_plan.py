@@ -0,0 +1,55 @@
+from synchronisation.adapters import instrumentation
+from synchronisation.service_layer import actions, plan
+import logging
+import os
+import pytest
+import table_loader.tests.unit.helpers as tuh
+import table_loader.tests.unit.variables as tuv
+
+logger = logging.getLogger(__name__)
+
+
+def make_plan_file(tmpdir):
+    plan_file = str(tmpdir.join("plan.json"))
+    plan.write_plans(
+        plan_file,
+        [plan.make_plan(tuh.make_unit_of_work(tmpdir), "project", "dataset")],
+        bucket_name="bucket",
+    )
+    return plan_file
+
+
+def test_applying_a_plan_does_not_collect_the_states_again(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    plan_file = make_plan_file(tmpdir)
+    # a fresh checkout has the same content under new stat metadata
+    payload = tmpdir.join("projects", "project", "dataset", "table.jsonl")
+    os.utime(payload, ns=(0, 0))
+
+    bucket_name, plans = plan.read_plans(plan_file)
+    instrumentation.METRICS.reset()
+    applied = plan.apply_plan(tuh.make_unit_of_work(tmpdir), plans[0])
+
+    assert bucket_name == "bucket"
+    assert applied == {"project.dataset.table": actions.CREATE}
+    assert plans[0].preferred["project.dataset.table"].rows == 2
+    assert not {"scan", "hash", "list", "diff"} & set(
+        instrumentation.METRICS.report()["stages"]
+    )
+    current = tuh.make_unit_of_work(tmpdir).current.get_state("project.dataset")
+    assert current["project.dataset.table"].rows == 2
+
+
+def test_stale_plan_is_not_applied(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2)
+    plan_file = make_plan_file(tmpdir)
+    tuh.write_table(tmpdir, tuv.PAYLOAD_2 + [{"ID": 4, "NAME": "FOUR"}])
+
+    _, plans = plan.read_plans(plan_file)
+    with pytest.raises(plan.StalePlanError) as error:
+        plan.apply_plan(tuh.make_unit_of_work(tmpdir), plans[0])
+
+    assert error.value.grid_ids == ["project.dataset.table"]
+    assert tuh.make_unit_of_work(tmpdir).current.get_state("project.dataset") == {}
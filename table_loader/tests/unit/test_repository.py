@@ -1,6 +1,11 @@
-from synchronisation.adapters import repository
+from google.api_core import exceptions
+from google.cloud import bigquery
+from synchronisation.adapters import chunking, repository, repository_loader
+from synchronisation.domain import model
 
 # import pytest
+import contextlib
+import functools
 import os
 import logging
 from table_loader.tests.helpers import schema_object_from_json
@@ -8,6 +13,168 @@ from table_loader.tests.helpers import schema_object_from_json
 logger = logging.getLogger(__name__)
 
 
+class FakeBlob:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    @property
+    def crc32c(self):
+        return repository_loader.make_crc32c(self.client.blobs[self.name])
+
+    @property
+    def size(self):
+        return len(self.client.blobs[self.name].encode("utf-8"))
+
+    @property
+    def generation(self):
+        return 1
+
+    @property
+    def metadata(self):
+        return self.client.metadata.get(self.name)
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self.client.metadata[self.name] = metadata
+
+    def upload_from_filename(self, filename):
+        if "broken" in filename:
+            raise IOError(f"Unable to upload {filename}")
+        self.client.uploads += 1
+        with open(filename, "r") as f:
+            self.client.blobs[self.name] = f.read()
+
+    def download_to_filename(self, filename):
+        self.client.downloads += 1
+        with open(filename, "w") as f:
+            f.write(self.client.blobs[self.name])
+
+    def download_as_bytes(self, start=None, end=None):
+        self.client.downloads += 1
+        content = self.client.blobs[self.name].encode("utf-8")
+        if start is None:
+            return content
+        stop = None if end is None else end + 1
+        return content[start:stop]
+
+    def delete(self):
+        if self.client.in_batch:
+            self.client.deferred.append(self.name)
+            return
+        if "protected" in self.name:
+            raise exceptions.Forbidden(f"{self.name} can't be deleted")
+        if self.client.blobs.pop(self.name, None) is None:
+            raise exceptions.NotFound(f"{self.name} not found")
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def blob(self, name):
+        return FakeBlob(self.client, name)
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.blobs = {}
+        self.in_batch = False
+        self.deferred = []
+        self.batches = 0
+        self.uploads = 0
+        self.downloads = 0
+        self.metadata = {}
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self)
+
+    def list_blobs(self, bucket_or_name, prefix):
+        return [
+            FakeBlob(self, name)
+            for name in sorted(self.blobs)
+            if name.startswith(prefix)
+        ]
+
+    @contextlib.contextmanager
+    def batch(self):
+        self.batches += 1
+        self.in_batch = True
+        try:
+            yield
+        finally:
+            self.in_batch = False
+        deferred, self.deferred = self.deferred, []
+        failed = [name for name in deferred if "protected" in name]
+        for name in deferred:
+            if name not in failed:
+                self.blobs.pop(name, None)
+        if failed:
+            raise exceptions.Forbidden(f"{failed[0]} can't be deleted")
+
+
+class FakeLoadJob:
+    def __init__(self, client, destination, polls):
+        self.client = client
+        self.destination = destination
+        self.polls = polls
+
+    def done(self):
+        self.polls -= 1
+        return self.polls <= 0
+
+    def result(self):
+        while not self.done():
+            pass
+        self.client.running -= 1
+        if "broken" in self.destination:
+            raise ValueError(f"Unable to load {self.destination}")
+
+
+class FakeBigqueryClient:
+    def __init__(self, job_polls=1):
+        self.job_polls = job_polls
+        self.updates = []
+        self.tables = []
+        self.running = 0
+        self.peak = 0
+        self.calls = []
+        self.existing = {}
+
+    def create_table(self, table):
+        self.tables.append(table)
+
+    def load_table_from_uri(self, source_uris, destination, job_config):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        return FakeLoadJob(self, destination, self.job_polls)
+
+    def update_table(self, table, fields):
+        self.updates.append((table, fields))
+        return table
+
+    def list_tables(self, dataset):
+        self.calls.append("list_tables")
+        return [
+            bigquery.table.TableListItem(
+                {
+                    "tableReference": bigquery.TableReference.from_string(
+                        table_id
+                    ).to_api_repr(),
+                    "type": table.table_type,
+                }
+            )
+            for table_id, table in self.existing.items()
+        ]
+
+    def get_table(self, table):
+        self.calls.append("get_table")
+        return self.existing[table]
+
+    def delete_table(self, table, not_found_ok):
+        self.existing.pop(table, None)
+
+
 # do we need a fake repository at all?
 class FakeFilesystemGridRepository(repository.AbstractGridRepository):
     def __init__(self, root):
@@ -174,6 +341,198 @@ def test_removing_an_uploaded_file(
     gcs_repository.remove(target_postfix=f"{target_postfix}")
 
 
+def test_uploading_many_files(preferred_root, dataset_name):
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    uploads = []
+    for name in ["one", "two", "broken"]:
+        file_path = preferred_root.join(f"{name}.jsonl")
+        file_path.write(f'{{"NAME":"{name}"}}')
+        uploads.append((str(file_path), f"{dataset_name}/{name}.jsonl"))
+
+    results = gcs_repository.add_many(uploads)
+
+    assert sorted(client.blobs) == [
+        f"{dataset_name}/one.jsonl",
+        f"{dataset_name}/two.jsonl",
+    ]
+    assert results[f"{dataset_name}/one.jsonl"] is None
+    assert isinstance(results[f"{dataset_name}/broken.jsonl"], IOError)
+
+
+def test_removing_many_files(dataset_name):
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    names = [f"{dataset_name}/{i}.jsonl" for i in range(250)]
+    client.blobs.update((name, "") for name in names)
+
+    results = gcs_repository.remove_many(names)
+
+    assert client.batches == 3
+    assert client.blobs == {}
+    assert all(error is None for error in results.values())
+
+
+def test_removing_many_files_reports_failures(dataset_name):
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    client.blobs[f"{dataset_name}/present.jsonl"] = ""
+    client.blobs[f"{dataset_name}/protected.jsonl"] = ""
+
+    results = gcs_repository.remove_many(
+        [f"{dataset_name}/present.jsonl", f"{dataset_name}/protected.jsonl"]
+    )
+
+    assert results[f"{dataset_name}/present.jsonl"] is None
+    assert isinstance(results[f"{dataset_name}/protected.jsonl"], exceptions.Forbidden)
+    assert list(client.blobs) == [f"{dataset_name}/protected.jsonl"]
+
+
+def test_only_changed_files_are_uploaded(preferred_root, dataset_name):
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    uploads = []
+    for name in ["one", "two"]:
+        file_path = preferred_root.join(f"{name}.jsonl")
+        file_path.write(f'{{"NAME":"{name}"}}')
+        uploads.append((str(file_path), f"{dataset_name}/{name}.jsonl"))
+
+    assert len(gcs_repository.add_changed(uploads, prefix=dataset_name)) == 2
+    assert gcs_repository.add_changed(uploads, prefix=dataset_name) == {}
+
+    preferred_root.join("two.jsonl").write('{"NAME":"TWO"}')
+    assert list(gcs_repository.add_changed(uploads, prefix=dataset_name)) == [
+        f"{dataset_name}/two.jsonl"
+    ]
+    assert client.uploads == 3
+
+
+def test_last_known_state_from_index(dataset_name):
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    client.blobs[f"project/{dataset_name}/one.jsonl"] = '{"NAME":"one"}'
+    client.blobs[f"project/{dataset_name}/one.json"] = "[]"
+
+    state = gcs_repository.get_state(prefix=f"project/{dataset_name}/")
+
+    assert list(state) == [f"project.{dataset_name}.one"]
+    assert state[f"project.{dataset_name}.one"].payload_hash == (
+        repository_loader.make_crc32c('{"NAME":"one"}')
+    )
+
+
+def test_chunked_upload_only_sends_new_chunks(preferred_root, monkeypatch):
+    monkeypatch.setattr(
+        repository.chunking,
+        "split_chunks",
+        functools.partial(
+            chunking.split_chunks, min_size=1024, average_size=4096, max_size=16384
+        ),
+    )
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    rows = [f'{{"ID":{i}}}\n' for i in range(5000)]
+    payload = preferred_root.join("table.jsonl")
+
+    payload.write("".join(rows))
+    uris = gcs_repository.add_chunked(
+        str(payload), "project/dataset/table.manifest", "hash", len(rows)
+    )
+    uploads = client.uploads
+
+    payload.write("".join(rows[:2500] + ['{"ID":-1}\n'] + rows[2500:]))
+    gcs_repository.add_chunked(
+        str(payload), "project/dataset/table.manifest", "new hash", len(rows) + 1
+    )
+
+    assert len(uris) > 2
+    assert all(uri.startswith("gs://bucket/_chunks/project/dataset/") for uri in uris)
+    # the manifest and at most the two chunks around the edit
+    assert client.uploads - uploads <= 3
+    state = gcs_repository.get_state(prefix="project/dataset/")
+    assert state["project.dataset.table"].payload_hash == "new hash"
+
+
+def test_unreferenced_chunks_are_removed(preferred_root, monkeypatch):
+    monkeypatch.setattr(
+        repository.chunking,
+        "split_chunks",
+        functools.partial(
+            chunking.split_chunks, min_size=64, average_size=128, max_size=512
+        ),
+    )
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    rows = [f'{{"ID":{i}}}\n' for i in range(100)]
+    payload = preferred_root.join("table.jsonl")
+    payload.write("".join(rows))
+    gcs_repository.add_chunked(
+        str(payload), "project/dataset/table.manifest", "hash", len(rows)
+    )
+    payload.write("".join(rows[:50] + ['{"ID":-1}\n'] + rows[50:]))
+    uris = gcs_repository.add_chunked(
+        str(payload), "project/dataset/table.manifest", "new hash", len(rows) + 1
+    )
+
+    removed = gcs_repository.remove_unreferenced_chunks("project/dataset/")
+
+    assert removed
+    assert sorted(
+        f"gs://bucket/{name}" for name in client.blobs if name.startswith("_chunks/")
+    ) == sorted(set(uris))
+    state = gcs_repository.get_state(prefix="project/dataset/")
+    assert len(list(state["project.dataset.table"].payload)) == len(rows) + 1
+
+    gcs_repository.remove("project/dataset/table.manifest")
+    gcs_repository.remove_unreferenced_chunks("project/dataset/")
+
+    assert not [name for name in client.blobs if name.startswith("_chunks/")]
+
+
+def test_last_known_payload_is_streamed_on_demand(preferred_root, monkeypatch):
+    monkeypatch.setattr(
+        repository.chunking,
+        "split_chunks",
+        functools.partial(
+            chunking.split_chunks, min_size=64, average_size=128, max_size=512
+        ),
+    )
+    # ranges that end mid row
+    monkeypatch.setattr(repository, "DOWNLOAD_RANGE_SIZE", 50)
+    client = FakeStorageClient()
+    gcs_repository = repository.GoogleCloudStorageGridRepository(
+        bucket_name="bucket", client=client
+    )
+    rows = [{"ID": i} for i in range(100)]
+    payload = preferred_root.join("chunked.jsonl")
+    payload.write("".join(f'{{"ID": {row["ID"]}}}\n' for row in rows))
+    gcs_repository.add_chunked(
+        str(payload), "project/dataset/chunked.manifest", "hash", len(rows)
+    )
+    gcs_repository.add(str(payload), "project/dataset/plain.jsonl")
+
+    downloads = client.downloads
+    state = gcs_repository.get_state(prefix="project/dataset/")
+
+    assert client.downloads == downloads
+    assert list(state["project.dataset.plain"].payload) == rows
+    assert list(state["project.dataset.chunked"].payload) == rows
+
+
 def test_adding_table(
     preferred_root, project_id, dataset_id, bucket_name, dataset_name, table_name
 ):
@@ -220,6 +579,85 @@ def test_adding_table(
     )
 
 
+def test_updating_table_metadata():
+    client = FakeBigqueryClient()
+    bq_repository = repository.BigqueryGridRepository(
+        billing_project="project", client=client
+    )
+
+    bq_repository.update(
+        grid_id="project.dataset.table",
+        description="new description",
+        labels={"kept": "new value"},
+        previous_labels={"kept": "old value", "dropped": "old value"},
+    )
+
+    table, fields = client.updates[0]
+    assert fields == ["description", "labels"]
+    assert table.description == "new description"
+    assert table.labels == {"kept": "new value", "dropped": None}
+
+
+def test_adding_many_tables():
+    client = FakeBigqueryClient(job_polls=3)
+    bq_repository = repository.BigqueryGridRepository(
+        billing_project="project", client=client
+    )
+    grids = [
+        (f"project.dataset.table_{i}", [], None, f"gs://bucket/table_{i}.jsonl")
+        for i in range(10)
+    ]
+    grids.append(("project.dataset.broken", [], None, "gs://bucket/broken.jsonl"))
+
+    results = bq_repository.add_many(grids, max_in_flight=4, poll_interval=0)
+
+    assert len(client.tables) == 11
+    assert client.peak == 4
+    assert client.running == 0
+    assert [grid_id for grid_id, error in results.items() if error] == [
+        "project.dataset.broken"
+    ]
+
+
+def test_current_state_snapshot():
+    client = FakeBigqueryClient()
+    table = bigquery.Table(
+        "project.dataset.table",
+        schema=[bigquery.SchemaField("ID", "INTEGER", mode="REQUIRED")],
+    )
+    table._properties.update({"type": "TABLE", "numRows": "3"})
+    table.description = "description"
+    table.labels = {"label": "value"}
+    view = bigquery.Table("project.dataset.view")
+    view._properties["type"] = "VIEW"
+    view.view_query = "select 1"
+    client.existing = {
+        "project.dataset.table": table,
+        "project.dataset.view": view,
+    }
+    bq_repository = repository.BigqueryGridRepository(
+        billing_project="project", client=client
+    )
+
+    state = bq_repository.get_state("project.dataset")
+    assert (
+        bq_repository.lookup("project.dataset.table") is state["project.dataset.table"]
+    )
+    assert client.calls == ["list_tables", "get_table", "get_table"]
+
+    current_table = state["project.dataset.table"]
+    assert isinstance(current_table, model.Table)
+    assert current_table.rows == 3
+    assert current_table.description == "description"
+    assert current_table.labels == {"label": "value"}
+    assert current_table.schema[0]["name"] == "ID"
+    assert isinstance(state["project.dataset.view"], model.View)
+    assert state["project.dataset.view"].query == "select 1"
+
+    bq_repository.remove("project.dataset.view")
+    assert list(bq_repository.get_state("project.dataset")) == ["project.dataset.table"]
+
+
 def test_getting_table():
     pass
 
@@ -0,0 +1,117 @@
+from synchronisation.adapters import repository_loader
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT = '{"STATIC_ID":1}\n{"STATIC_ID":2}\n{"STATIC_ID":3}'
+
+
+def test_file_crc32c_matches_in_memory_crc32c(tmpdir):
+    file_path = tmpdir.join("static.jsonl")
+    file_path.write(CONTENT)
+
+    payload_hash, rows = repository_loader.make_file_crc32c(str(file_path))
+
+    assert payload_hash == repository_loader.make_crc32c(CONTENT)
+    assert rows == len(CONTENT.splitlines())
+
+
+def test_file_crc32c_is_independent_of_chunk_size(tmpdir):
+    file_path = tmpdir.join("static.jsonl")
+    file_path.write(f"{CONTENT}\n")
+
+    assert repository_loader.make_file_crc32c(
+        str(file_path), chunk_size=4
+    ) == repository_loader.make_file_crc32c(str(file_path))
+    assert repository_loader.make_file_crc32c(str(file_path), chunk_size=4)[1] == 3
+
+
+def test_empty_file_has_no_rows(tmpdir):
+    file_path = tmpdir.join("empty.jsonl")
+    file_path.write("")
+
+    assert repository_loader.make_file_crc32c(str(file_path)) == ("AAAAAA==", 0)
+
+
+def test_scanning_projects(tmpdir):
+    dataset = tmpdir.mkdir("project_1").mkdir("dataset_1")
+    dataset.join("table_1.json").write("[]")
+    dataset.join("table_1.jsonl").write(CONTENT)
+    dataset.join("view_1.sql").write(
+        "\n  CREATE VIEW `project_1.dataset_1.view_1` as select 1"
+    )
+    dataset.join("mview_1.sql").write(
+        "create or replace materialized view `project_1.dataset_1.mview_1` as select 1"
+    )
+    dataset.join("unknown.sql").write("select 1")
+    tmpdir.mkdir("project_2").mkdir("dataset_2").join("table_2.jsonl").write(CONTENT)
+
+    assert repository_loader.scan_projects(str(tmpdir)) == {
+        "project_1": {
+            "dataset_1": {
+                "table_1": "table",
+                "view_1": "view",
+                "mview_1": "materialised_view",
+            }
+        },
+        "project_2": {"dataset_2": {"table_2": "table"}},
+    }
+
+
+def test_view_query_and_references():
+    sql = """-- reads from `project_1.dataset_1.ignored`
+    create or replace materialized view `project_1.dataset_1.view`
+    options (enable_refresh = true) as
+    with recent as (select * from `project_1.dataset_1.table_1`)
+    select * from recent, unnest(recent.items)
+    left join dataset_2.table_2 as t using (id)
+    where id in (select id from `project_2`.`dataset_2`.`table_3`);
+    """
+
+    query = repository_loader.get_view_query(sql)
+
+    assert query.startswith("with recent as") and query.endswith("`table_3`)")
+    assert repository_loader.get_references(query, "project_1") == {
+        "project_1.dataset_1.table_1",
+        "project_1.dataset_2.table_2",
+        "project_2.dataset_2.table_3",
+    }
+
+
+def test_materialised_view_options():
+    sql = """create materialized view `p.d.v`
+    options (
+        enable_refresh = false,
+        refresh_interval_minutes = 60,
+        description = "a, b (c)"
+    ) as select 1"""
+
+    options = repository_loader.get_view_options(sql)
+
+    assert options == {
+        "enable_refresh": "false",
+        "refresh_interval_minutes": "60",
+        "description": '"a, b (c)"',
+    }
+    assert repository_loader.get_refresh_options(options) == {
+        "refresh_enabled": False,
+        "refresh_interval": 3600000,
+    }
+    assert repository_loader.get_view_options("create view v as select 1") == {}
+
+
+def test_reformatted_query_has_the_same_fingerprint():
+    query = "select a.id, count(*) from `p.d.t` a where a.name = 'Select  x' group by 1"
+    reformatted = """CREATE OR REPLACE VIEW p.d.v AS
+    -- counts per id
+    SELECT a.id, COUNT(*)
+    FROM p.d.t a
+    WHERE a.name = 'Select  x'  /* kept */
+    GROUP BY 1;"""
+
+    assert repository_loader.make_query_fingerprint(
+        query
+    ) == repository_loader.make_query_fingerprint(reformatted)
+    assert repository_loader.make_query_fingerprint(
+        query
+    ) != repository_loader.make_query_fingerprint(query.replace("Select  x", "x"))
@@ -0,0 +1,111 @@
+from synchronisation.adapters import row_delta
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+OLD_ROWS = [
+    '{"ID":1, "NAME":"ONE"}',
+    '{"ID":2, "NAME":"TWO"}',
+    '{"ID":3, "NAME":"THREE"}',
+]
+
+
+def write_rows(file_path, rows):
+    file_path.write("\n".join(rows) + "\n")
+    return str(file_path)
+
+
+def test_keyed_delta(tmpdir):
+    old_file = write_rows(tmpdir.join("old.jsonl"), OLD_ROWS)
+    new_file = write_rows(
+        tmpdir.join("new.jsonl"),
+        ['{"ID":1, "NAME":"ONE"}', '{"ID":2, "NAME":"2"}', '{"ID":4, "NAME":"FOUR"}'],
+    )
+    delta_file = str(tmpdir.join("delta.jsonl"))
+
+    delta = row_delta.diff_row_snapshots(
+        row_delta.make_row_snapshot(old_file, ["ID"]),
+        row_delta.make_row_snapshot(new_file, ["ID"]),
+        ["ID"],
+    )
+    rows = row_delta.write_row_delta(new_file, delta_file, delta, ["ID"])
+
+    with open(delta_file) as f:
+        written = [json.loads(line) for line in f]
+    assert rows == 3
+    assert written == [
+        {"ID": 2, "NAME": "2"},
+        {"ID": 4, "NAME": "FOUR"},
+        {"ID": 3, row_delta.DELETED_COLUMN: True},
+    ]
+
+
+def test_keyless_append_only_delta(tmpdir):
+    old_file = write_rows(tmpdir.join("old.jsonl"), OLD_ROWS)
+    new_file = write_rows(tmpdir.join("new.jsonl"), OLD_ROWS + [OLD_ROWS[0]])
+    delta_file = str(tmpdir.join("delta.jsonl"))
+
+    delta = row_delta.diff_row_snapshots(
+        row_delta.make_row_snapshot(old_file, []),
+        row_delta.make_row_snapshot(new_file, []),
+        [],
+    )
+    row_delta.write_row_delta(new_file, delta_file, delta, [])
+
+    assert delta.rows == 1
+    with open(delta_file) as f:
+        assert f.read() == f"{OLD_ROWS[0]}\n"
+
+
+def test_keyless_changed_rows_cant_be_diffed(tmpdir):
+    old_file = write_rows(tmpdir.join("old.jsonl"), OLD_ROWS)
+    new_file = write_rows(tmpdir.join("new.jsonl"), OLD_ROWS[1:])
+
+    assert (
+        row_delta.diff_row_snapshots(
+            row_delta.make_row_snapshot(old_file, []),
+            row_delta.make_row_snapshot(new_file, []),
+            [],
+        )
+        is None
+    )
+
+
+def test_keyed_rows_with_a_repeated_key_cant_be_diffed(tmpdir):
+    old_file = write_rows(tmpdir.join("old.jsonl"), OLD_ROWS)
+    new_file = write_rows(
+        tmpdir.join("new.jsonl"), OLD_ROWS + ['{"ID":1, "NAME":"UNO"}']
+    )
+    snapshot_file = str(tmpdir.join("new.rowhashes"))
+    row_delta.write_row_snapshot(
+        row_delta.make_row_snapshot(new_file, ["ID"]), snapshot_file
+    )
+
+    for old, new in [(old_file, new_file), (new_file, old_file)]:
+        assert (
+            row_delta.diff_row_snapshots(
+                row_delta.make_row_snapshot(old, ["ID"]),
+                row_delta.make_row_snapshot(new, ["ID"]),
+                ["ID"],
+            )
+            is None
+        )
+    assert (
+        row_delta.diff_row_snapshots(
+            row_delta.read_row_snapshot(snapshot_file),
+            row_delta.make_row_snapshot(old_file, ["ID"]),
+            ["ID"],
+        )
+        is None
+    )
+
+
+def test_snapshot_round_trip(tmpdir):
+    rows_file = write_rows(tmpdir.join("rows.jsonl"), OLD_ROWS)
+    snapshot_file = str(tmpdir.join("rows.rowhashes"))
+    snapshot = row_delta.make_row_snapshot(rows_file, ["ID"])
+
+    row_delta.write_row_snapshot(snapshot, snapshot_file)
+
+    assert row_delta.read_row_snapshot(snapshot_file) == snapshot
@@ -0,0 +1,92 @@
+from synchronisation.adapters import row_validator
+from synchronisation.domain import model
+import logging
+import table_loader.tests.unit.variables as tuv
+
+logger = logging.getLogger(__name__)
+
+
+def write_rows(file_path, rows):
+    file_path.write("\n".join(rows) + "\n")
+    return str(file_path)
+
+
+def test_valid_rows_have_no_violations(tmpdir):
+    file_name = write_rows(
+        tmpdir.join("valid.jsonl"),
+        ['{"ID": 2, "NAME": "TWO"}', '{"ID": "3", "NAME": "THREE"}'],
+    )
+
+    assert row_validator.validate_file(file_name, tuv.FIELD_DEFINITIONS_2) == []
+
+
+def test_formatted_timestamps_are_valid(tmpdir):
+    field_definitions = model.get_field_definitions(
+        [
+            {"name": "ID", "type": "INTEGER", "mode": "required"},
+            {"name": "CREATED", "type": "TIMESTAMP"},
+        ]
+    )
+    file_name = write_rows(
+        tmpdir.join("timestamps.jsonl"),
+        [
+            '{"ID": 1, "CREATED": "2020-01-01 00:00:00 UTC"}',
+            '{"ID": 2, "CREATED": "2020-01-01T00:00:00Z"}',
+            '{"ID": 3, "CREATED": "2020-01-01T00:00:00.123456+01:00"}',
+            '{"ID": 4, "CREATED": "2020-01-01 00:00:00 Europe/London"}',
+            '{"ID": 5, "CREATED": 1577836800.5}',
+            '{"ID": 6, "CREATED": "yesterday"}',
+            '{"CREATED": "2020-01-01"}',
+        ],
+    )
+
+    violations = row_validator.validate_file(file_name, field_definitions)
+
+    assert [(violation.line, violation.field) for violation in violations] == [
+        (6, "CREATED"),
+        (7, "ID"),
+    ]
+
+
+def test_invalid_rows_are_reported_by_line(tmpdir):
+    file_name = write_rows(
+        tmpdir.join("invalid.jsonl"),
+        [
+            '{"ID": 2, "NAME": "TWO"}',
+            '{"ID": "two", "NAME": "TWO"}',
+            '{"NAME": "THREE"}',
+            '{"ID": 4, "NAME": "FOUR", "AGE": 4}',
+            "{not json",
+        ],
+    )
+
+    violations = row_validator.validate_file(file_name, tuv.FIELD_DEFINITIONS_2)
+
+    assert [(violation.line, violation.field) for violation in violations] == [
+        (2, "ID"),
+        (3, "ID"),
+        (4, "AGE"),
+        (5, ""),
+    ]
+
+
+def test_only_the_first_violations_are_reported(tmpdir):
+    rows = ['{"ID": "two"}'] * 1000
+    invalid = write_rows(tmpdir.join("invalid.jsonl"), rows)
+    valid = write_rows(tmpdir.join("valid.jsonl"), ['{"ID": 1}'])
+
+    violations = row_validator.validate_files(
+        {
+            "project.dataset.invalid": (invalid, tuv.FIELD_DEFINITIONS_1),
+            "project.dataset.valid": (valid, tuv.FIELD_DEFINITIONS_1),
+        },
+        max_workers=2,
+        max_violations=3,
+    )
+
+    assert list(violations) == ["project.dataset.invalid"]
+    assert [violation.line for violation in violations["project.dataset.invalid"]] == [
+        1,
+        2,
+        3,
+    ]
@@ -0,0 +1,61 @@
+from synchronisation.service_layer import scheduler
+import collections
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def test_every_unit_is_synchronised():
+    units = [(f"project_{p}", f"dataset_{d}") for p in range(3) for d in range(5)]
+
+    report = scheduler.synchronise_all(
+        units=units, sync=lambda project, dataset: f"{project}.{dataset}"
+    )
+
+    assert report.succeeded
+    assert sorted(result.result for result in report.results) == sorted(
+        f"{project}.{dataset}" for project, dataset in units
+    )
+
+
+def test_project_concurrency_is_limited():
+    lock = threading.Lock()
+    running = collections.Counter()
+    peak = collections.Counter()
+
+    def sync(project, dataset):
+        with lock:
+            running[project] += 1
+            peak[project] = max(peak[project], running[project])
+        time.sleep(0.01)
+        with lock:
+            running[project] -= 1
+
+    units = [(f"project_{p}", f"dataset_{d}") for p in range(2) for d in range(10)]
+    report = scheduler.synchronise_all(
+        units=units, sync=sync, max_workers=8, max_workers_per_project=2
+    )
+
+    assert report.succeeded
+    assert max(peak.values()) == 2
+
+
+def test_errors_are_aggregated():
+    def sync(project, dataset):
+        if dataset == "broken":
+            raise ValueError(f"{project}.{dataset} is broken")
+        return dataset
+
+    report = scheduler.synchronise_all(
+        units=[("project", "broken"), ("project", "fine"), ("other", "broken")],
+        sync=sync,
+    )
+
+    assert not report.succeeded
+    assert sorted((r.project, r.dataset) for r in report.errors) == [
+        ("other", "broken"),
+        ("project", "broken"),
+    ]
+    assert [r.result for r in report.results if r.succeeded] == ["fine"]